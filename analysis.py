@@ -1,47 +1,116 @@
 import numpy as np
 import pandas as pd
 from sklearn.preprocessing import minmax_scale
-from datetime import datetime
-from openpyxl.styles import PatternFill
+from price_store import open_price_store
+from indicators import compute_state, INDICATOR_STATE_PATH
+from config import AnalysisConfig
+from feature_cache import FeatureCache, RETURN_STATS_PATH, content_hash, return_stats
+from db_candles import load_candles
+from excel_tracker import read_tracker, update_tracker, write_tracker, TRACKER_PATH
 
 np.random.seed(42)  # Для воспроизводимости результатов
 
 
+def score_signals(features, price, rsi, z, support, config):
+    """Баллы и сигналы покупки/продажи по индикаторам и фундаментальным баллам акций.
+
+    features - отобранные акции (Analysis.get_features()) в порядке последней оси массивов индикаторов:
+    это может быть вектор (последняя дата) или матрица даты × тикеры (бэктест). В бэктесте features - словарь
+    массивов: баллы пересчитываются на каждую дату по акциям, прошедшим фильтры на ту дату.
+    Возвращает (score, buy, sell).
+    """
+    cfg = config
+    # Начисляем баллы каждой акции (порядок сложения как в поштучном расчёте)
+    score = np.zeros(np.broadcast(price, rsi, z, support).shape)
+
+    # 1. P/E (0–3), уже нормализован
+    score += np.asarray(features['P/E_score'])
+
+    # 2. ROE (0–3)
+    score += np.asarray(features['ROE_score'])
+
+    # 3. RSI (0–2)
+    rsi_1, rsi_2, rsi_3 = cfg.rsi_levels
+    score += np.select([rsi < rsi_1, rsi < rsi_2, rsi < rsi_3], [2.0, 1.5, 0.5], 0.0)
+
+    # 4. Z-Score (0–1)
+    z_1, z_2 = cfg.z_levels
+    score += np.select([z < z_1, z < z_2], [1.0, 0.5], 0.0)
+
+    # 5. Цена у поддержки (0–1)
+    score += np.where(price <= support * cfg.support_margin, 1.0, 0.0)
+
+    # 6. Дивиденды (0–0.5)
+    score += np.asarray(features['Div_score'])
+
+    # Сигналы (сравнения с NaN дают False, как и проверки pd.isna в поштучном расчёте)
+    buy = (score >= cfg.buy_score) & (rsi < cfg.buy_rsi) & \
+        (np.asarray(features['P/E_TTM']) < cfg.buy_pe) & (np.asarray(features['ROE']) > cfg.buy_roe)
+    sell = (rsi > cfg.sell_rsi) & (z > cfg.sell_z)
+    return score, buy, sell
+
+
 
 class Analysis():
-    def __init__(self):
+    def __init__(self, prices=None, fundamentals=None, config=None, cache=None):
+        # данные можно передать напрямую (например, синтетические для бенчмарка), иначе читаются с диска
+        # пороги фильтров, окна индикаторов и правила сигналов
+        self.config = config if config is not None else AnalysisConfig()
+        cfg = self.config
+        # состояние индикаторов сохраняется между запусками только для цен из хранилища
+        self.__state_path = None
+        self.__store = None
         try:
-            prices = pd.read_csv('candles.csv', index_col='Date', parse_dates=['Date'])
-            fundamentals = pd.read_csv('fundamentals.csv', index_col=0).T
+            # цены читаются из бинарного хранилища через memmap (при первом запуске импортируется candles.csv)
+            if prices is None:
+                self.__store = open_price_store()
+                prices = self.__store.read()
+                self.__state_path = INDICATOR_STATE_PATH
+            if fundamentals is None:
+                fundamentals = pd.read_csv('fundamentals.csv', index_col=0).T
         except FileNotFoundError:
             'Файлы не существуют, сначала используйте метод get_candles_and_fundamentals()'
         # Загрузка данных
         self.__prices = prices
         self.__fundamentals = fundamentals
-        # Вычисление процентного изменения цены на каждый день(вчера - сегодня) с удалением NaN
-        self.__returns = self.__prices.ffill().pct_change().dropna()
-        # Вычисление волатильности
-        self.__volatility = self.__returns.std()
-        # Объединение данных
-        self.__features = pd.DataFrame({
-                'Return': self.__returns.mean(),
-                'Volatility': self.__volatility
-        })
+        # кэш производных данных (по умолчанию - для данных с диска, как и состояние индикаторов):
+        # ключи - отпечатки истории каждого тикера, отчётности и настройки, при неизменных входных данных
+        # расчёт не повторяется. Доходность и волатильность дополняются новыми днями (return_stats)
+        self.__cache = cache if cache is not None else (FeatureCache() if self.__state_path else None)
+        self.__keys = {}
+        self.__stats = None
+        if self.__cache is not None:
+            self.__stats = return_stats(self.__prices, RETURN_STATS_PATH if self.__state_path else None, self.__store)
+            self.__keys['prices'] = content_hash('prices', self.__stats.tickers, self.__stats.digest)
+            self.__keys['features'] = content_hash('features', self.__keys['prices'], self.__fundamentals, cfg.filter_key())
+            self.__cleaned = self.__cache.get(self.__keys['features'])
+            if self.__cleaned is not None:
+                return
+        self.__select_stocks()
+        if self.__cache is not None:
+            self.__cache.put(self.__keys['features'], self.__cleaned)
+
+
+    def __select_stocks(self):
+        """Отбор акций по фильтрам и нормализация фундаментальных баллов"""
+        cfg = self.config
+        # Объединение данных: средняя доходность и волатильность по каждому тикеру
+        self.__features = self.__returns_stats()
         # Добавление финансовых показателей
         for col in self.__fundamentals.columns:
             self.__features[col] = self.__fundamentals[col].astype(float)
         # Удаляем строки с NaN
         self.__features.replace([np.inf, -np.inf], np.nan, inplace=True)
         self.__features.dropna(inplace=True)
-        # Фильтрация по условиям (именно тут убираем рисковые активы можете выставить показатели на своё усмотрение)
+        # Фильтрация по условиям (именно тут убираем рисковые активы, показатели задаются в AnalysisConfig)
         self.__cleaned = self.__features[
-            (self.__features['ROE'] >= 3) &
-            (self.__features['ROE'] < 50) &
-            (self.__features['P/E_TTM'] > 0.5) &
-            (self.__features['P/E_TTM'] < 30) &
-            (self.__features['Div_Yield'] >= 0) &
-            (self.__features['Div_Yield'] <= 15) &
-            (self.__features['Volatility'] < 0.4)
+            (self.__features['ROE'] >= cfg.roe_min) &
+            (self.__features['ROE'] < cfg.roe_max) &
+            (self.__features['P/E_TTM'] > cfg.pe_min) &
+            (self.__features['P/E_TTM'] < cfg.pe_max) &
+            (self.__features['Div_Yield'] >= cfg.div_min) &
+            (self.__features['Div_Yield'] <= cfg.div_max) &
+            (self.__features['Volatility'] < cfg.volatility_max)
         ]
         # Удаление выбросов по IQR
         self.__cleaned = self.__remove_outliers_iqr(self.__cleaned, 'ROE')
@@ -49,13 +118,13 @@ class Analysis():
         # убираем очень дешевые акции (можете убрать код до следующего комментария, если это для вас не принципиально)
         self.__cleaned = self.__cleaned[self.__cleaned.index.isin(self.__prices.columns)]
         price_last = self.__prices.loc[:, self.__cleaned.index].iloc[-1]
-        valid_tickers = price_last[price_last > 0.1].index
+        valid_tickers = price_last[price_last > cfg.min_price].index
         self.__cleaned = self.__cleaned[self.__cleaned.index.isin(valid_tickers)]
         # Подготовка данных для нормализации (подводим к понятным значениям для компьютера)
         norm_metrics = pd.DataFrame(index=self.__cleaned.index)
         norm_metrics['ROE'] = self.__cleaned['ROE']
         norm_metrics['P/E_TTM'] = self.__cleaned['P/E_TTM']
-        norm_metrics['Div_Yield'] = self.__cleaned['Div_Yield'].clip(0, 15)  # ограничение по дивидендам(в моём случае от 0% до 15%)
+        norm_metrics['Div_Yield'] = self.__cleaned['Div_Yield'].clip(cfg.div_min, cfg.div_max)  # ограничение по дивидендам
         # Нормализация: 0–100%, затем масштаб под max баллы
         norm_metrics['ROE_score'] = minmax_scale(norm_metrics['ROE'], feature_range=(0, 3))
         norm_metrics['Div_score'] = minmax_scale(norm_metrics['Div_Yield'], feature_range=(0, 0.5))
@@ -66,101 +135,95 @@ class Analysis():
         self.__cleaned = self.__cleaned.join(norm_metrics[['ROE_score', 'P/E_score', 'Div_score']])
 
 
+    def __returns_stats(self):
+        """Средняя доходность и волатильность тикеров (с кэшем - из накопленных сумм ReturnStats)"""
+        if self.__stats is not None:
+            return self.__stats.stats()
+        # Вычисление процентного изменения цены на каждый день(вчера - сегодня) с удалением NaN
+        filled = self.__prices.ffill()
+        values = filled.to_numpy(dtype=np.float64)
+        # строки, которые остаются после dropna() по доходностям всех тикеров (пропуск - нет цены или 0 -> 0)
+        nan_returns = np.isnan(values[1:]) | np.isnan(values[:-1]) | ((values[1:] == 0) & (values[:-1] == 0))
+        rows = np.concatenate([[False], ~nan_returns.any(axis=1)])
+        returns = filled.pct_change()[rows]
+        # Вычисление волатильности
+        return pd.DataFrame({'Return': returns.mean(), 'Volatility': returns.std()})
+
+
+    @classmethod
+    def from_db(cls, db, tickers=None, start=None, end=None, fundamentals=None, config=None):
+        """Анализ по ценам из таблицы candles за диапазон дат по набору тикеров"""
+        return cls(prices=load_candles(db, tickers, start, end), fundamentals=fundamentals, config=config)
+
+
     def recommendations(self):
-        """Основная функция анализа акций и создания рекомендаций"""
-        results = []
-
-        for stock in self.__cleaned.index:
-            data = self.__prices[stock].dropna()
-
-            # Проверка на минимальное количество данных(от 200 дней, игнорируем молодые акции)
-            if len(data) < 200:
-                continue
-
-            # Получение актуальной цены
-            current_price = data.iloc[-1]
-            # Вычисление RSI и Z-Score
-            rsi_val = self.__rsi(data).dropna()
-            z_val = self.__z_score(data).dropna()
-            calc_rsi = rsi_val.iloc[-1] if len(rsi_val) > 0 else np.nan
-            calc_z = z_val.iloc[-1] if len(z_val) > 0 else np.nan
-            # Вычисление линии поддержки и сопротивления
-            support, resistance = self.__support_resistance(data)
-            # Получение финансовых показателей
-            pe = self.__cleaned.loc[stock, 'P/E_TTM']
-            roe = self.__cleaned.loc[stock, 'ROE']
-            div_yield = self.__cleaned.loc[stock, 'Div_Yield']
-
-            # Начисляем баллы каждой акции
-            score = 0.0
-
-            # 1. P/E (0–3), уже нормализован
-            score += self.__cleaned.loc[stock, 'P/E_score']
-
-            # 2. ROE (0–3)
-            score += self.__cleaned.loc[stock, 'ROE_score']
-
-            # 3. RSI (0–2)
-            if not pd.isna(calc_rsi):
-                if calc_rsi < 30:
-                    score += 2.0
-                elif calc_rsi < 40:
-                    score += 1.5
-                elif calc_rsi < 50:
-                    score += 0.5
-
-            # 4. Z-Score (0–1)
-            if not pd.isna(calc_z):
-                if calc_z < -1:
-                    score += 1.0
-                elif calc_z < 0:
-                    score += 0.5
-
-            # 5. Цена у поддержки (0–1)
-            if current_price <= support * 1.05:
-                score += 1.0
-
-            # 6. Дивиденды (0–0.5)
-            score += self.__cleaned.loc[stock, 'Div_score']
-
-            # Сигналы
-            buy_signal = (score >= 6) and (not pd.isna(calc_rsi)) and (calc_rsi < 50) and (pe < 15) and (roe > 10)
-            sell_signal = (not pd.isna(calc_rsi)) and (calc_rsi > 70) and (not pd.isna(calc_z)) and (calc_z > 2)
-            signal = None
-            if buy_signal:
-                signal = 'buy'
-            elif sell_signal:
-                signal = 'sell'
-            else:
-                signal = 'hold'
-            # Цены для лучшей покупки и продажи
-            ideal_buy_price = max(support, current_price * 0.95, (support + current_price) / 2)
-            ideal_sell_price = min(resistance, current_price * 1.20)
-
-            # Формируем результат
-            results.append({
-                'Акция': stock,
-                'Актуальная цена': round(current_price, 2),
-                'Поддержка': round(support, 2),
-                'Сопротивление': round(resistance, 2),
-                'Покупать по': round(ideal_buy_price, 2),
-                'Продавать по': round(ideal_sell_price, 2),
-                'RSI': round(calc_rsi, 2) if not pd.isna(calc_rsi) else None,
-                'Z-Score': round(calc_z, 2) if not pd.isna(calc_z) else None,
-                'P/E': round(pe, 2),
-                'ROE': round(roe, 2),
-                'Div Yield': round(div_yield, 2),
-                'Сигнал': signal,
-                'Score': round(score, 2)
-            })
-
-        self.recommendations = pd.DataFrame(results)
+        """Основная функция анализа акций и создания рекомендаций (расчёт сразу по всем акциям)"""
+        cfg = self.config
+        # при тех же ценах, отобранных акциях и настройках результат берётся из кэша
+        key = None
+        if self.__cache is not None:
+            key = content_hash('recommendations', self.__keys['prices'], self.__keys['features'], cfg)
+            cached = self.__cache.get(key)
+            if cached is not None:
+                self.recommendations, self.buy_list, self.sell_list = cached
+                return
+        # Состояние индикаторов на последнюю дату: к сохранённому состоянию применяются только новые бары
+        state = compute_state(self.__prices, self.__state_path, cfg.rsi_window, cfg.z_window, cfg.sr_window,
+                              store=self.__store)
+        count = pd.Series(state.count, index=state.tickers)
+
+        # Проверка на минимальное количество данных(по умолчанию от 200 дней, игнорируем молодые акции)
+        stocks = self.__cleaned.index[count.reindex(self.__cleaned.index).to_numpy() >= cfg.min_history]
+        cleaned = self.__cleaned.loc[stocks]
+
+        # Получение актуальной цены
+        current_price = pd.Series(state.last_price, index=state.tickers)[stocks]
+        # Вычисление RSI и Z-Score (последние значения)
+        calc_rsi = state.rsi()[stocks]
+        calc_z = state.z_score()[stocks]
+        # Вычисление линии поддержки и сопротивления
+        support, resistance = state.support_resistance()
+        support, resistance = support[stocks], resistance[stocks]
+        # Получение финансовых показателей
+        pe = cleaned['P/E_TTM']
+        roe = cleaned['ROE']
+        div_yield = cleaned['Div_Yield']
+
+        # Баллы и сигналы по индикаторам на последнюю дату
+        score, buy_signal, sell_signal = score_signals(cleaned, current_price.to_numpy(), calc_rsi.to_numpy(),
+                                                       calc_z.to_numpy(), support.to_numpy(), cfg)
+        score = pd.Series(score, index=stocks)
+        signal = np.select([buy_signal, sell_signal], ['buy', 'sell'], 'hold')
+        # Цены для лучшей покупки и продажи
+        ideal_buy_price = np.maximum(np.maximum(support, current_price * cfg.buy_discount), (support + current_price) / 2)
+        ideal_sell_price = np.minimum(resistance, current_price * cfg.sell_premium)
+
+        # Формируем результат
+        results = pd.DataFrame({
+            'Акция': stocks,
+            'Актуальная цена': current_price.round(2).values,
+            'Поддержка': support.round(2).values,
+            'Сопротивление': resistance.round(2).values,
+            'Покупать по': ideal_buy_price.round(2).values,
+            'Продавать по': ideal_sell_price.round(2).values,
+            'RSI': calc_rsi.round(2).values,
+            'Z-Score': calc_z.round(2).values,
+            'P/E': pe.round(2).values,
+            'ROE': roe.round(2).values,
+            'Div Yield': div_yield.round(2).values,
+            'Сигнал': signal,
+            'Score': score.round(2).values
+        })
+
+        self.recommendations = results
         # генерируем список "к покупке"
         buy_list = self.recommendations[self.recommendations['Сигнал'] == 'buy'].copy()
         self.buy_list = buy_list.sort_values(by='Score', ascending=False)
         # генерируем список "к продаже"
         sell_list = self.recommendations[self.recommendations['Сигнал'] == 'sell'].copy()
         self.sell_list = sell_list.sort_values(by='RSI', ascending=False)
+        if key is not None:
+            self.__cache.put(key, (self.recommendations, self.buy_list, self.sell_list))
 
 
     def save_to_excel(self, buy_list, sell_list):
@@ -171,97 +234,21 @@ class Analysis():
             sell_list[['Акция', 'Актуальная цена']].assign(Сигнал='Продажа')
         ])
 
-        # чтение Exel файла
-        stock_tracker_0 = pd.read_excel('stock_tracker.xlsx', index_col='Акция', sheet_name=0, parse_dates=['Дата рекомендации', 'Дата'])
-        stock_tracker_1 = pd.read_excel('stock_tracker.xlsx', index_col='Акция', sheet_name=1)
-
-        # эта часть кода продолжает обновлять данные уже вписаных в ексель тикеро, даже если их сейчас нет в сигналах
-        for ticker in stock_tracker_0.index:
-            if ticker not in signals[['Акция']]:
-                stock_tracker_0.loc[ticker, 'Актуальная цена'] = self.__prices[ticker].iloc[-1]
-                stock_tracker_0.loc[ticker,'Изменение (%)'] = round((stock_tracker_0.loc[ticker, 'Актуальная цена'] - stock_tracker_0.loc[ticker, 'Начальная цена']) / stock_tracker_0.loc[ticker,'Начальная цена'] * 100, 2)
-
-        # обновление данных таблиц
-        for ticker, sign, price in signals[['Акция','Сигнал', 'Актуальная цена']].itertuples(index=False):
-            # если тикер уже в файле
-            if ticker in stock_tracker_0.index:
-                # при этом сигналы тикера совпадают с сигналом в файле:
-                if stock_tracker_0.loc[ticker, 'Сигнал'] == sign:
-                    # то обновляем поля "Дата", "Актуальная цена" и "Изменение (%)"
-                    stock_tracker_0.loc[ticker,'Дата'] = pd.Timestamp.now().normalize()
-                    stock_tracker_0.loc[ticker,'Актуальная цена'] = price
-                    stock_tracker_0.loc[ticker,'Изменение (%)'] = round((stock_tracker_0.loc[ticker, 'Актуальная цена'] - stock_tracker_0.loc[ticker, 'Начальная цена']) / stock_tracker_0.loc[ticker,'Начальная цена'] * 100, 2)
-                # если сигнал не совпадает то переносим данные в лист "Trade_history"
-                elif stock_tracker_0.loc[ticker, 'Сигнал'] != sign:
-                    # Задаём новые поля "Акция", "Сигнал", "Цена", "Результат(%)", "Кол-во дней"(сколько сигнал просуществовал не меняясь)
-                    new_stock = pd.DataFrame([{'Акция': ticker}]).set_index('Акция')
-                    new_stock['Сигнал'] = stock_tracker_0.loc[ticker, 'Сигнал']
-                    new_stock['Результат(%)'] = round((price - stock_tracker_0.loc[ticker, 'Начальная цена']) / stock_tracker_0.loc[ticker,'Начальная цена'] * 100, 2)
-                    new_stock['Кол-во дней'] = (datetime.now().date() - stock_tracker_0.loc[ticker, 'Дата рекомендации'].to_pydatetime().date()).days
-                    stock_tracker_1 = pd.concat([stock_tracker_1, new_stock])
-                    # удаляем тикер из листа "Recommendations"
-                    stock_tracker_0.drop(ticker, inplace=True)
-            # если тикера нет в файле:
-            else:
-                # добавляем поля "Акция", "Начальная цена", "Сигнал", "Дата рекомендации"
-                stock_tracker_0 = pd.concat([stock_tracker_0, pd.DataFrame([{'Акция': ticker}]).set_index('Акция')])
-                stock_tracker_0.loc[ticker, 'Начальная цена'] = price
-                stock_tracker_0.loc[ticker, 'Сигнал'] = sign
-                stock_tracker_0.loc[ticker, 'Дата рекомендации'] = pd.Timestamp.now().normalize()
-
-
-        # запись в Exel файл
-        with pd.ExcelWriter('stock_tracker.xlsx', engine='openpyxl', mode='w') as writer:
-            stock_tracker_0.to_excel(writer, index=True, sheet_name='Recommendations')
-            stock_tracker_1.to_excel(writer, index=True, sheet_name='Trade_History')
-
+        # чтение журнала (из кэша, если файл не менялся с прошлой записи)
+        stock_tracker_0, stock_tracker_1 = read_tracker(TRACKER_PATH)
 
-            ws0 = writer.sheets['Recommendations']
-
-            green_fill = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')  # Светло‑зелёный
-            red_fill = PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')    # Светло‑красный
-
-
-            def get_col_idx(worksheet, col_name):
-                for col in range(1, worksheet.max_column + 1):
-                    if worksheet.cell(row=1, column=col).value == col_name:
-                        return col
-                return None
-
-
-            col_signal = get_col_idx(ws0, 'Сигнал')
-            col_change = get_col_idx(ws0, 'Изменение (%)')
-
-            if col_signal and col_change:
-                for row in range(2, ws0.max_row + 1):  # пропускаем заголовок (строка 1)
-                    cell_signal = ws0.cell(row=row, column=col_signal)
-                    cell_change = ws0.cell(row=row, column=col_change)
-
-
-                    # Цвет для "Сигнал": зелёный если "Покупка", красный если "Продажа"
-                    if cell_signal.value == 'Покупка':
-                        cell_signal.fill = green_fill
-                    elif cell_signal.value == 'Продажа':
-                        cell_signal.fill = red_fill
-
-
-                    # Цвет для "Изменение (%)":
-                    change_val = cell_change.value
-                    if isinstance(change_val, (int, float)):
-                        if cell_signal.value == 'Покупка':
-                            if change_val >= 0:
-                                cell_change.fill = green_fill
-                            else:
-                                cell_change.fill = red_fill
-                        elif cell_signal.value == 'Продажа':
-                            if change_val < 0:
-                                cell_change.fill = green_fill
-                            else:
-                                cell_change.fill = red_fill
-
-            print('Запись в Excel файл успешно завершена')
+        # обновление данных таблиц одним векторным проходом
+        last_prices = self.__prices.iloc[-1] if len(self.__prices) else pd.Series(dtype=float)
+        new_tracker_0, new_tracker_1 = update_tracker(stock_tracker_0, stock_tracker_1, signals, last_prices)
 
+        # если ничего не изменилось - файл не перезаписываем
+        if new_tracker_0.equals(stock_tracker_0) and new_tracker_1.equals(stock_tracker_1):
+            print('Excel файл не требует обновления')
+            return
 
+        # запись в Exel файл
+        write_tracker(TRACKER_PATH, new_tracker_0, new_tracker_1)
+        print('Запись в Excel файл успешно завершена')
 
 
     def __remove_outliers_iqr(self, df, column):
@@ -269,36 +256,11 @@ class Analysis():
         Q1 = df[column].quantile(0.25)
         Q3 = df[column].quantile(0.75)
         IQR = Q3 - Q1
-        lower = Q1 - 1.5 * IQR
-        upper = Q3 + 1.5 * IQR
+        lower = Q1 - self.config.iqr_factor * IQR
+        upper = Q3 + self.config.iqr_factor * IQR
         return df[(df[column] >= lower) & (df[column] <= upper)]
 
 
-    def __rsi(self, series, window=14):
-        """Метод расчёта RSI"""
-        delta = series.diff()
-        gain = (delta.where(delta > 0, 0)).ewm(alpha=1/window, adjust=False).mean()
-        loss = (-delta.where(delta < 0, 0)).ewm(alpha=1/window, adjust=False).mean()
-        rs = gain / loss.replace(0, np.nan)
-        rsi = 100 - (100 / (1 + rs))
-        return rsi.fillna(100)
-
-
-    def __z_score(self, series, window=60):
-        """Метод расчета Z-Score"""
-        mean = series.rolling(window=window).mean()
-        std = series.rolling(window=window).std()
-        z = (series - mean) / std.replace(0, np.nan)
-        return z.fillna(0)
-
-
-    def __support_resistance(self, series, window=200):
-        """Метод расчета поддержки и сопротивления"""
-        support = series.rolling(window=window).min()
-        resistance = series.rolling(window=window).max()
-        return support.iloc[-1], resistance.iloc[-1]
-
-
     def get_recommendations(self):
         """Получение рекомендаций"""
         return self.recommendations
@@ -312,3 +274,18 @@ class Analysis():
     def get_sell_list(self):
         """Получение списка продаж"""
         return self.sell_list
+
+
+    def get_features(self):
+        """Получение отфильтрованных акций с баллами P/E, ROE и дивидендов"""
+        return self.__cleaned
+
+
+    def get_fundamentals(self):
+        """Получение финансовых показателей (тикеры × показатели)"""
+        return self.__fundamentals
+
+
+    def get_prices(self):
+        """Получение матрицы цен (даты × тикеры)"""
+        return self.__prices
@@ -0,0 +1,239 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from analysis import score_signals
+from config import AnalysisConfig
+
+
+class Backtest():
+    """Пошаговая (walk-forward) проверка правил Analysis (AnalysisConfig) на всей истории цен.
+
+    На каждую дату индикаторы и отбор акций считаются только по ценам до этой даты включительно, поэтому
+    заглядывания в будущее по ценам нет: волатильность - по доходностям тикера до даты, фильтр дешёвых акций -
+    по цене на дату, выбросы IQR и нормализация баллов - по акциям, прошедшим фильтры на эту дату.
+    Волатильность считается по собственной истории тикера, а не по общим для всех тикеров дням, как в Analysis:
+    общие дни зависят от будущих размещений. Поэтому на последней дате отбор может немного отличаться от Analysis.
+    Фундаментальные показатели берутся из текущего среза отчётностей (истории отчётностей нет) - это
+    единственная часть, известная не на дату сигнала.
+    Сигнал держится до противоположного сигнала - так же, как в таблицах signals/history.
+    """
+    def __init__(self, prices, fundamentals):
+        # fundamentals - финансовые показатели (тикеры × показатели), как в Analysis: тикеры с пропусками не участвуют
+        fundamentals = fundamentals.astype(float).replace([np.inf, -np.inf], np.nan).dropna()
+        tickers = fundamentals.index[fundamentals.index.isin(prices.columns)]
+        self.fundamentals = fundamentals.loc[tickers]
+        self.prices = prices[tickers]
+        self.dates = self.prices.index
+        values = self.prices.to_numpy(dtype=np.float64)
+        self._observed = ~np.isnan(values)
+        # цены с переносом последнего значения (для входа/выхода по сделкам и дневной доходности)
+        self._filled = self.prices.ffill().to_numpy(dtype=np.float64)
+        # номер наблюдения каждой цены в истории своего тикера
+        self._history = np.cumsum(self._observed, axis=0)
+        self._indicators = {}
+        self._volatility = None
+        # отбор акций последнего варианта настроек отбора (перебор идёт порциями с одинаковым отбором)
+        self._universe = (None, None)
+
+
+    @classmethod
+    def from_analysis(cls, analysis):
+        """Проверка на ценах и отчётностях готового Analysis"""
+        return cls(analysis.get_prices(), analysis.get_fundamentals())
+
+
+    def volatility(self):
+        """Волатильность дневных доходностей каждого тикера по его истории до даты включительно (даты × тикеры)"""
+        if self._volatility is None:
+            aligned, rows, cols = self._align_right()
+            returns = aligned.pct_change(fill_method=None).replace([np.inf, -np.inf], np.nan)
+            self._volatility = self._scatter(returns.expanding().std(), rows, cols)
+        return self._volatility
+
+
+    def universe(self, config=None):
+        """Отбор акций на каждую дату по правилам Analysis: маска (даты × тикеры) и нормализованные баллы
+        ROE_score, P/E_score, Div_score (NaN вне отбора). Кэшируется последний ключ настроек отбора"""
+        cfg = config if config is not None else AnalysisConfig()
+        key = cfg.filter_key()
+        if self._universe[0] == key:
+            return self._universe[1]
+        roe = self.fundamentals['ROE'].to_numpy()
+        pe = self.fundamentals['P/E_TTM'].to_numpy()
+        div = self.fundamentals['Div_Yield'].to_numpy()
+        fundamental = (roe >= cfg.roe_min) & (roe < cfg.roe_max) & (pe > cfg.pe_min) & (pe < cfg.pe_max) & \
+            (div >= cfg.div_min) & (div <= cfg.div_max)
+        with np.errstate(invalid='ignore'):
+            mask = fundamental & (self.volatility() < cfg.volatility_max)
+        # выбросы по IQR, затем дешёвые акции (порядок как в Analysis)
+        mask = self._remove_outliers_iqr(mask, roe, cfg.iqr_factor)
+        mask = self._remove_outliers_iqr(mask, pe, cfg.iqr_factor)
+        with np.errstate(invalid='ignore'):
+            mask &= self._filled > cfg.min_price
+        universe = {
+            'mask': mask,
+            'ROE_score': self._minmax_scale(mask, roe, 3),
+            'Div_score': self._minmax_scale(mask, np.clip(div, cfg.div_min, cfg.div_max), 0.5),
+            # P/E: чем ниже, тем лучше → инвертируем
+            'P/E_score': 3 - self._minmax_scale(mask, pe, 3),
+        }
+        self._universe = (key, universe)
+        return universe
+
+
+    def indicators(self, rsi_window=14, z_window=60, sr_window=200):
+        """RSI, Z-Score, поддержка и сопротивление на каждую дату (даты × тикеры), кэшируются по окнам"""
+        key = (rsi_window, z_window, sr_window)
+        if key not in self._indicators:
+            aligned, rows, cols = self._align_right()
+            delta = aligned.diff()
+            gain = (delta.where(delta > 0, 0)).ewm(alpha=1/rsi_window, adjust=False).mean()
+            loss = (-delta.where(delta < 0, 0)).ewm(alpha=1/rsi_window, adjust=False).mean()
+            rsi = (100 - (100 / (1 + gain / loss.replace(0, np.nan)))).fillna(100)
+            mean = aligned.rolling(window=z_window).mean()
+            std = aligned.rolling(window=z_window).std()
+            z = ((aligned - mean) / std.replace(0, np.nan)).fillna(0)
+            support = aligned.rolling(window=sr_window).min()
+            resistance = aligned.rolling(window=sr_window).max()
+            self._indicators[key] = {name: self._scatter(frame, rows, cols) for name, frame in
+                                     (('rsi', rsi), ('z', z), ('support', support), ('resistance', resistance))}
+        return self._indicators[key]
+
+
+    def signals(self, config=None):
+        """Матрица сигналов (даты × тикеры): 1 - покупка, -1 - продажа, 0 - держать / нет торгов"""
+        cfg = config if config is not None else AnalysisConfig()
+        ind = self.indicators(cfg.rsi_window, cfg.z_window, cfg.sr_window)
+        universe = self.universe(cfg)
+        price = np.where(self._observed, self._filled, np.nan)
+        features = {**universe, 'P/E_TTM': self.fundamentals['P/E_TTM'].to_numpy(),
+                    'ROE': self.fundamentals['ROE'].to_numpy()}
+        score, buy, sell = score_signals(features, price, ind['rsi'], ind['z'], ind['support'], cfg)
+        active = self._observed & (self._history >= cfg.min_history) & universe['mask']
+        buy &= active
+        sell &= active
+        return np.select([buy, sell], [1, -1], 0).astype(np.int8)
+
+
+    def trades(self, signals):
+        """Сделки: сигнал открывается при смене направления и закрывается противоположным сигналом
+        (незакрытые оцениваются по последней цене)"""
+        position = pd.DataFrame(np.where(signals != 0, signals, np.nan)).ffill().to_numpy()
+        previous = np.vstack([np.full((1, position.shape[1]), np.nan), position[:-1]])
+        starts = ~np.isnan(position) & (position != previous)
+
+        # сортировка по тикеру, затем по дате: конец сделки - начало следующей по тому же тикеру
+        col, row = np.nonzero(starts.T)
+        last = np.append(col[1:] != col[:-1], True)
+        end = np.where(last, len(self.dates) - 1, np.append(row[1:], 0))
+        direction = position[row, col]
+        start_price = self._filled[row, col]
+        end_price = self._filled[end, col]
+        return pd.DataFrame({
+            'ticker': self.prices.columns[col],
+            'signal': np.where(direction > 0, 'buy', 'sell'),
+            'start_date': self.dates[row],
+            'end_date': self.dates[end],
+            'start_price': start_price,
+            'end_price': end_price,
+            'return': direction * (end_price / start_price - 1),
+            'days': (self.dates[end] - self.dates[row]).days,
+            'open': last,
+        })
+
+
+    def evaluate(self, config=None):
+        """Полный прогон варианта настроек: сигналы, сделки, показатели по тикерам и сводка"""
+        signals = self.signals(config)
+        trades = self.trades(signals)
+        strategy = self.strategy_returns(signals)
+
+        closed = trades[~trades['open']]
+        per_ticker = closed.groupby('ticker').agg(
+            trades=('return', 'size'),
+            hit_rate=('return', lambda r: (r > 0).mean()),
+            avg_return=('return', 'mean'),
+            avg_days=('days', 'mean'),
+        ).reindex(self.prices.columns)
+        per_ticker['strategy_return'] = strategy
+        summary = self._summary(closed, strategy, config)
+        return {'signals': pd.DataFrame(signals, index=self.dates, columns=self.prices.columns),
+                'trades': trades, 'per_ticker': per_ticker, 'summary': summary}
+
+
+    def summary(self, config=None):
+        """Сводные показатели варианта настроек (без построения таблиц - для перебора)"""
+        signals = self.signals(config)
+        trades = self.trades(signals)
+        return self._summary(trades[~trades['open']], self.strategy_returns(signals), config)
+
+
+    def strategy_returns(self, signals):
+        """Доходность следования сигналам по каждому тикеру: позиция на закрытии вчера × изменение цены сегодня"""
+        position = pd.DataFrame(np.where(signals != 0, signals, np.nan)).ffill().fillna(0).to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = np.nan_to_num(np.diff(self._filled, axis=0) / self._filled[:-1])
+        return np.prod(1 + position[:-1] * returns, axis=0) - 1
+
+
+    def _summary(self, closed, strategy, config):
+        # средняя доходность стратегии - по тикерам, которые хотя бы раз проходили отбор
+        selected = self.universe(config)['mask'].any(axis=0)
+        strategy = strategy[selected]
+        returns = closed['return']
+        return {
+            'tickers': int(selected.sum()),
+            'trades': len(closed),
+            'buy_trades': int((closed['signal'] == 'buy').sum()),
+            'sell_trades': int((closed['signal'] == 'sell').sum()),
+            'hit_rate': (returns > 0).mean() if len(closed) else np.nan,
+            'avg_return': returns.mean() if len(closed) else np.nan,
+            'avg_days': closed['days'].mean() if len(closed) else np.nan,
+            'strategy_return': float(np.mean(strategy)) if len(strategy) else np.nan,
+        }
+
+
+    @staticmethod
+    def _remove_outliers_iqr(mask, values, factor):
+        """Удаление выбросов по IQR на каждую дату среди акций маски (квартили как в pandas quantile)"""
+        masked = np.where(mask, values, np.nan)
+        with warnings.catch_warnings():
+            # даты без акций в отборе - квартили NaN, маска остаётся пустой
+            warnings.simplefilter('ignore', RuntimeWarning)
+            q1, q3 = np.nanquantile(masked, [0.25, 0.75], axis=1, keepdims=True)
+        iqr = q3 - q1
+        return mask & (masked >= q1 - factor * iqr) & (masked <= q3 + factor * iqr)
+
+
+    @staticmethod
+    def _minmax_scale(mask, values, high):
+        """Масштабирование в [0, high] на каждую дату среди акций маски (как sklearn minmax_scale)"""
+        masked = np.where(mask, values, np.nan)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            low, top = np.nanmin(masked, axis=1, keepdims=True), np.nanmax(masked, axis=1, keepdims=True)
+        spread = top - low
+        # одинаковые значения масштабируются в 0, как в sklearn
+        spread[spread == 0] = 1
+        return (masked - low) / spread * high
+
+
+    def _align_right(self):
+        """Значения каждого тикера без пропусков, выровненные по последней строке (аналог dropna() по тикеру)"""
+        values = self.prices.to_numpy(dtype=np.float64)
+        rank = np.cumsum(self._observed, axis=0) - 1
+        rows = len(values) - self._observed.sum(axis=0) + rank
+        cols = np.broadcast_to(np.arange(values.shape[1]), values.shape)
+        aligned = np.full(values.shape, np.nan)
+        aligned[rows[self._observed], cols[self._observed]] = values[self._observed]
+        return pd.DataFrame(aligned), rows, cols
+
+
+    def _scatter(self, frame, rows, cols):
+        """Возврат значений из выровненной матрицы на исходные даты"""
+        result = np.full(frame.shape, np.nan)
+        values = frame.to_numpy()
+        result[self._observed] = values[rows[self._observed], cols[self._observed]]
+        return result
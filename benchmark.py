@@ -0,0 +1,273 @@
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from analysis import Analysis
+from excel_tracker import TRACKER_PATH, read_tracker, write_tracker
+from price_store import PRICE_STORE_DIR, PriceStore
+from profiling import PipelineProfiler
+
+
+# результаты прогонов копятся в JSON Lines (строка - один прогон), чтобы сравнивать коммиты
+BENCH_RESULTS_PATH = 'benchmark_results.jsonl'
+# схема PostgreSQL для бенчмарка db_update: пересоздаётся на каждый прогон, рабочие таблицы не затрагиваются
+BENCH_SCHEMA = 'benchmark'
+# таблицы как в db_visual.ipynb
+BENCH_DDL = """
+CREATE TABLE tickers (
+           name VARCHAR(10) PRIMARY KEY);
+CREATE TABLE signals (
+           ticker_name VARCHAR REFERENCES tickers(name),
+           start_date DATE NOT NULL,
+           signal VARCHAR(10) NOT NULL,
+           start_price FLOAT NOT NULL,
+           price_now FLOAT NOT NULL,
+           score FLOAT NOT NULL);
+CREATE TABLE history (
+           ticker_name VARCHAR REFERENCES tickers(name),
+           signal VARCHAR(10) NOT NULL,
+           start_date DATE NOT NULL,
+           end_date DATE NOT NULL,
+           start_price FLOAT NOT NULL,
+           end_price FLOAT NOT NULL,
+           delta FLOAT NOT NULL);
+CREATE TABLE recommendations (
+           name VARCHAR REFERENCES tickers(name),
+           start_price FLOAT NOT NULL,
+           support_line FLOAT NOT NULL,
+           resistance_line FLOAT NOT NULL,
+           buy_by FLOAT NOT NULL,
+           sell_by FLOAT NOT NULL,
+           RSI FLOAT NOT NULL,
+           Z_Score FLOAT NOT NULL,
+           P_E FLOAT NOT NULL,
+           ROE FLOAT NOT NULL,
+           div_yield FLOAT NOT NULL,
+           signal VARCHAR(10) NOT NULL,
+           score FLOAT NOT NULL);
+"""
+
+
+def make_prices(n_tickers, years=3, seed=42, young_share=0.1, gap_share=0.01):
+    """Синтетическая матрица цен (даты × тикеры): случайное блуждание, молодые акции и пропуски торгов"""
+    rng = np.random.default_rng(seed)
+    n_days = int(252 * years)
+    dates = pd.bdate_range(end=pd.Timestamp.now().normalize(), periods=n_days, name='Date')
+    start = rng.uniform(1, 5000, n_tickers)
+    steps = rng.normal(0.0003, 0.02, (n_days, n_tickers))
+    prices = np.round(start * np.exp(np.cumsum(steps, axis=0)), 2)
+    # молодые акции - история начинается не с первой даты (но не позже середины периода)
+    young = rng.random(n_tickers) < young_share
+    listing = rng.integers(0, n_days // 2, n_tickers)
+    prices[np.arange(n_days)[:, None] < np.where(young, listing, 0)] = np.nan
+    # случайные дни без торгов
+    prices[rng.random((n_days, n_tickers)) < gap_share] = np.nan
+    return pd.DataFrame(prices, index=dates, columns=[f'T{i:05d}' for i in range(n_tickers)])
+
+
+def make_fundamentals(tickers, seed=42):
+    """Синтетические фундаментальные показатели (тикеры × показатели), как fundamentals.csv после .T"""
+    rng = np.random.default_rng(seed)
+    n = len(tickers)
+    return pd.DataFrame({
+        'P/E_TTM': rng.uniform(-5, 40, n).round(2),
+        'P/B_TTM': rng.uniform(0.2, 5, n).round(2),
+        'ROE': rng.uniform(-20, 60, n).round(2),
+        'Revenue_Growth_YOY': rng.normal(5, 15, n).round(2),
+        'Div_Yield': rng.uniform(0, 18, n).round(2),
+        'Debt_To_Equity': rng.uniform(0, 300, n).round(2),
+        'Beta': rng.uniform(0.2, 1.8, n).round(2),
+        'FCF_Yield': rng.normal(5, 20, n).round(2),
+    }, index=tickers)
+
+
+def loop_indicators(prices, tickers):
+    """Поштучный расчёт индикаторов (прежняя реализация Analysis.recommendations) - эталон для сравнения"""
+    rows = {}
+    for stock in tickers:
+        data = prices[stock].dropna()
+        if len(data) < 200:
+            continue
+        delta = data.diff()
+        gain = (delta.where(delta > 0, 0)).ewm(alpha=1/14, adjust=False).mean()
+        loss = (-delta.where(delta < 0, 0)).ewm(alpha=1/14, adjust=False).mean()
+        rsi = (100 - (100 / (1 + gain / loss.replace(0, np.nan)))).fillna(100)
+        mean = data.rolling(window=60).mean()
+        std = data.rolling(window=60).std()
+        z = ((data - mean) / std.replace(0, np.nan)).fillna(0)
+        rows[stock] = {
+            'RSI': round(rsi.iloc[-1], 2),
+            'Z-Score': round(z.iloc[-1], 2),
+            'Поддержка': round(data.rolling(window=200).min().iloc[-1], 2),
+            'Сопротивление': round(data.rolling(window=200).max().iloc[-1], 2),
+        }
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+
+def bench_recommendations(n_tickers, years):
+    """Сравнение времени поштучного и пакетного расчёта рекомендаций"""
+    prices = make_prices(n_tickers, years)
+    fundamentals = make_fundamentals(prices.columns)
+    analysis = Analysis(prices=prices, fundamentals=fundamentals)
+
+    start = time.perf_counter()
+    analysis.recommendations()
+    batch_time = time.perf_counter() - start
+    result = analysis.get_recommendations().set_index('Акция')
+
+    start = time.perf_counter()
+    reference = loop_indicators(prices, result.index)
+    loop_time = time.perf_counter() - start
+
+    pd.testing.assert_frame_equal(result[reference.columns], reference, check_names=False)
+    print(f'{n_tickers:>6} тикеров × {years} лет: {len(result)} в расчёте, '
+          f'поштучно {loop_time:.3f} с, пакетно {batch_time:.3f} с, ускорение ×{loop_time / batch_time:.1f}')
+
+
+def git_revision():
+    """Текущий коммит и признак незакоммиченных изменений (None вне git)"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True, check=True).stdout.strip() != ''
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit, dirty
+
+
+def _bench_db(db_params):
+    """Подключение к БД с пустыми таблицами в схеме BENCH_SCHEMA"""
+    from db_config import CONNECTION_DB
+    db = CONNECTION_DB(*db_params)
+    if db.conn is None:
+        raise ConnectionError('Нет подключения к БД для бенчмарка db_update')
+    db.execute(f'DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE; CREATE SCHEMA {BENCH_SCHEMA}; '
+               f'SET search_path TO {BENCH_SCHEMA}; {BENCH_DDL}')
+    return db
+
+
+def bench_pipeline(n_tickers, years, db_params=None, runs=2, trace_memory=False, seed=42):
+    """Время этапов main.py (Analysis.__init__, recommendations, save_to_excel, db_update) на синтетических данных.
+
+    Всё пишется во временный каталог: хранилище цен, журнал (пустой, со столбцами stock_tracker.xlsx) и,
+    если переданы параметры БД, таблицы в схеме BENCH_SCHEMA. Analysis, как в main.py, читает цены из хранилища,
+    поэтому в замер входят чтение через memmap, кэш производных данных, суммы доходностей и состояние индикаторов.
+    Первый прогон - с нуля, следующие - повторный запуск на тех же данных (кэш, состояние, журнал и БД уже
+    заполнены). Этап db_update требует PostgreSQL (запросы db_update написаны под psycopg2 и синтаксис PostgreSQL),
+    без параметров БД он пропускается. Возвращает список отчётов PipelineProfiler.
+    """
+    from db_update import db_update
+
+    tracker, history = read_tracker(TRACKER_PATH)
+    cwd = os.getcwd()
+    db = None
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            prices = make_prices(n_tickers, years, seed)
+            fundamentals = make_fundamentals(prices.columns, seed)
+            PriceStore(PRICE_STORE_DIR).write(prices)
+            write_tracker(TRACKER_PATH, tracker.iloc[:0], history.iloc[:0])
+            db = _bench_db(db_params) if db_params else None
+            if db is None:
+                print('Параметры PostgreSQL не переданы (--db), этап db_update пропускается')
+
+            reports = []
+            for run in range(runs):
+                profiler = PipelineProfiler(trace_memory=trace_memory)
+                with profiler.stage('init'):
+                    analysis = Analysis(fundamentals=fundamentals)
+                with profiler.stage('recommendations'):
+                    analysis.recommendations()
+                    buy, sell = analysis.get_buy_list(), analysis.get_sell_list()
+                with profiler.stage('save_to_excel'):
+                    analysis.save_to_excel(buy, sell)
+                if db is not None:
+                    with profiler.stage('db_update'):
+                        db_update(db, analysis, close=False)
+                reports.append(dict(profiler.report(), tickers=n_tickers, years=years, dates=len(prices.index),
+                                    run=run, buy=len(buy), sell=len(sell)))
+        finally:
+            os.chdir(cwd)
+            if db is not None:
+                db.execute(f'DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE')
+                db.close()
+    return reports
+
+
+def run_suite(scales, db_params=None, runs=2, trace_memory=False, output=BENCH_RESULTS_PATH):
+    """Прогон bench_pipeline по масштабам (тикеры, лет). Каждый масштаб считается в отдельном процессе,
+    поэтому пиковая память (peak_rss_mb) относится к нему, а не к предыдущим. Результаты дописываются в output"""
+    commit, dirty = git_revision()
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for n_tickers, years in scales:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            reports = pool.submit(bench_pipeline, n_tickers, years, db_params, runs, trace_memory).result()
+        for report in reports:
+            report.update(commit=commit, dirty=dirty, date=datetime.now().isoformat(timespec='seconds'))
+            stages = ', '.join(f"{stage['stage']} {stage['wall_s']:.3f} с" for stage in report['stages'])
+            print(f"{n_tickers:>6} тикеров × {years} лет, прогон {report['run'] + 1}: {stages}; "
+                  f"пик памяти {report['peak_rss_mb']} МБ")
+        results.extend(reports)
+    if output:
+        with open(output, 'a', encoding='utf-8') as f:
+            for report in results:
+                f.write(json.dumps(report, ensure_ascii=False) + '\n')
+        print(f'Результаты добавлены в {output}')
+    return results
+
+
+def compare_results(path=BENCH_RESULTS_PATH, last=5):
+    """Таблица времени этапов (с) по последним коммитам: строки - масштаб, прогон и этап, столбцы - коммиты"""
+    with open(path, encoding='utf-8') as f:
+        reports = [json.loads(line) for line in f if line.strip()]
+    rows = [{'commit': (report['commit'] or '?') + ('+' if report['dirty'] else ''), 'tickers': report['tickers'],
+             'years': report['years'], 'run': report['run'], 'stage': stage['stage'], 'wall_s': stage['wall_s']}
+            for report in reports for stage in report['stages']]
+    rows += [{'commit': (report['commit'] or '?') + ('+' if report['dirty'] else ''), 'tickers': report['tickers'],
+              'years': report['years'], 'run': report['run'], 'stage': 'peak_rss_mb', 'wall_s': report['peak_rss_mb']}
+             for report in reports]
+    df = pd.DataFrame(rows)
+    commits = list(dict.fromkeys(df['commit']))[-last:]
+    # для повторных прогонов одного коммита берётся последний
+    return df[df['commit'].isin(commits)].pivot_table(index=['tickers', 'years', 'run', 'stage'], columns='commit',
+                                                      values='wall_s', aggfunc='last')[commits]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Бенчмарк расчётов на синтетических данных')
+    parser.add_argument('--tickers', type=int, nargs='+', default=[150, 2000])
+    parser.add_argument('--years', type=int, nargs='+', default=[3])
+    parser.add_argument('--pipeline', action='store_true',
+                        help='время этапов Analysis.__init__, recommendations, save_to_excel и db_update')
+    parser.add_argument('--runs', type=int, default=2, help='прогонов на масштаб (первый - с нуля)')
+    parser.add_argument('--db', nargs='+', metavar='NAME USER PASSWORD [HOST [PORT]]', default=None,
+                        help='PostgreSQL для db_update (таблицы создаются в схеме benchmark); без него этап пропускается')
+    parser.add_argument('--trace-memory', action='store_true', help='пик выделенной памяти по этапам (tracemalloc)')
+    parser.add_argument('--output', default=BENCH_RESULTS_PATH)
+    parser.add_argument('--compare', action='store_true', help='сравнить сохранённые результаты по коммитам')
+    args = parser.parse_args()
+
+    if args.compare:
+        with pd.option_context('display.max_rows', None, 'display.width', 200):
+            print(compare_results(args.output))
+    elif args.pipeline:
+        db_params = None
+        if args.db:
+            db_params = args.db[:4] + [int(args.db[4])] if len(args.db) > 4 else args.db
+        run_suite([(n, years) for n in args.tickers for years in args.years], db_params, args.runs,
+                  args.trace_memory, args.output)
+    else:
+        for n in args.tickers:
+            for years in args.years:
+                bench_recommendations(n, years)
@@ -0,0 +1,226 @@
+import os
+from datetime import datetime
+from itertools import chain
+from operator import attrgetter
+
+import numpy as np
+import pandas as pd
+
+from price_store import PRICE_STORE_DIR
+
+
+# каталог хранилища OHLCV-свечей (по подкаталогу на интервал)
+CANDLE_STORE_DIR = os.path.join(PRICE_STORE_DIR, 'candles')
+# размер раздела файла: минутные свечи - по месяцам, часовые и дневные - по годам
+PARTITIONS = {'1m': 'M', '5m': 'M', 'hour': 'Y', 'day': 'Y'}
+# торговый день для дневных баров определяется по времени биржи
+MARKET_TZ = 'Europe/Moscow'
+PRICE_FIELDS = ('open', 'high', 'low', 'close')
+FIELDS = ('time',) + PRICE_FIELDS + ('volume',)
+# Quotation: units + nano / 10^9
+NANO = 10**9
+
+
+def quotation_to_float(quotation):
+    """Quotation в float без округления (units и nano переводятся в одно целое, деление - в самом конце)"""
+    return (quotation.units * NANO + quotation.nano) / NANO
+
+
+def candles_to_arrays(candles, fields=FIELDS):
+    """Свечи API в массивы: время - секунды UTC, цены - точные целые в нано-единицах (units * 10^9 + nano).
+
+    Ответ разбирается за один проход: units/nano всех нужных полей каждой свечи читаются attrgetter
+    в общий массив int64 (свечи × поля), а сборка units * 10^9 + nano идёт векторно в NumPy.
+    fields - только нужные поля (например, ('time', 'close') для дневных цен закрытия)."""
+    n = len(candles)
+    arrays = {}
+    if 'time' in fields:
+        arrays['time'] = np.fromiter(map(datetime.timestamp, map(attrgetter('time'), candles)),
+                                     dtype=np.float64, count=n).astype(np.int64)
+    prices = [field for field in PRICE_FIELDS if field in fields]
+    names = [f'{field}.{part}' for field in prices for part in ('units', 'nano')]
+    if 'volume' in fields:
+        names.append('volume')
+    if names:
+        getter = attrgetter(*names)
+        rows = map(getter, candles) if len(names) > 1 else ((value,) for value in map(getter, candles))
+        values = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=n * len(names)).reshape(n, len(names))
+        for i, field in enumerate(prices):
+            arrays[field] = values[:, 2 * i] * NANO + values[:, 2 * i + 1]
+        if 'volume' in fields:
+            arrays['volume'] = values[:, -1].copy()
+    return {field: arrays[field] for field in FIELDS if field in arrays}
+
+
+def close_series(candles):
+    """Цены закрытия дневных свечей в виде Series с индексом дат (дата свечи - по UTC, как candle.time.date())"""
+    arrays = candles_to_arrays(candles, ('time', 'close'))
+    days = arrays['time'].astype('datetime64[s]').astype('datetime64[D]')
+    return pd.Series(arrays['close'] / NANO, index=pd.DatetimeIndex(days, name='Date'), name='Close')
+
+
+def _utc_seconds(value):
+    """Момент времени как datetime64[s] UTC (время без часового пояса считается UTC)"""
+    value = pd.Timestamp(value)
+    if value.tzinfo is not None:
+        value = value.tz_convert('UTC').tz_localize(None)
+    return np.datetime64(value, 's')
+
+
+def request_windows(start, end, max_window):
+    """Разбиение периода [start, end) на окна не длиннее лимита API для интервала"""
+    windows = []
+    while start < end:
+        windows.append((start, min(start + max_window, end)))
+        start += max_window
+    return windows
+
+
+def resample_daily(arrays, tz=MARKET_TZ):
+    """Дневные бары из внутридневных: open - первая свеча дня, close - последняя, high/low - экстремумы,
+    volume - сумма. Массивы должны быть отсортированы по времени"""
+    times = arrays['time']
+    if not len(times):
+        return pd.DataFrame(columns=list(PRICE_FIELDS) + ['volume'], index=pd.DatetimeIndex([], name='Date'))
+    days = pd.to_datetime(times, unit='s', utc=True).tz_convert(tz).tz_localize(None).normalize().values
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    ends = np.r_[starts[1:], len(times)] - 1
+    bars = pd.DataFrame({
+        'open': arrays['open'][starts],
+        'high': np.maximum.reduceat(arrays['high'], starts),
+        'low': np.minimum.reduceat(arrays['low'], starts),
+        'close': arrays['close'][ends],
+        'volume': np.add.reduceat(arrays['volume'], starts),
+    }, index=pd.DatetimeIndex(days[starts], name='Date'))
+    bars[list(PRICE_FIELDS)] = bars[list(PRICE_FIELDS)] / NANO
+    return bars
+
+
+class CandleStore():
+    """Хранилище OHLCV-свечей одного интервала.
+
+    Для каждого тикера - каталог с файлами-разделами (месяц или год). Время хранится как int64 (секунды UTC),
+    объём - int64, цены - целые с масштабом раздела (10^k нано-единиц): int32, если значения помещаются,
+    иначе int64. Так цены хранятся точно и в 2-4 раза компактнее float64 в DataFrame, а чтение диапазона
+    открывает только нужные разделы.
+    """
+    def __init__(self, interval='1m', path=CANDLE_STORE_DIR):
+        self.interval = interval
+        self.period = PARTITIONS[interval]
+        self.path = os.path.join(path, interval)
+
+
+    def tickers(self):
+        return sorted(os.listdir(self.path)) if os.path.isdir(self.path) else []
+
+
+    def _partition_key(self, times):
+        return times.astype('datetime64[s]').astype(f'datetime64[{self.period}]')
+
+
+    def _partitions(self, ticker):
+        """Разделы тикера: {ключ раздела: путь}, по возрастанию"""
+        directory = os.path.join(self.path, ticker)
+        if not os.path.isdir(directory):
+            return {}
+        names = sorted(name[:-4] for name in os.listdir(directory) if name.endswith('.npz') and not name.endswith('.tmp.npz'))
+        return {np.datetime64(name, self.period): os.path.join(directory, name + '.npz') for name in names}
+
+
+    def write(self, ticker, arrays):
+        """Запись свечей тикера: свечи с тем же временем перезаписываются новыми (незавершённая свеча
+        обновляется при следующей загрузке), затрагиваются только разделы с новыми данными"""
+        if not len(arrays['time']):
+            return
+        directory = os.path.join(self.path, ticker)
+        os.makedirs(directory, exist_ok=True)
+        existing = self._partitions(ticker)
+        keys = self._partition_key(arrays['time'])
+        for key in np.unique(keys):
+            mask = keys == key
+            new = {field: arrays[field][mask] for field in FIELDS}
+            if key in existing:
+                old = self._load(existing[key])
+                new = {field: np.concatenate([old[field], new[field]]) for field in FIELDS}
+            # сортировка с сохранением порядка: из свечей с одинаковым временем остаётся последняя (новая)
+            order = np.argsort(new['time'], kind='stable')
+            times = new['time'][order]
+            keep = order[np.r_[times[1:] != times[:-1], True]]
+            self._save(os.path.join(directory, f'{key}.npz'), {field: new[field][keep] for field in FIELDS})
+
+
+    def read_arrays(self, ticker, start=None, end=None):
+        """Свечи тикера за [start, end] в виде массивов (цены - точные нано-единицы int64)"""
+        start = None if start is None else _utc_seconds(start)
+        end = None if end is None else _utc_seconds(end)
+        parts = []
+        for key, path in self._partitions(ticker).items():
+            if start is not None and key < start.astype(f'datetime64[{self.period}]'):
+                continue
+            if end is not None and key > end.astype(f'datetime64[{self.period}]'):
+                continue
+            parts.append(self._load(path))
+        if not parts:
+            return {field: np.empty(0, dtype=np.int64) for field in FIELDS}
+        arrays = {field: np.concatenate([part[field] for part in parts]) for field in FIELDS}
+        mask = np.ones(len(arrays['time']), dtype=bool)
+        if start is not None:
+            mask &= arrays['time'] >= start.astype(np.int64)
+        if end is not None:
+            mask &= arrays['time'] <= end.astype(np.int64)
+        return {field: values[mask] for field, values in arrays.items()}
+
+
+    def read(self, ticker, start=None, end=None):
+        """Свечи тикера в виде DataFrame (время UTC × open/high/low/close/volume)"""
+        arrays = self.read_arrays(ticker, start, end)
+        df = pd.DataFrame({field: arrays[field] / NANO for field in PRICE_FIELDS},
+                          index=pd.DatetimeIndex(pd.to_datetime(arrays['time'], unit='s', utc=True), name='Time'))
+        df['volume'] = arrays['volume']
+        return df
+
+
+    def last_time(self, ticker):
+        """Время последней сохранённой свечи тикера (None, если свечей нет)"""
+        partitions = self._partitions(ticker)
+        if not partitions:
+            return None
+        times = self._load(partitions[max(partitions)])['time']
+        return pd.Timestamp(int(times[-1]), unit='s', tz='UTC') if len(times) else None
+
+
+    def daily(self, ticker, start=None, end=None):
+        """Дневные бары тикера, построенные из свечей хранилища"""
+        return resample_daily(self.read_arrays(ticker, start, end))
+
+
+    def daily_close(self, tickers=None, start=None, end=None):
+        """Дневные цены закрытия (даты × тикеры) - в том же виде, что и PriceStore.read()"""
+        tickers = self.tickers() if tickers is None else tickers
+        closes = {ticker: self.daily(ticker, start, end)['close'] for ticker in tickers}
+        prices = pd.DataFrame(closes) if closes else pd.DataFrame()
+        prices.index.name = 'Date'
+        return prices.sort_index()
+
+
+    def _load(self, path):
+        with np.load(path) as data:
+            scale = int(data['scale'])
+            arrays = {'time': data['time'], 'volume': data['volume']}
+            for field in PRICE_FIELDS:
+                arrays[field] = data[field].astype(np.int64) * scale
+        return arrays
+
+
+    def _save(self, path, arrays):
+        """Цены раздела сохраняются целыми с наибольшим масштабом 10^k, при котором не теряются знаки"""
+        prices = np.concatenate([arrays[field] for field in PRICE_FIELDS])
+        scale = NANO
+        while scale > 1 and np.any(prices % scale):
+            scale //= 10
+        limit = np.abs(prices).max(initial=0) // scale
+        dtype = np.int32 if limit < 2**31 else np.int64
+        tmp_path = path[:-4] + '.tmp.npz'
+        np.savez(tmp_path, scale=np.int64(scale), time=arrays['time'], volume=arrays['volume'],
+                 **{field: (arrays[field] // scale).astype(dtype) for field in PRICE_FIELDS})
+        os.replace(tmp_path, path)
@@ -0,0 +1,61 @@
+from dataclasses import asdict, dataclass, replace
+
+from indicators import RSI_WINDOW, SR_WINDOW, Z_WINDOW
+
+
+@dataclass(frozen=True)
+class AnalysisConfig():
+    """Пороги фильтров, окна индикаторов и правила сигналов Analysis (по умолчанию - исходные значения)"""
+    # фильтры акций (рисковые активы отсекаются здесь)
+    roe_min: float = 3
+    roe_max: float = 50
+    pe_min: float = 0.5
+    pe_max: float = 30
+    div_min: float = 0
+    div_max: float = 15
+    volatility_max: float = 0.4
+    # множитель IQR при удалении выбросов ROE и P/E
+    iqr_factor: float = 1.5
+    # очень дешёвые акции не рассматриваются
+    min_price: float = 0.1
+
+    # окна индикаторов и минимальная длина истории акции
+    rsi_window: int = RSI_WINDOW
+    z_window: int = Z_WINDOW
+    sr_window: int = SR_WINDOW
+    min_history: int = 200
+
+    # баллы: RSI ниже уровней - 2 / 1.5 / 0.5, Z-Score ниже уровней - 1 / 0.5, цена <= поддержка * support_margin - 1
+    rsi_levels: tuple = (30, 40, 50)
+    z_levels: tuple = (-1, 0)
+    support_margin: float = 1.05
+
+    # сигнал на покупку и продажу
+    buy_score: float = 6
+    buy_rsi: float = 50
+    buy_pe: float = 15
+    buy_roe: float = 10
+    sell_rsi: float = 70
+    sell_z: float = 2
+
+    # цены для лучшей покупки (не ниже цены * buy_discount) и продажи (не выше цены * sell_premium)
+    buy_discount: float = 0.95
+    sell_premium: float = 1.20
+
+    # поля, от которых зависит отбор акций и их фундаментальные баллы
+    FILTER_FIELDS = ('roe_min', 'roe_max', 'pe_min', 'pe_max', 'div_min', 'div_max', 'volatility_max',
+                     'iqr_factor', 'min_price')
+
+
+    def replace(self, **changes):
+        """Копия настроек с изменёнными полями"""
+        return replace(self, **changes)
+
+
+    def to_dict(self):
+        return asdict(self)
+
+
+    def filter_key(self):
+        """Ключ настроек отбора акций: при одинаковом ключе набор акций и баллы совпадают"""
+        return tuple(getattr(self, name) for name in self.FILTER_FIELDS)
@@ -1,100 +1,291 @@
 from t_tech.invest import Client, CandleInterval, GetAssetFundamentalsRequest
-from datetime import datetime, timedelta
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import json
+import os
 import pandas as pd
+from fetcher import ConcurrentFetcher
+from instruments import InstrumentRegistry
+from price_store import open_price_store, CANDLES_CSV, PRICE_STORE_DIR
+from candle_store import CandleStore, candles_to_arrays, close_series, quotation_to_float, request_windows
+
+
+# глубина истории, загружаемой для новых тикеров (в днях)
+HISTORY_DAYS = 365*3
+# проверки тикеров, по которым API не вернул новых свечей (рядом с хранилищем цен): дата последней проверки
+# и число таких проверок подряд (по разным дням). Тикер считается неактивным (делистинг, приостановка торгов,
+# нет истории) после SYNC_INACTIVE_MISSES пустых проверок подряд, если его история отстаёт от рынка
+# не меньше чем на SYNC_INACTIVE_LAG торговых дней; неактивные тикеры проверяются раз в SYNC_RECHECK_DAYS дней
+SYNC_CHECKS_PATH = os.path.join(PRICE_STORE_DIR, 'sync_checks.json')
+SYNC_INACTIVE_MISSES = 3
+SYNC_INACTIVE_LAG = 5
+SYNC_RECHECK_DAYS = 7
+# максимальное количество активов в одном запросе GetAssetFundamentals
+FUNDAMENTALS_CHUNK_SIZE = 100
+# интервалы свечей: (интервал API, максимальный период одного запроса GetCandles, глубина первичной загрузки)
+CANDLE_INTERVALS = {
+    '1m': (CandleInterval.CANDLE_INTERVAL_1_MIN, timedelta(days=1), timedelta(days=30)),
+    '5m': (CandleInterval.CANDLE_INTERVAL_5_MIN, timedelta(days=1), timedelta(days=90)),
+    'hour': (CandleInterval.CANDLE_INTERVAL_HOUR, timedelta(days=7), timedelta(days=365)),
+    'day': (CandleInterval.CANDLE_INTERVAL_DAY, timedelta(days=365), timedelta(days=HISTORY_DAYS)),
+}
+# тикеров в одной порции загрузки свечей (ответы порции держатся в памяти до записи)
+CANDLES_BATCH_SIZE = 50
 
 
 class MyClient(Client):
-    def __init__(self, token):
+    def __init__(self, token, max_workers=8, rate_limits=None, client_factory=Client, fundamentals_chunk_size=FUNDAMENTALS_CHUNK_SIZE):
         self.token = token
-        with Client(token) as client:
-            # получение списка акций
-            self.shares = client.instruments.shares().instruments
+        # количество активов в одном запросе отчётностей (не больше лимита API)
+        self.fundamentals_chunk_size = max(1, min(fundamentals_chunk_size, FUNDAMENTALS_CHUNK_SIZE))
+        # фабрика клиента API (для офлайн-проверки можно передать fake_client.FakeClient)
+        self.client_factory = client_factory
+        # параллельная загрузка с учётом лимитов брокера
+        self.fetcher = ConcurrentFetcher(max_workers=max_workers, rate_limits=rate_limits)
+        # справочник акций: читается из файла при первом обращении, из API - только если устарел
+        self.registry = InstrumentRegistry(token, client_factory=client_factory, fetcher=self.fetcher)
+
+
+    @property
+    def tickers_TQBR_nocval(self):
+        """Словарь {тикер: {figi, name, UID}} акций TQBR для неквалифицированных инвесторов"""
+        return self.registry.tickers
+
+
+    def refresh_instruments(self):
+        """Принудительное обновление справочника акций из API"""
+        return self.registry.refresh()
+
 
-            # фильтрация акций по классу и исключение акций для квалифицированных инвесторов
-            # TQBR — аббревиатура, которая означает «Торги Квалифицированных Биржевых Рынков».
-            # Это основной режим торгов на Московской бирже, предназначенный для торговли акциями.
-            # for_qual_investor_flag = False - отбирает только акции, предназначенные для неквалифицированных инвесторов.
-            # на выходe получаем словарь с {тикер: {figi, name, UID}}
-            self.tickers_TQBR_nocval = {share.ticker: {'figi': share.figi, 'name': share.name,'UID': share.asset_uid} for share in self.shares if share.class_code == 'TQBR' and not share.for_qual_investor_flag}
+    def get_candles_and_fundamentals(self, export_csv=False):
+        """Метод получения свечей: первичная выгрузка за 3 года, далее дозагрузка только недостающего хвоста.
+        Свечи хранятся в бинарном хранилище price_store, export_csv=True дополнительно выгружает их в candles.csv"""
+        if self.sync_candles(export_csv) is None:
+            return
+        self._get_fundamentals()
 
 
-    def get_candles_and_fundamentals(self):
-        """Метод получения свечей за 5 лет с сохранением в .csv и последующим его обновлением"""
-        with Client(self.token) as client:
+    def sync_candles(self, export_csv=False, on_ticker=None, reload=()):
+        """Дозагрузка дневных свечей в price_store. Ответы разбираются по мере прихода (пока остальные тикеры
+        ещё загружаются) и пишутся в хранилище порциями по CANDLES_BATCH_SIZE тикеров; on_ticker(тикер, цены)
+        вызывается для каждого полученного тикера. reload - тикеры, история которых загружается заново целиком
+        (например, сохранённая раньше с округлением до копеек). Тикеры, по которым API не вернул новых свечей,
+        запоминаются в SYNC_CHECKS_PATH; после нескольких пустых проверок подряд и заметного отставания от рынка
+        они запрашиваются не чаще раза в SYNC_RECHECK_DAYS дней. Возвращает {тикер: цены} или None, если обновлять нечего"""
+        with self.client_factory(self.token) as client:
             self.candles_data = {}
 
             # дата на сегодняшний день
             now = datetime.now()
 
-            try:
-                # пробуем выгрузить данные из файла
-                old_candles_df = pd.read_csv('candles.csv', index_col='Date', parse_dates=['Date'])
-                # количество дней без обновления данных
-                days = (now - old_candles_df.index[-1]).days
+            # открываем хранилище свечей (при первом запуске импортируется candles.csv)
+            store = open_price_store()
 
-            except FileNotFoundError:
-                days = (now - timedelta(days=365*3)).day
+            # для каждого тикера определяем дату, с которой нужно догрузить данные
+            last_dates = store.last_valid_dates()
+            checks = self._load_sync_checks()
+            sync_from = self._get_sync_dates(last_dates, now, reload, checks, store.dates)
 
-            # дата 5 лет назад
-            start_date = now - timedelta(days=365*3)
+            if not sync_from:
+                print('Данные не требуют обновления.')
+                return None
 
-            if days > 2:
-                # получаем свечи для каждого тикера за указанный срок
-                for ticker, values in self.tickers_TQBR_nocval.items():
-                    candles = client.market_data.get_candles(figi=values['figi'], from_=start_date, to=now, interval=CandleInterval.CANDLE_INTERVAL_DAY).candles
-                    df = pd.DataFrame([
-                        {
-                        'Date': candle.time.date(),
-                        'Close': self._quotation_to_float(candle.close) # берем только свечи закрытия
-                        }
-                        for candle in candles])
+            # параллельно получаем только недостающие свечи для каждого тикера; период запроса режется
+            # на окна по лимиту API для дневных свечей (первичная загрузка за 3 года - несколько запросов)
+            api_interval, max_window, _ = CANDLE_INTERVALS['day']
+            requests = [(ticker, window_from, window_to) for ticker, start in sync_from.items()
+                        for window_from, window_to in request_windows(start, now, max_window) or [(start, now)]]
+            responses = self.fetcher.imap('get_candles', lambda request: client.market_data.get_candles(
+                figi=self.tickers_TQBR_nocval[request[0]]['figi'], from_=request[1], to=request[2],
+                interval=api_interval).candles, requests)
+            # тикер разбирается, когда пришли ответы по всем его окнам
+            remaining = Counter(ticker for ticker, _, _ in requests)
+            windows = {}
 
-                    df = df.set_index('Date') # установка индекса по 'Date'
-                    self.candles_data[ticker] = df["Close"]
+            batch = {}
+            for (ticker, window_from, _), window_candles in responses:
+                windows.setdefault(ticker, []).append((window_from, window_candles))
+                remaining[ticker] -= 1
+                if remaining[ticker]:
+                    continue
+                candles = [candle for _, part in sorted(windows.pop(ticker), key=lambda item: item[0]) for candle in part]
+                # берем только свечи закрытия: весь ответ сразу в массивы, цены - без округления
+                close = close_series(candles) if candles else None
+                if close is not None:
+                    # свеча на границе окон может прийти дважды
+                    close = close[~close.index.duplicated(keep='last')]
+                last_date = last_dates.get(ticker, pd.NaT)
+                if close is None or (ticker not in reload and pd.notna(last_date) and close.index.max() <= last_date):
+                    # новых свечей нет - запоминаем проверку (хвост прошлого запуска всё равно перезаписываем);
+                    # повторные запуски в тот же день не считаются отдельными проверками
+                    check = checks.get(ticker, {'checked': None, 'misses': 0})
+                    if check['checked'] != now.date().isoformat():
+                        checks[ticker] = {'checked': now.date().isoformat(), 'misses': check['misses'] + 1}
+                    if close is None:
+                        continue
+                else:
+                    checks.pop(ticker, None)
+                self.candles_data[ticker] = batch[ticker] = close
+                if on_ticker is not None:
+                    on_ticker(ticker, close)
+                # дописываем новые свечи в хранилище (новые значения перезаписывают старые за те же даты)
+                if len(batch) >= CANDLES_BATCH_SIZE:
+                    store.upsert(pd.DataFrame(batch))
+                    batch = {}
+            if batch:
+                store.upsert(pd.DataFrame(batch))
+            self._save_sync_checks(checks)
+            if export_csv:
+                store.to_csv(CANDLES_CSV) # сохранение в CSV файл
 
-                 # объединение DataFrame
-                candles_df = pd.DataFrame(self.candles_data) # создание DataFrame из словаря
-                candles_df.to_csv('candles.csv', encoding='utf-8') # сохранение DataFrame в CSV файл
+            print(f'Хранилище свечей обновлено: {len(self.candles_data)} тикеров')
+            return self.candles_data
 
-                print('Файл свечей создан')
 
-                self._get_fundamentals()
-            else:
-                print('Данные не требуют обновления.')
+    def get_fundamentals(self):
+        """Загрузка отчётностей в fundamentals.csv (независимо от свечей)"""
+        self._get_fundamentals()
+
+
+    def get_candles(self, interval='1m', tickers=None, history=None):
+        """OHLCV-свечи интервала '1m', '5m', 'hour' или 'day' в хранилище candle_store.
+        Для каждого тикера догружается хвост начиная с последней сохранённой свечи, период запроса режется
+        на окна по лимиту API. Дневные бары из внутридневных свечей строит CandleStore.daily()"""
+        api_interval, max_window, default_history = CANDLE_INTERVALS[interval]
+        store = CandleStore(interval)
+        now = datetime.now(timezone.utc)
+        backfill_date = now - (history or default_history)
+        tickers = list(self.tickers_TQBR_nocval) if tickers is None else list(tickers)
+
+        updated, n_requests = 0, 0
+        with self.client_factory(self.token) as client:
+            # порциями по несколько тикеров, чтобы не держать в памяти ответы по всем сразу
+            for i in range(0, len(tickers), CANDLES_BATCH_SIZE):
+                requests = []
+                for ticker in tickers[i:i + CANDLES_BATCH_SIZE]:
+                    last_time = store.last_time(ticker)
+                    start = backfill_date if last_time is None else last_time.to_pydatetime()
+                    requests += [(ticker, window_from, window_to) for window_from, window_to in request_windows(start, now, max_window)]
+                n_requests += len(requests)
+
+                responses = self.fetcher.map('get_candles', lambda request: client.market_data.get_candles(
+                    figi=self.tickers_TQBR_nocval[request[0]]['figi'], from_=request[1], to=request[2],
+                    interval=api_interval).candles, requests)
+
+                candles_by_ticker = {}
+                for (ticker, _, _), candles in responses.items():
+                    candles_by_ticker.setdefault(ticker, []).extend(candles)
+                for ticker, candles in candles_by_ticker.items():
+                    if candles:
+                        store.write(ticker, candles_to_arrays(candles))
+                        updated += 1
+
+        print(f'Свечи {interval} обновлены: {updated} тикеров, запросов: {n_requests}')
+        return store
+
+
+    def _get_sync_dates(self, last_dates, now, reload=(), checks=None, dates=None):
+        """Возвращает словарь {тикер: дата начала загрузки} для тикеров, данные которых устарели.
+        checks - {тикер: {'checked': дата, 'misses': число пустых проверок подряд}}, dates - даты хранилища:
+        неактивные тикеры (см. SYNC_INACTIVE_MISSES, SYNC_INACTIVE_LAG) пропускаются SYNC_RECHECK_DAYS дней"""
+        # начало истории для новых тикеров (бэкфилл за 3 года)
+        backfill_date = now - timedelta(days=HISTORY_DAYS)
+        today = pd.Timestamp(now.date())
+        checks = checks or {}
+        dates = dates if dates is not None else pd.DatetimeIndex([])
+
+        sync_from = {}
+        for ticker in self.tickers_TQBR_nocval:
+            last_date = last_dates.get(ticker, pd.NaT)
+            if ticker not in reload and self._is_inactive(checks.get(ticker), last_date, dates, today):
+                continue
+            if pd.isna(last_date) or ticker in reload:
+                # новый тикер (или тикер без данных, или перезагрузка) - загружаем всю историю
+                sync_from[ticker] = backfill_date
+            elif last_date < today:
+                # загружаем, начиная с последней сохранённой даты включительно,
+                # чтобы перезаписать незавершённую на момент прошлого запуска дневную свечу
+                sync_from[ticker] = last_date.to_pydatetime()
+        return sync_from
+
+
+    @staticmethod
+    def _is_inactive(check, last_date, dates, today):
+        """Тикер недавно проверяли, новых свечей не было несколько раз подряд, а рынок за это время
+        торговался несколько дней (у тикера без истории отставание не проверяется)"""
+        if check is None or check['misses'] < SYNC_INACTIVE_MISSES:
+            return False
+        if today - pd.Timestamp(check['checked']) >= timedelta(days=SYNC_RECHECK_DAYS):
+            return False
+        # число дат хранилища после последней свечи тикера - торговые дни, пропущенные тикером
+        return pd.isna(last_date) or len(dates) - dates.searchsorted(last_date, side='right') >= SYNC_INACTIVE_LAG
+
+
+    def _load_sync_checks(self):
+        if not os.path.exists(SYNC_CHECKS_PATH):
+            return {}
+        with open(SYNC_CHECKS_PATH, encoding='utf-8') as f:
+            checks = json.load(f)
+        # прежний формат - только дата проверки
+        return {ticker: check if isinstance(check, dict) else {'checked': check, 'misses': 1}
+                for ticker, check in checks.items()}
+
+
+    def _save_sync_checks(self, checks):
+        os.makedirs(os.path.dirname(SYNC_CHECKS_PATH), exist_ok=True)
+        tmp_path = SYNC_CHECKS_PATH + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(checks, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, SYNC_CHECKS_PATH)
 
 
     def _get_fundamentals(self):
-        """Метод получения отчётностей по каждой акции"""
-        with Client(self.token) as client:
-            # получение фундаментальных данных
+        """Метод получения отчётностей по каждой акции пакетами по несколько активов за запрос"""
+        # тикеры, относящиеся к каждому активу (asset_uid)
+        uid_to_tickers = {}
+        for ticker, values in self.tickers_TQBR_nocval.items():
+            uid_to_tickers.setdefault(values['UID'], []).append(ticker)
+        uids = list(uid_to_tickers)
+        chunks = [tuple(uids[i:i + self.fundamentals_chunk_size]) for i in range(0, len(uids), self.fundamentals_chunk_size)]
+
+        with self.client_factory(self.token) as client:
+            # параллельное получение фундаментальных данных по пакетам активов
             self.fundamentals_data = {}
-            for ticker, values in self.tickers_TQBR_nocval.items():
-                #uid = self.tickers_assets[ticker]
-                fundamentals = client.instruments.get_asset_fundamentals(request=GetAssetFundamentalsRequest(assets=[values['UID']],)).fundamentals
+            responses = self.fetcher.map('get_asset_fundamentals', lambda chunk: client.instruments.get_asset_fundamentals(
+                request=GetAssetFundamentalsRequest(assets=list(chunk),)).fundamentals, chunks)
+
+        # сопоставляем ответы с тикерами по asset_uid, а не по позиции в ответе
+        for fundamentals in responses.values():
+            for fundamental in fundamentals:
+                for ticker in uid_to_tickers.get(fundamental.asset_uid, []):
+                    self.fundamentals_data[ticker] = {
+                    # 1. Оценка стоимости
+                    'P/E_TTM': fundamental.pe_ratio_ttm,
+                    'P/B_TTM': fundamental.price_to_book_ttm,
 
-                self.fundamentals_data[ticker] = {
-                # 1. Оценка стоимости
-                'P/E_TTM': fundamentals[0].pe_ratio_ttm,
-                'P/B_TTM': fundamentals[0].price_to_book_ttm,
+                    # 2. Прибыльность и эффективность
+                    'ROE': fundamental.roe,
 
-                # 2. Прибыльность и эффективность
-                'ROE': fundamentals[0].roe,
+                    # 3. Рост
+                    'Revenue_Growth_YOY': fundamental.one_year_annual_revenue_growth_rate,
 
-                # 3. Рост
-                'Revenue_Growth_YOY': fundamentals[0].one_year_annual_revenue_growth_rate,
+                    # 4. Дивиденды
+                    'Div_Yield': fundamental.dividend_yield_daily_ttm,
 
-                # 4. Дивиденды
-                'Div_Yield': fundamentals[0].dividend_yield_daily_ttm,
+                    # 5. Финансовая устойчивость
+                    'Debt_To_Equity': fundamental.total_debt_to_equity_mrq,
 
-                # 5. Финансовая устойчивость
-                'Debt_To_Equity': fundamentals[0].total_debt_to_equity_mrq,
+                    # 6. Рыночные характеристики
+                    'Beta': fundamental.beta,
 
-                # 6. Рыночные характеристики
-                'Beta': fundamentals[0].beta,
+                    # 7. Дополнительные метрики
+                    'FCF_Yield': fundamental.price_to_free_cash_flow_ttm
+                }
 
-                # 7. Дополнительные метрики
-                'FCF_Yield': fundamentals[0].price_to_free_cash_flow_ttm
-            }
+        # активы, по которым API не вернул отчётность, в файл не попадают (анализ их отбросит как NaN)
+        missing = [ticker for ticker in self.tickers_TQBR_nocval if ticker not in self.fundamentals_data]
+        if missing:
+            print(f'Нет отчётностей по {len(missing)} тикерам: {", ".join(missing)}')
 
         fundamentals_df = pd.DataFrame(self.fundamentals_data) # создание DataFrame из словаря
         fundamentals_df.to_csv('fundamentals.csv', encoding='utf-8') # сохранение DataFrame в CSV файл
@@ -104,8 +295,8 @@ class MyClient(Client):
 
     # API Т-банка возвращает стоимость активов в формате quotation - нужна фанкция для конвертации в привычные метрики
     def _quotation_to_float(self, quotation):
-        """Преобразует объект Quotation в float"""
-        return round(quotation.units + quotation.nano / 1000000000, 2)
+        """Преобразует объект Quotation в float (без округления - у дешёвых акций важны доли копейки)"""
+        return quotation_to_float(quotation)
 
     def get_ticker_and_names(self):
         return [(ticker, values['name']) for ticker, values in self.tickers_TQBR_nocval.items()]
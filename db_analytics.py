@@ -0,0 +1,106 @@
+import pandas as pd
+from psycopg2 import sql
+
+
+# Даты сигналов и истории - DATE (старые таблицы с VARCHAR переводятся на месте), индексы (ticker_name, start_date).
+# signal_performance - агрегаты закрытых сигналов по тикеру, сигналу и месяцу закрытия. Хранятся аддитивные
+# суммы, поэтому новые строки history добавляются к своим группам в той же транзакции (без пересчёта всей
+# истории), а отчёты читают маленькую таблицу агрегатов вместо history.
+ANALYTICS_DDL = """
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'signals' AND column_name = 'start_date') <> 'date' THEN
+        ALTER TABLE signals ALTER COLUMN start_date TYPE DATE USING start_date::date;
+    END IF;
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'history' AND column_name = 'start_date') <> 'date' THEN
+        ALTER TABLE history ALTER COLUMN start_date TYPE DATE USING start_date::date,
+                            ALTER COLUMN end_date TYPE DATE USING end_date::date;
+    END IF;
+END $$;
+CREATE INDEX IF NOT EXISTS signals_ticker_start_idx ON signals (ticker_name, start_date);
+CREATE INDEX IF NOT EXISTS history_ticker_start_idx ON history (ticker_name, start_date);
+CREATE TABLE IF NOT EXISTS signal_performance (
+           ticker_name VARCHAR NOT NULL,
+           signal VARCHAR(10) NOT NULL,
+           month DATE NOT NULL,
+           trades INTEGER NOT NULL,
+           wins INTEGER NOT NULL,
+           sum_delta FLOAT NOT NULL,
+           sum_days BIGINT NOT NULL,
+           PRIMARY KEY (ticker_name, signal, month));
+"""
+# сигнал покупки успешен, если цена выросла, продажи - если упала
+PERFORMANCE_SELECT = """
+SELECT ticker_name, signal, date_trunc('month', end_date)::date AS month, count(*) AS trades,
+       count(*) FILTER (WHERE (signal = 'buy' AND delta > 0) OR (signal = 'sell' AND delta < 0)) AS wins,
+       sum(delta) AS sum_delta, sum(end_date - start_date) AS sum_days
+FROM {source}
+GROUP BY 1, 2, 3
+"""
+PERFORMANCE_GROUPS = ('ticker_name', 'signal', 'month')
+
+
+def create_analytics_tables(db):
+    """Перевод дат на DATE, индексы и таблица агрегатов; пустая таблица агрегатов заполняется из history"""
+    with db.transaction():
+        db.execute(ANALYTICS_DDL)
+        db.execute("""INSERT INTO signal_performance """ + PERFORMANCE_SELECT.format(source='history') +
+                   """HAVING NOT EXISTS (SELECT 1 FROM signal_performance)""")
+
+
+def rebuild_performance(db):
+    """Полный пересчёт агрегатов по history (если history правили вручную)"""
+    with db.transaction():
+        db.execute("""DELETE FROM signal_performance""")
+        db.execute("""INSERT INTO signal_performance """ + PERFORMANCE_SELECT.format(source='history'))
+
+
+def add_performance(db, history_rows):
+    """Добавление закрытых сигналов (строки history: ticker_name, signal, start_date, end_date,
+    start_price, end_price, delta) к агрегатам их групп одним запросом"""
+    rows = [(ticker, signal, start_date, end_date, delta)
+            for ticker, signal, start_date, end_date, _, _, delta in history_rows]
+    if not rows:
+        return
+    query = ("""INSERT INTO signal_performance AS p """ +
+             PERFORMANCE_SELECT.format(source='(VALUES %s) AS v (ticker_name, signal, start_date, end_date, delta)') +
+             """ON CONFLICT (ticker_name, signal, month) DO UPDATE
+                SET trades = p.trades + EXCLUDED.trades,
+                    wins = p.wins + EXCLUDED.wins,
+                    sum_delta = p.sum_delta + EXCLUDED.sum_delta,
+                    sum_days = p.sum_days + EXCLUDED.sum_days""")
+    db.execute_batch(query, rows, template='(%s, %s, %s::date, %s::date, %s::float8)')
+
+
+def signal_performance(db, by=PERFORMANCE_GROUPS, start=None, end=None):
+    """Результаты закрытых сигналов, сгруппированные по by (любые из ticker_name, signal, month):
+    число сделок, доля успешных, средний результат и средний срок удержания (дней). start/end - месяцы закрытия"""
+    by = list(by)
+    unknown = [column for column in by if column not in PERFORMANCE_GROUPS]
+    if unknown:
+        raise ValueError(f'Неизвестные столбцы группировки: {unknown}')
+    columns = sql.SQL(', ').join(map(sql.Identifier, by))
+    query = sql.SQL("""
+        SELECT {columns}{comma} sum(trades) AS trades, sum(wins)::float8 / sum(trades) AS win_rate,
+               sum(sum_delta) / sum(trades) AS avg_delta, sum(sum_days)::float8 / sum(trades) AS avg_days
+        FROM signal_performance
+        WHERE (%(start)s::date IS NULL OR month >= date_trunc('month', %(start)s::date))
+          AND (%(end)s::date IS NULL OR month <= %(end)s::date)
+        {group}""").format(
+        columns=columns, comma=sql.SQL(',') if by else sql.SQL(''),
+        group=sql.SQL('GROUP BY {0} ORDER BY {0}').format(columns) if by else sql.SQL(''))
+    params = {'start': None if start is None else pd.Timestamp(start).date(),
+              'end': None if end is None else pd.Timestamp(end).date()}
+    return pd.read_sql_query(query.as_string(db.conn), db.conn, params=params,
+                             parse_dates=['month'] if 'month' in by else None)
+
+
+def open_signals(db):
+    """Открытые сигналы с текущим результатом и сроком (считаются в БД)"""
+    return pd.read_sql_query("""
+        SELECT ticker_name, signal, start_date, current_date - start_date AS days,
+               start_price, price_now, round(((price_now - start_price) / start_price)::numeric, 4)::float8 AS delta
+        FROM signals
+        ORDER BY start_date, ticker_name""", db.conn, parse_dates=['start_date'])
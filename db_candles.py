@@ -0,0 +1,93 @@
+import io
+
+import pandas as pd
+
+
+# Таблица истории цен закрытия: ключ (ticker, date), даты - DATE, цены - точный NUMERIC.
+# Хранилище дневных цен держит только close, поэтому open/high/low/volume в таблице нет (пустые столбцы
+# из прежней схемы удаляются). Индекс (date, ticker) INCLUDE (close) покрывает выборки диапазона дат
+# по всем тикерам без чтения таблицы.
+CANDLES_DDL = """
+CREATE TABLE IF NOT EXISTS candles (
+           ticker VARCHAR(10) NOT NULL REFERENCES tickers(name),
+           date DATE NOT NULL,
+           close NUMERIC(20, 9) NOT NULL,
+           PRIMARY KEY (ticker, date));
+DO $$
+BEGIN
+    -- ALTER TABLE берёт исключительную блокировку таблицы, поэтому только если старые столбцы ещё есть
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_schema = current_schema() AND table_name = 'candles' AND column_name = 'open') THEN
+        ALTER TABLE candles DROP COLUMN IF EXISTS open, DROP COLUMN IF EXISTS high,
+                            DROP COLUMN IF EXISTS low, DROP COLUMN IF EXISTS volume;
+    END IF;
+END $$;
+CREATE INDEX IF NOT EXISTS candles_date_ticker_idx ON candles (date, ticker) INCLUDE (close);
+"""
+CANDLES_COLUMNS = ['ticker', 'date', 'close']
+
+
+def create_candles_table(db):
+    """Создание таблицы candles и её индекса (если их ещё нет)"""
+    db.execute(CANDLES_DDL)
+
+
+def last_candle_dates(db):
+    """Последняя сохранённая дата по каждому тикеру (читается только первичный ключ)"""
+    df = pd.read_sql_query("""SELECT ticker, max(date) AS date FROM candles GROUP BY ticker""", db.conn)
+    return pd.Series(pd.to_datetime(df['date']).values, index=df['ticker'])
+
+
+def upsert_candles(db, prices):
+    """Идемпотентная загрузка цен закрытия (DataFrame даты × тикеры): COPY во временную таблицу и
+    INSERT ... ON CONFLICT в candles, поэтому повторная загрузка тех же дней просто перезаписывает их"""
+    long = prices.rename_axis(index='date', columns='ticker').stack().rename('close').reset_index()
+    if long.empty:
+        return 0
+    long = long.reindex(columns=CANDLES_COLUMNS)
+    long['date'] = pd.to_datetime(long['date']).dt.strftime('%Y-%m-%d')
+    buffer = io.StringIO()
+    long.to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+
+    with db.transaction():
+        db.execute("""CREATE TEMP TABLE IF NOT EXISTS candles_stage (LIKE candles INCLUDING DEFAULTS) ON COMMIT DROP""")
+        db.copy_from('candles_stage', CANDLES_COLUMNS, buffer)
+        db.execute("""
+            INSERT INTO candles (ticker, date, close)
+            SELECT ticker, date, close FROM candles_stage
+            ON CONFLICT (ticker, date) DO UPDATE SET close = EXCLUDED.close""")
+    return len(long)
+
+
+def sync_candles(db, store):
+    """Дозагрузка в БД новых дней из хранилища цен: для каждого тикера - начиная с последней даты в БД
+    включительно (она могла быть перезаписана в хранилище); тикеры, которых в БД нет, - вся история.
+    Тикеры без цен в хранилище пропускаются"""
+    last_dates = last_candle_dates(db).reindex(store.tickers)[store.last_valid_dates().notna().to_numpy()]
+    # тикеры с одной и той же последней датой в БД читаются из хранилища одним срезом с этой даты,
+    # поэтому отставший тикер не заставляет перечитывать историю остальных
+    parts = [store.read(tickers=last_dates.index[last_dates.isna()])]
+    for start, group in last_dates.dropna().groupby(last_dates.dropna()):
+        parts.append(store.read(tickers=group.index, start=start))
+    return upsert_candles(db, pd.concat(parts, axis=1))
+
+
+def load_candles(db, tickers=None, start=None, end=None):
+    """Цены закрытия из БД за диапазон дат по набору тикеров в виде DataFrame (даты × тикеры)"""
+    query = """SELECT date, ticker, close::float8 AS close FROM candles WHERE TRUE"""
+    params = []
+    if tickers is not None:
+        query += """ AND ticker = ANY(%s)"""
+        params.append(list(tickers))
+    if start is not None:
+        query += """ AND date >= %s"""
+        params.append(pd.Timestamp(start).date())
+    if end is not None:
+        query += """ AND date <= %s"""
+        params.append(pd.Timestamp(end).date())
+    df = pd.read_sql_query(query, db.conn, params=params, parse_dates=['date'])
+    prices = df.pivot(index='date', columns='ticker', values='close').sort_index()
+    prices.index.name = 'Date'
+    prices.columns.name = None
+    return prices
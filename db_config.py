@@ -1,16 +1,64 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 import psycopg2
-from psycopg2 import OperationalError
+from psycopg2 import InterfaceError, OperationalError, extensions, sql
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+from profiling import count
+
+
+class CountingCursor(extensions.cursor):
+    """Курсор, считающий обращения к БД (в том числе из execute_values и pandas.read_sql_query)"""
+    def execute(self, query, vars=None):
+        count('db_round_trips')
+        return super().execute(query, vars)
+
+
+    def executemany(self, query, vars_list):
+        count('db_round_trips')
+        return super().executemany(query, vars_list)
+
+
+    def copy_expert(self, sql, file, size=8192):
+        count('db_round_trips')
+        return super().copy_expert(sql, file, size)
+
+
+class CountingConnection(extensions.connection):
+    """Соединение с CountingCursor по умолчанию; commit и rollback тоже считаются обращениями"""
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault('cursor_factory', CountingCursor)
+        return super().cursor(*args, **kwargs)
+
+
+    def commit(self):
+        count('db_round_trips')
+        return super().commit()
+
+
+    def rollback(self):
+        count('db_round_trips')
+        return super().rollback()
 
 
 class CONNECTION_DB():
     def __init__(self, db_name, db_user, db_password, db_host='localhost', db_port=5432):
+        # глубина вложенных транзакций: пока > 0, запросы не фиксируются по отдельности
+        self._transaction_depth = 0
+        # соединение из пула закрывает пул, а не close()
+        self._pooled = False
         try:
             self.conn = psycopg2.connect(
             database=db_name,
             user=db_user,
             password=db_password,
             host=db_host,
-            port=db_port)
+            port=db_port,
+            connection_factory=CountingConnection)
             self.conn.autocommit = False
             print('Подключение к БД установлено')
         except OperationalError as e:
@@ -18,17 +66,118 @@ class CONNECTION_DB():
             self.conn = None
 
 
-    def execute(self, query: str):
+    @classmethod
+    def from_connection(cls, conn):
+        """Обёртка над уже открытым соединением (например, выданным DB_POOL)"""
+        db = cls.__new__(cls)
+        db._transaction_depth = 0
+        db._pooled = True
+        db.conn = conn
+        return db
+
+
+    @contextmanager
+    def transaction(self):
+        """Группирует все запросы внутри блока в одну транзакцию: commit в конце, rollback при ошибке"""
+        self._transaction_depth += 1
+        try:
+            yield self
+        except Exception:
+            self._transaction_depth -= 1
+            if self.conn and self._transaction_depth == 0:
+                self.conn.rollback()
+            raise
+        else:
+            self._transaction_depth -= 1
+            if self.conn and self._transaction_depth == 0:
+                self.conn.commit()
+
+
+    def execute(self, query, params=None):
         if not self.conn:
             print('Нет подключения к БД')
             return
 
         try:
             with self.conn.cursor() as cursor:
-                cursor.execute(query)
-            self.conn.commit()
-        except OperationalError as e:
-            self.conn.rollback()
+                cursor.execute(query, params)
+            self._commit()
+        except psycopg2.Error as e:
+            self._rollback()
+            print(f'Ошибка: {e}')
+            raise
+
+
+    def execute_batch(self, query, rows, template=None):
+        """Выполнение запроса с VALUES %s сразу для всех строк (execute_values) за один проход"""
+        rows = list(rows)
+        if not self.conn:
+            print('Нет подключения к БД')
+            return
+        if not rows:
+            return
+
+        try:
+            with self.conn.cursor() as cursor:
+                execute_values(cursor, query, rows, template=template, page_size=max(len(rows), 1))
+            self._commit()
+        except psycopg2.Error as e:
+            self._rollback()
+            print(f'Ошибка: {e}')
+            raise
+
+
+    def insert_many(self, table: str, columns: list, rows, conflict: list = None, update: list = None):
+        """Пакетная вставка строк; conflict - столбцы ON CONFLICT, update - столбцы для DO UPDATE (иначе DO NOTHING)"""
+        query = sql.SQL('INSERT INTO {} ({}) VALUES %s').format(
+            sql.Identifier(table), sql.SQL(', ').join(map(sql.Identifier, columns)))
+        if conflict:
+            query += sql.SQL(' ON CONFLICT ({})').format(sql.SQL(', ').join(map(sql.Identifier, conflict)))
+            if update:
+                query += sql.SQL(' DO UPDATE SET {}').format(sql.SQL(', ').join(
+                    sql.SQL('{0} = EXCLUDED.{0}').format(sql.Identifier(column)) for column in update))
+            else:
+                query += sql.SQL(' DO NOTHING')
+        self.execute_batch(query, rows)
+
+
+    def upsert_many(self, table: str, columns: list, rows, conflict: list):
+        """Пакетный upsert: конфликтующие по conflict строки обновляются остальными столбцами"""
+        self.insert_many(table, columns, rows, conflict=conflict,
+                         update=[column for column in columns if column not in conflict])
+
+
+    def update_many(self, table: str, key: str, columns: list, rows):
+        """Пакетное обновление UPDATE ... FROM (VALUES ...): строки вида (key, значение столбца 1, ...)"""
+        query = sql.SQL('UPDATE {table} AS t SET {assignments} FROM (VALUES %s) AS v ({names}) WHERE t.{key} = v.{key}').format(
+            table=sql.Identifier(table),
+            assignments=sql.SQL(', ').join(sql.SQL('{0} = v.{0}').format(sql.Identifier(column)) for column in columns),
+            names=sql.SQL(', ').join(map(sql.Identifier, [key] + list(columns))),
+            key=sql.Identifier(key))
+        self.execute_batch(query, rows)
+
+
+    def delete_many(self, table: str, key: str, values):
+        """Удаление строк, у которых key входит в values"""
+        values = list(values)
+        if values:
+            self.execute(sql.SQL('DELETE FROM {} WHERE {} = ANY(%s)').format(sql.Identifier(table), sql.Identifier(key)), (values,))
+
+
+    def copy_from(self, table: str, columns: list, buffer):
+        """Массовая загрузка CSV из буфера через COPY ... FROM STDIN"""
+        if not self.conn:
+            print('Нет подключения к БД')
+            return
+
+        query = sql.SQL('COPY {} ({}) FROM STDIN WITH (FORMAT csv)').format(
+            sql.Identifier(table), sql.SQL(', ').join(map(sql.Identifier, columns)))
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.copy_expert(query, buffer)
+            self._commit()
+        except psycopg2.Error as e:
+            self._rollback()
             print(f'Ошибка: {e}')
             raise
 
@@ -40,23 +189,104 @@ class CONNECTION_DB():
 
 
     def clear_table(self, table: str):
-        query = f"""DELETE FROM {table}"""
+        query = sql.SQL('DELETE FROM {}').format(sql.Identifier(table))
         self.execute(query)
 
 
     def update_table(self, table: str, column: str, value, where: dict):
-        query = f"""UPDATE {table}
-                SET {column} = {value}
-                WHERE {list(where.keys())[0]} = '{list(where.values())[0]}'"""
-        self.execute(query)
+        query = sql.SQL('UPDATE {} SET {} = %s WHERE {} = %s').format(
+            sql.Identifier(table), sql.Identifier(column), sql.Identifier(list(where.keys())[0]))
+        self.execute(query, (value, list(where.values())[0]))
 
 
     def delete_from(self, table: str, where: dict):
-        query = f"""DELETE FROM {table}
-                WHERE {list(where.keys())[0]} = '{list(where.values())[0]}'"""
-        self.execute(query)
+        query = sql.SQL('DELETE FROM {} WHERE {} = %s').format(sql.Identifier(table), sql.Identifier(list(where.keys())[0]))
+        self.execute(query, (list(where.values())[0],))
+
+
+    def _commit(self):
+        # внутри transaction() фиксация откладывается до конца блока
+        if self._transaction_depth == 0:
+            self.conn.commit()
+
+
+    def _rollback(self):
+        if self._transaction_depth == 0:
+            self.conn.rollback()
 
 
     def close(self):
-        if self.conn:
+        if self.conn and not self._pooled:
             self.conn.close()
+
+
+class DB_POOL():
+    """Пул соединений с БД: сессии через контекстный менеджер, проверка соединений и переподключение"""
+    def __init__(self, db_name, db_user, db_password, db_host='localhost', db_port=5432, minconn=1, maxconn=8):
+        self.pool = ThreadedConnectionPool(minconn, maxconn, database=db_name, user=db_user, password=db_password,
+                                           host=db_host, port=db_port, connection_factory=CountingConnection)
+        # ThreadedConnectionPool не ждёт свободного соединения, а сразу падает - ограничиваем выдачу семафором
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self.maxconn = maxconn
+        print('Пул подключений к БД создан')
+
+
+    def _acquire(self):
+        """Соединение из пула с проверкой: разорванные соединения закрываются и заменяются новыми"""
+        conn = self.pool.getconn()
+        try:
+            if conn.closed:
+                raise InterfaceError('connection already closed')
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+        except (OperationalError, InterfaceError):
+            self.pool.putconn(conn, close=True)
+            conn = self.pool.getconn()
+        conn.autocommit = False
+        return conn
+
+
+    @contextmanager
+    def session(self):
+        """Сессия CONNECTION_DB на соединении из пула: всё внутри блока - одна транзакция"""
+        self._slots.acquire()
+        conn = None
+        try:
+            conn = self._acquire()
+            db = CONNECTION_DB.from_connection(conn)
+            with db.transaction():
+                yield db
+        except (OperationalError, InterfaceError):
+            # соединение могло порваться - в пул его не возвращаем
+            if conn is not None:
+                self.pool.putconn(conn, close=True)
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                self.pool.putconn(conn)
+            self._slots.release()
+
+
+    def run(self, func, *args, retries=2, backoff=0.5):
+        """Выполняет func(db, *args) в отдельной сессии, повторяя при обрыве соединения"""
+        for attempt in range(retries + 1):
+            try:
+                with self.session() as db:
+                    return func(db, *args)
+            except (OperationalError, InterfaceError) as e:
+                if attempt == retries:
+                    raise
+                print(f'Ошибка соединения, повтор: {e}')
+                time.sleep(backoff * 2 ** attempt)
+
+
+    def run_parallel(self, func, items, max_workers=None):
+        """Параллельная запись: func(db, item) для каждого элемента, у каждого потока своя сессия"""
+        with ThreadPoolExecutor(max_workers=max_workers or self.maxconn) as executor:
+            return list(executor.map(lambda item: self.run(func, item), items))
+
+
+    def close(self):
+        self.pool.closeall()
@@ -1,53 +1,114 @@
 import pandas as pd
 from datetime import datetime
+from price_store import open_price_store
+from db_candles import create_candles_table, sync_candles
+from db_analytics import add_performance, create_analytics_tables
 
 
+# столбцы таблиц (в нижнем регистре - так PostgreSQL хранит имена, созданные без кавычек)
+RECOMMENDATIONS_COLUMNS = ['name', 'start_price', 'support_line', 'resistance_line', 'buy_by', 'sell_by',
+                           'rsi', 'z_score', 'p_e', 'roe', 'div_yield', 'signal', 'score']
+SIGNALS_COLUMNS = ['ticker_name', 'start_date', 'signal', 'start_price', 'price_now', 'score']
+HISTORY_COLUMNS = ['ticker_name', 'signal', 'start_date', 'end_date', 'start_price', 'end_price', 'delta']
 
-def db_update(db, analysis):
 
-    tickers_in_db = pd.read_sql_query("""SELECT * FROM tickers""",con=db.conn).values
-    new_tickers = pd.read_csv('candles.csv').columns[1:]
-    tickers_records = ', '.join([f"('{ticker}')" for ticker in new_tickers if ticker not in tickers_in_db])
-    columns = '(name)'
-
-    if tickers_records:
-        db.insert_into(table='tickers',columns=columns, values=tickers_records)
+def db_update(db, analysis, close=True):
+    """Синхронизация БД с результатами анализа: все изменения пакетами в одной транзакции"""
+    store = open_price_store()
+    today = datetime.now().date().isoformat()
 
+    tickers_in_db = set(pd.read_sql_query("""SELECT name FROM tickers""", con=db.conn)['name'])
+    table_of_signals = pd.read_sql_query("""SELECT * FROM signals""", db.conn).set_index('ticker_name')
     recommendations = analysis.get_recommendations()
-    recommendations_records = ', '.join([f"{tuple(recommendation)}" for recommendation in recommendations.values])
-    columns = '(name, start_price, support_line, resistance_line, buy_by, sell_by, RSI, Z_score, P_E, ROE, div_yield, signal, score)'
+    signals = pd.concat([analysis.get_buy_list(), analysis.get_sell_list()])
+    last_prices = store.last_prices()
 
-    db.clear_table('recommendations')
-    db.insert_into(table='recommendations', columns=columns, values=recommendations_records)
+    # актуальная цена для всех сигналов в БД
+    price_updates = [(ticker, float(last_prices[ticker])) for ticker in table_of_signals.index if ticker in last_prices.index]
 
+    # разбираем текущие сигналы: продолжение старого сигнала, смена сигнала или новый тикер
+    score_updates, history_rows, closed, signal_rows = signal_changes(table_of_signals, signals, today)
 
-    table_of_signals = pd.read_sql_query("""SELECT * FROM signals""", db.conn).set_index('ticker_name')
-    signals = pd.concat([analysis.get_buy_list(), analysis.get_sell_list()])
-    prices = pd.read_csv('candles.csv').set_index('Date')
-    columns_signals = '(ticker_name, start_date, signal, start_price, price_now, score)'
-    columns_history = '(ticker_name, signal, start_date, end_date, start_price, end_price, delta)'
+    with db.transaction():
+        db.insert_many('tickers', ['name'], [(ticker,) for ticker in store.tickers if ticker not in tickers_in_db],
+                       conflict=['name'])
+
+        # даты DATE, индексы и агрегаты результатов сигналов (создаются при первом запуске)
+        create_analytics_tables(db)
+
+        # история свечей: только новые дни
+        create_candles_table(db)
+        sync_candles(db, store)
+
+        changes = sync_recommendations(db, recommendations)
+
+        db.update_many('signals', 'ticker_name', ['price_now'], price_updates)
+        write_signal_changes(db, score_updates, history_rows, closed, signal_rows)
+
+    if close:
+        db.close()
+    print(f"База данных обновлена (рекомендации: добавлено {changes['inserted']}, "
+          f"изменено {changes['updated']}, удалено {changes['deleted']})")
 
-    for ticker in table_of_signals.index:
-        price_now = prices[ticker].sort_index().iloc[-1]
-        db.update_table('signals', 'price_now', price_now, {'ticker_name': ticker})
 
+def signal_changes(table_of_signals, signals, today):
+    """Разбор сигналов (Акция, Сигнал, Актуальная цена, Score) относительно таблицы signals:
+    продолжение старого сигнала, смена сигнала (старый уходит в историю) или новый тикер"""
+    score_updates, history_rows, closed, signal_rows = [], [], [], []
     for ticker, signal, price_now, score in signals[['Акция', 'Сигнал', 'Актуальная цена', 'Score']].itertuples(index=False):
+        price_now, score = float(price_now), float(score)
         if ticker in table_of_signals.index:
-            db.update_table('signals', 'price_now', price_now, {'ticker_name': ticker})
-            db.update_table('signals', 'score', score, {'ticker_name': ticker})
-            if table_of_signals.loc[ticker, 'signal'] != signal:
-                db.insert_into('history', columns_history, f"""({ticker},
-                            {table_of_signals.loc[ticker, 'signal']},
-                            {table_of_signals.loc[ticker, 'start_date']},
-                            '{datetime.date().isoformat()}',
-                            {table_of_signals.loc[ticker, 'start_price']}
-                            {price_now},
-                            {round((price_now - table_of_signals.loc[ticker, 'start_price']) / table_of_signals.loc[ticker, 'start_price'], 2)})""")
-
-                db.delete_from('signals', {'ticker_name': ticker})
-                db.insert_into('signals', columns_signals, f"('{ticker}', '{datetime.now().date().isoformat()}', '{signal}', {price_now}, {price_now}, {score})")
+            old = table_of_signals.loc[ticker]
+            if old['signal'] == signal:
+                score_updates.append((ticker, price_now, score))
+            else:
+                # сигнал сменился - переносим старый в историю и открываем новый
+                history_rows.append((ticker, old['signal'], old['start_date'], today, old['start_price'], price_now,
+                                     round((price_now - old['start_price']) / old['start_price'], 2)))
+                closed.append(ticker)
+                signal_rows.append((ticker, today, signal, price_now, price_now, score))
         else:
-            db.insert_into('signals', columns_signals, f"('{ticker}', '{datetime.now().date().isoformat()}', '{signal}', {price_now}, {price_now}, {score})")
+            signal_rows.append((ticker, today, signal, price_now, price_now, score))
+    return score_updates, history_rows, closed, signal_rows
+
+
+def write_signal_changes(db, score_updates, history_rows, closed, signal_rows):
+    """Запись результата signal_changes пакетными запросами (агрегаты signal_performance - в той же транзакции)"""
+    with db.transaction():
+        db.update_many('signals', 'ticker_name', ['price_now', 'score'], score_updates)
+        db.insert_many('history', HISTORY_COLUMNS, history_rows)
+        add_performance(db, history_rows)
+        db.delete_many('signals', 'ticker_name', closed)
+        db.insert_many('signals', SIGNALS_COLUMNS, signal_rows)
+
+
+def sync_signals(db, signals, today=None):
+    """Запись сигналов в signals/history без полного обновления БД (для потокового режима)"""
+    today = today or datetime.now().date().isoformat()
+    table_of_signals = pd.read_sql_query("""SELECT * FROM signals""", db.conn).set_index('ticker_name')
+    changes = signal_changes(table_of_signals, signals, today)
+    write_signal_changes(db, *changes)
+    return changes
+
+
+def sync_recommendations(db, recommendations):
+    """Дифференциальная синхронизация таблицы recommendations: пишутся только новые, изменённые и
+    исчезнувшие тикеры. Возвращает счётчик изменений"""
+    new = pd.DataFrame(recommendations.values, columns=RECOMMENDATIONS_COLUMNS).drop_duplicates('name', keep='last').set_index('name')
+    old = pd.read_sql_query("""SELECT * FROM recommendations""", db.conn)
+    old = old.reindex(columns=RECOMMENDATIONS_COLUMNS).drop_duplicates('name', keep='last').set_index('name')
+
+    inserted = new.index.difference(old.index)
+    deleted = old.index.difference(new.index)
+    common = new.index.intersection(old.index)
+    # строка изменилась, если отличается хотя бы одно значение (NaN с NaN считаем равными)
+    new_common, old_common = new.loc[common], old.loc[common]
+    differs = (new_common != old_common) & ~(new_common.isna() & old_common.isna())
+    updated = common[differs.any(axis=1).to_numpy()]
+
+    with db.transaction():
+        db.delete_many('recommendations', 'name', deleted.tolist())
+        db.update_many('recommendations', 'name', RECOMMENDATIONS_COLUMNS[1:], new.loc[updated].reset_index().values.tolist())
+        db.insert_many('recommendations', RECOMMENDATIONS_COLUMNS, new.loc[inserted].reset_index().values.tolist())
 
-    db.close()
-    print('База данных обновлена')
+    return {'inserted': len(inserted), 'updated': len(updated), 'deleted': len(deleted)}
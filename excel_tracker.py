@@ -0,0 +1,148 @@
+import os
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.formatting.rule import CellIsRule, FormulaRule
+from openpyxl.styles import Font, PatternFill
+from openpyxl.utils import get_column_letter
+
+
+TRACKER_PATH = 'stock_tracker.xlsx'
+RECOMMENDATIONS_SHEET = 'Recommendations'
+HISTORY_SHEET = 'Trade_History'
+
+green_fill = PatternFill(start_color='C6EFCE', end_color='C6EFCE', fill_type='solid')  # Светло‑зелёный
+red_fill = PatternFill(start_color='FFC7CE', end_color='FFC7CE', fill_type='solid')    # Светло‑красный
+
+
+def _cache_path(path):
+    root, _ = os.path.splitext(path)
+    return root + '.cache.pkl'
+
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def read_tracker(path=TRACKER_PATH):
+    """Чтение журнала: если файл не менялся с последней записи, листы берутся из быстрого кэша, а не из xlsx"""
+    cache_path = _cache_path(path)
+    if os.path.exists(cache_path):
+        cache = pd.read_pickle(cache_path)
+        if cache['stamp'] == _file_stamp(path):
+            return cache['recommendations'], cache['history']
+
+    recommendations = pd.read_excel(path, index_col='Акция', sheet_name=0, parse_dates=['Дата рекомендации', 'Дата'])
+    history = pd.read_excel(path, index_col='Акция', sheet_name=1)
+    return recommendations, history
+
+
+def update_tracker(recommendations, history, signals, last_prices, today=None):
+    """Обновление журнала одним векторным проходом.
+
+    signals - DataFrame с колонками 'Акция', 'Сигнал' ('Покупка'/'Продажа'), 'Актуальная цена';
+    last_prices - последние цены всех тикеров. Возвращает новые листы Recommendations и Trade_History.
+    """
+    today = pd.Timestamp.now().normalize() if today is None else pd.Timestamp(today).normalize()
+    signals = signals.drop_duplicates('Акция', keep='last').set_index('Акция')
+    tracker = recommendations.copy()
+
+    # актуальная цена обновляется для всех тикеров журнала, даже если сейчас по ним нет сигнала
+    tracked = tracker.index.isin(last_prices.index)
+    tracker.loc[tracked, 'Актуальная цена'] = last_prices.reindex(tracker.index[tracked]).to_numpy()
+
+    known = signals[signals.index.isin(tracker.index)]
+    same = known['Сигнал'].to_numpy() == tracker.loc[known.index, 'Сигнал'].to_numpy()
+
+    # сигнал подтвердился - обновляем дату и цену
+    kept = known.index[same]
+    tracker.loc[kept, 'Дата'] = today
+    tracker.loc[kept, 'Актуальная цена'] = known.loc[kept, 'Актуальная цена']
+    tracker['Изменение (%)'] = ((tracker['Актуальная цена'] - tracker['Начальная цена']) / tracker['Начальная цена'] * 100).round(2)
+
+    # сигнал сменился - переносим тикер в Trade_History и удаляем из Recommendations
+    flipped = known.index[~same]
+    closed = tracker.loc[flipped]
+    new_history = pd.DataFrame({
+        'Сигнал': closed['Сигнал'],
+        'Результат(%)': ((known.loc[flipped, 'Актуальная цена'] - closed['Начальная цена']) / closed['Начальная цена'] * 100).round(2),
+        'Кол-во дней': (today - closed['Дата рекомендации'].dt.normalize()).dt.days,
+    }, index=flipped)
+    tracker = tracker.drop(flipped)
+
+    # новые тикеры добавляются в конец
+    added = signals[~signals.index.isin(recommendations.index)]
+    new_rows = pd.DataFrame({
+        'Начальная цена': added['Актуальная цена'],
+        'Сигнал': added['Сигнал'],
+        'Дата рекомендации': today,
+    }, index=added.index).reindex(columns=tracker.columns).astype(tracker.dtypes.to_dict())
+
+    # пустые таблицы в concat не передаются: у пустого журнала типы столбцов не определены
+    tracker = pd.concat([frame for frame in (tracker, new_rows) if len(frame)]) if len(new_rows) else tracker
+    history = pd.concat([frame for frame in (history, new_history) if len(frame)]) if len(new_history) else history
+    tracker.index.name = history.index.name = 'Акция'
+    return tracker, history
+
+
+def write_tracker(path, recommendations, history):
+    """Потоковая запись журнала (openpyxl write-only), цвета задаются правилами условного форматирования"""
+    workbook = Workbook(write_only=True)
+    sheet = _write_sheet(workbook, RECOMMENDATIONS_SHEET, recommendations)
+    _write_sheet(workbook, HISTORY_SHEET, history)
+
+    columns = ['Акция'] + list(recommendations.columns)
+    if 'Сигнал' in columns and 'Изменение (%)' in columns and len(recommendations):
+        last_row = len(recommendations) + 1
+        signal = _column_letter(columns, 'Сигнал')
+        change = _column_letter(columns, 'Изменение (%)')
+        # Цвет для "Сигнал": зелёный если "Покупка", красный если "Продажа"
+        signal_range = f'{signal}2:{signal}{last_row}'
+        sheet.conditional_formatting.add(signal_range, CellIsRule(operator='equal', formula=['"Покупка"'], fill=green_fill))
+        sheet.conditional_formatting.add(signal_range, CellIsRule(operator='equal', formula=['"Продажа"'], fill=red_fill))
+        # Цвет для "Изменение (%)": рост - хорошо для покупки, падение - для продажи
+        change_range = f'{change}2:{change}{last_row}'
+        buy, sell, value = f'${signal}2="Покупка"', f'${signal}2="Продажа"', f'{change}2'
+        for condition, fill in ((f'AND({buy},ISNUMBER({value}),{value}>=0)', green_fill),
+                                (f'AND({buy},ISNUMBER({value}),{value}<0)', red_fill),
+                                (f'AND({sell},ISNUMBER({value}),{value}<0)', green_fill),
+                                (f'AND({sell},ISNUMBER({value}),{value}>=0)', red_fill)):
+            sheet.conditional_formatting.add(change_range, FormulaRule(formula=[condition], fill=fill))
+
+    workbook.save(path)
+    # запоминаем записанные листы, чтобы при следующем запуске не разбирать xlsx
+    pd.to_pickle({'stamp': _file_stamp(path), 'recommendations': recommendations, 'history': history}, _cache_path(path))
+
+
+def _column_letter(columns, col_name):
+    return get_column_letter(columns.index(col_name) + 1)
+
+
+def _write_sheet(workbook, title, df):
+    """Построчная запись DataFrame (с индексом) в write-only лист"""
+    sheet = workbook.create_sheet(title)
+    header = []
+    for name in [df.index.name] + list(df.columns):
+        cell = WriteOnlyCell(sheet, value=name)
+        cell.font = Font(bold=True)
+        header.append(cell)
+    sheet.append(header)
+
+    date_columns = {i for i, dtype in enumerate(df.dtypes, start=1) if pd.api.types.is_datetime64_any_dtype(dtype)}
+    values = df.astype(object).where(df.notna(), None).itertuples(name=None)
+    for row in values:
+        cells = []
+        for i, value in enumerate(row):
+            if i in date_columns and value is not None:
+                cell = WriteOnlyCell(sheet, value=value.to_pydatetime())
+                cell.number_format = 'YYYY-MM-DD HH:MM:SS'
+                cells.append(cell)
+            elif isinstance(value, np.generic):
+                cells.append(value.item())
+            else:
+                cells.append(value)
+        sheet.append(cells)
+    return sheet
@@ -0,0 +1,141 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import numpy as np
+
+
+class FakeThrottlingError(Exception):
+    """Аналог ошибки API при превышении лимита запросов"""
+    code = SimpleNamespace(name='RESOURCE_EXHAUSTED')
+
+
+class _Quota():
+    """Скользящее окно запросов: отклоняет вызовы сверх limit за period секунд"""
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self.calls = []
+        self.lock = threading.Lock()
+
+
+    def check(self):
+        with self.lock:
+            now = time.monotonic()
+            self.calls = [t for t in self.calls if now - t < self.period]
+            if len(self.calls) >= self.limit:
+                raise FakeThrottlingError('RESOURCE_EXHAUSTED')
+            self.calls.append(now)
+
+
+# шаг свечей и максимальный период запроса GetCandles по внутридневным интервалам
+_INTRADAY = {
+    'CANDLE_INTERVAL_1_MIN': (timedelta(minutes=1), timedelta(days=1)),
+    'CANDLE_INTERVAL_5_MIN': (timedelta(minutes=5), timedelta(days=1)),
+    'CANDLE_INTERVAL_HOUR': (timedelta(hours=1), timedelta(days=7)),
+}
+# лимит периода одного запроса дневных свечей
+_DAY_WINDOW = timedelta(days=365)
+
+
+class FakeClient():
+    """Локальная замена Client для офлайн-проверки загрузки данных:
+    имитирует задержку сети и отказы по квотам, генерирует случайные свечи и отчётности"""
+    def __init__(self, token=None, n_tickers=150, latency=0.05, quota=None, period=1.0, seed=42):
+        self.latency = latency
+        self.rng = np.random.default_rng(seed)
+        # квота - максимальное количество запросов каждого метода за period секунд (None - без ограничений)
+        self.quotas = {method: _Quota(quota, period) for method in ('get_candles', 'get_asset_fundamentals', 'shares')} if quota else {}
+        self.calls = {'get_candles': 0, 'get_asset_fundamentals': 0, 'shares': 0}
+        self.lock = threading.Lock()
+        self._shares = [
+            SimpleNamespace(ticker=f'T{i:04d}', figi=f'FIGI{i:04d}', name=f'Company {i}', asset_uid=f'uid-{i:04d}',
+                            class_code='TQBR', for_qual_investor_flag=False)
+            for i in range(n_tickers)
+        ]
+        self._asset_uids = {share.asset_uid for share in self._shares}
+        self.instruments = SimpleNamespace(shares=self._get_shares, get_asset_fundamentals=self._get_asset_fundamentals)
+        self.market_data = SimpleNamespace(get_candles=self._get_candles)
+
+
+    def __call__(self, token=None):
+        # экземпляр можно передать вместо класса Client: MyClient(token, client_factory=FakeClient(...))
+        return self
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        return False
+
+
+    def _request(self, method):
+        """Имитация сетевого запроса"""
+        with self.lock:
+            self.calls[method] += 1
+        if method in self.quotas:
+            self.quotas[method].check()
+        time.sleep(self.latency)
+
+
+    def _get_shares(self):
+        self._request('shares')
+        return SimpleNamespace(instruments=self._shares)
+
+
+    def _get_candles(self, figi, from_, to, interval=None):
+        self._request('get_candles')
+        if getattr(interval, 'name', None) in _INTRADAY:
+            return self._get_intraday_candles(from_, to, *_INTRADAY[interval.name])
+        if to - from_ > _DAY_WINDOW:
+            raise ValueError(f'period {to - from_} exceeds {_DAY_WINDOW}')
+        days = max(0, (to.date() - from_.date()).days)
+        start = datetime(from_.year, from_.month, from_.day, tzinfo=timezone.utc)
+        with self.lock:
+            steps = self.rng.normal(0, 0.02, days + 1)
+        prices = 100 * np.exp(np.cumsum(steps))
+        candles = []
+        for i, price in enumerate(prices):
+            units = int(price)
+            quotation = SimpleNamespace(units=units, nano=int(round((price - units) * 1e9)))
+            candles.append(SimpleNamespace(time=start + timedelta(days=i), open=quotation, high=quotation,
+                                           low=quotation, close=quotation, volume=1000, is_complete=True))
+        return SimpleNamespace(candles=candles)
+
+
+    def _get_intraday_candles(self, from_, to, step, max_window):
+        """Внутридневные свечи с шагом step в [from_, to); период длиннее лимита API отклоняется"""
+        if to - from_ > max_window:
+            raise ValueError(f'period {to - from_} exceeds {max_window}')
+        step_seconds = int(step.total_seconds())
+        first = -(-int(from_.timestamp()) // step_seconds) * step_seconds
+        times = np.arange(first, int(to.timestamp()), step_seconds)
+        with self.lock:
+            steps = self.rng.normal(0, 0.002, (len(times), 4))
+            volumes = self.rng.integers(1, 1000, len(times))
+        # цены с шагом 0.01 - как у большинства акций
+        prices = np.round(100 * np.exp(np.cumsum(steps, axis=0)), 2)
+        candles = []
+        for time_, row, volume in zip(times, prices, volumes):
+            open_, close = row[0], row[3]
+            high, low = max(row[1], open_, close), min(row[2], open_, close)
+            quotations = [SimpleNamespace(units=int(price), nano=int(round((price - int(price)) * 1e9)))
+                          for price in (open_, high, low, close)]
+            candles.append(SimpleNamespace(time=datetime.fromtimestamp(int(time_), tz=timezone.utc),
+                                           open=quotations[0], high=quotations[1], low=quotations[2],
+                                           close=quotations[3], volume=int(volume), is_complete=True))
+        return SimpleNamespace(candles=candles)
+
+
+    def _get_asset_fundamentals(self, request):
+        self._request('get_asset_fundamentals')
+        fundamentals = [
+            SimpleNamespace(asset_uid=uid, pe_ratio_ttm=10.0, price_to_book_ttm=1.0, roe=15.0,
+                            one_year_annual_revenue_growth_rate=5.0, dividend_yield_daily_ttm=5.0,
+                            total_debt_to_equity_mrq=50.0, beta=1.0, price_to_free_cash_flow_ttm=10.0)
+            for uid in request.assets if uid in self._asset_uids
+        ]
+        return SimpleNamespace(fundamentals=fundamentals)
@@ -0,0 +1,204 @@
+import hashlib
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from indicators import bar_hashes
+from price_store import PRICE_STORE_DIR
+
+
+# каталог кэша производных данных анализа (рядом с хранилищем цен) и его предельный размер
+FEATURE_CACHE_DIR = os.path.join(PRICE_STORE_DIR, 'cache')
+FEATURE_CACHE_MAX_BYTES = 256 * 2**20
+# файл с накопленными суммами доходностей тикеров
+RETURN_STATS_PATH = os.path.join(PRICE_STORE_DIR, 'returns.npz')
+
+
+def content_hash(*parts):
+    """Хэш содержимого: массивы и таблицы - по байтам значений, остальное - по repr"""
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if isinstance(part, (pd.DataFrame, pd.Series)):
+            h.update(pd.util.hash_pandas_object(part, index=True).to_numpy().tobytes())
+            h.update(repr(list(part.columns) if isinstance(part, pd.DataFrame) else part.name).encode())
+        elif isinstance(part, np.ndarray):
+            h.update(repr((part.dtype.str, part.shape)).encode())
+            h.update(np.ascontiguousarray(part).tobytes())
+        else:
+            h.update(repr(part).encode())
+        h.update(b'|')
+    return h.hexdigest()
+
+
+class FeatureCache():
+    """Кэш производных данных на диске: ключ - хэш входных данных и настроек, значение - pickle.
+
+    Каждая запись - отдельный файл; время последнего обращения хранится в mtime файла, при превышении
+    max_bytes удаляются давно не использованные записи (LRU).
+    """
+    def __init__(self, path=FEATURE_CACHE_DIR, max_bytes=FEATURE_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+
+
+    def _file(self, key):
+        return os.path.join(self.path, f'{key}.pkl')
+
+
+    def get(self, key, default=None):
+        path = self._file(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return default
+        # отмечаем обращение для LRU
+        os.utime(path)
+        return value
+
+
+    def put(self, key, value):
+        os.makedirs(self.path, exist_ok=True)
+        path = self._file(key)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.evict()
+
+
+    def evict(self):
+        """Удаление давно не использованных записей, пока кэш больше max_bytes"""
+        if not os.path.isdir(self.path):
+            return
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.pkl'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+
+    def clear(self):
+        if os.path.isdir(self.path):
+            for entry in os.scandir(self.path):
+                if entry.name.endswith('.pkl'):
+                    os.remove(entry.path)
+
+
+class ReturnStats():
+    """Средняя доходность и волатильность тикеров с дозаписью новых дней.
+
+    Как и в Analysis, доходности берутся только за дни, где они есть у всех тикеров (dropna() по всей таблице),
+    поэтому выбор дней общий для всех тикеров: новый тикер или переписанная история любого тикера меняют его
+    для всех, и суммы пересчитываются целиком. Остальное - по тикерам: число дней, суммы доходностей и их
+    квадратов, последняя цена (для доходности следующего дня) и отпечаток учтённых баров каждого тикера
+    (digest, как у IndicatorState) - по отпечаткам строится ключ кэша без хэширования всей матрицы цен.
+    """
+    # массивы, которые сохраняются между запусками (по значению на тикер)
+    _arrays = ('last_filled', 'digest', 'total', 'total_sq')
+
+    def __init__(self, tickers):
+        self.tickers = list(tickers)
+        n = len(self.tickers)
+        # дата последнего учтённого дня (дни от 1970-01-01, минимум int64 - дней не было) и номер записи хранилища
+        self.last_date = np.int64(np.iinfo(np.int64).min)
+        self.store_revision = -1
+        # число общих дней с доходностями - одно на все тикеры
+        self.count = np.int64(0)
+        self.last_filled = np.full(n, np.nan)
+        self.digest = np.zeros(n, dtype=np.uint64)
+        self.total = np.zeros(n)
+        self.total_sq = np.zeros(n)
+
+
+    def update_many(self, prices):
+        """Добавление дней (DataFrame даты × тикеры в порядке self.tickers); уже учтённые даты пропускаются"""
+        if self.last_date != np.iinfo(np.int64).min:
+            prices = prices[prices.index > pd.Timestamp(np.datetime64(int(self.last_date), 'D'))]
+        if prices.empty:
+            return
+        values = prices.to_numpy(dtype=np.float64)
+        days = prices.index.values.astype('datetime64[D]').astype(np.int64)
+        self.digest += np.where(np.isnan(values), np.uint64(0), bar_hashes(days[:, None], values)).sum(axis=0, dtype=np.uint64)
+        # доходности от последней цены с переносом (первый день истории доходности не имеет)
+        filled = pd.DataFrame(np.vstack([self.last_filled, values])).ffill().to_numpy()
+        previous, current = filled[:-1], filled[1:]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = current / previous - 1
+        # дни, которые остаются после dropna() по доходностям всех тикеров (пропуск - нет цены или 0 -> 0)
+        rows = ~(np.isnan(current) | np.isnan(previous) | ((current == 0) & (previous == 0))).any(axis=1)
+        returns = returns[rows]
+        self.count += len(returns)
+        self.total += returns.sum(axis=0)
+        self.total_sq += (returns * returns).sum(axis=0)
+        self.last_filled = filled[-1]
+        self.last_date = days[-1]
+
+
+    def stats(self):
+        """Средняя доходность и волатильность (выборочное стандартное отклонение, как returns.std())"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = self.total / self.count
+            variance = (self.total_sq - self.total * mean) / (self.count - 1)
+        volatility = np.sqrt(np.clip(variance, 0, None)) if self.count > 1 else np.full(len(self.tickers), np.nan)
+        return pd.DataFrame({'Return': mean, 'Volatility': volatility}, index=self.tickers)
+
+
+    def copy(self):
+        state = ReturnStats(self.tickers)
+        state.last_date, state.store_revision, state.count = self.last_date, self.store_revision, self.count
+        for name in self._arrays:
+            setattr(state, name, getattr(self, name).copy())
+        return state
+
+
+    def save(self, path=RETURN_STATS_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, tickers=np.array(self.tickers, dtype=str), last_date=self.last_date, count=self.count,
+                 store_revision=np.int64(self.store_revision), **{name: getattr(self, name) for name in self._arrays})
+        os.replace(tmp_path, path)
+
+
+    @classmethod
+    def load(cls, path=RETURN_STATS_PATH):
+        with np.load(path) as data:
+            state = cls(data['tickers'].tolist())
+            state.last_date, state.count = np.int64(data['last_date']), np.int64(data['count'])
+            state.store_revision = int(data['store_revision'])
+            for name in cls._arrays:
+                setattr(state, name, data[name])
+        return state
+
+
+def return_stats(prices, path=None, store=None):
+    """ReturnStats на последнюю дату prices.
+
+    Если заданы path и store (хранилище, из которого прочитаны prices), сохранённые суммы дополняются только
+    новыми днями - пока набор тикеров тот же, а журнал хранилища не показывает перезаписей учтённых дней.
+    Сохраняются суммы без последней даты: её незавершённая свеча перезаписывается при следующей загрузке.
+    """
+    state = None
+    if path and store is not None and os.path.exists(path):
+        state = ReturnStats.load(path)
+        rewritten = store.rewritten_since(state.store_revision)
+        if state.tickers != list(prices.columns) or rewritten is None or \
+                (rewritten <= pd.Timestamp(np.datetime64(int(state.last_date), 'D'))).any():
+            state = None
+    if state is None:
+        state = ReturnStats(prices.columns)
+    if path and store is not None and len(prices.index):
+        state.update_many(prices[prices.index < prices.index[-1]])
+        state.store_revision = store.revision
+        state.save(path)
+        state = state.copy()
+    state.update_many(prices)
+    return state
@@ -0,0 +1,104 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from profiling import count
+
+
+# Лимиты запросов брокера (запросов в секунду) по методам API.
+# T-Invest API: MarketDataService - 600 запросов в минуту, InstrumentsService - 200 запросов в минуту
+RATE_LIMITS = {
+    'get_candles': 600 / 60,
+    'get_asset_fundamentals': 200 / 60,
+    'shares': 200 / 60,
+}
+
+
+def is_throttling_error(error):
+    """Проверка, что ошибка вызвана превышением лимита запросов (RESOURCE_EXHAUSTED)"""
+    code = getattr(error, 'code', None)
+    return getattr(code, 'name', code) == 'RESOURCE_EXHAUSTED'
+
+
+class TokenBucket():
+    """Потокобезопасный ограничитель частоты запросов по алгоритму token bucket"""
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        # размер "ведра" - сколько запросов можно отправить разом после простоя
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+
+    def acquire(self):
+        """Забирает один токен, при необходимости ожидая его появления"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ConcurrentFetcher():
+    """Параллельное выполнение запросов к API с ограничением частоты и повторами при троттлинге"""
+    def __init__(self, max_workers=8, rate_limits=None, retries=5, backoff=0.5, max_backoff=30.0):
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.buckets = {method: TokenBucket(rate) for method, rate in (rate_limits or RATE_LIMITS).items()}
+        # статистика запросов (с момента создания)
+        self.calls = 0
+        self.throttled = 0
+        self.stats_lock = threading.Lock()
+
+
+    def call(self, method, func, *args):
+        """Вызов функции с учётом лимита метода и повторами с экспоненциальной задержкой"""
+        bucket = self.buckets.get(method)
+        for attempt in range(self.retries + 1):
+            if bucket:
+                bucket.acquire()
+            with self.stats_lock:
+                self.calls += 1
+            count('api_calls')
+            try:
+                return func(*args)
+            except Exception as e:
+                if not is_throttling_error(e) or attempt == self.retries:
+                    raise
+                with self.stats_lock:
+                    self.throttled += 1
+                count('api_retries')
+                time.sleep(min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+    def imap(self, method, func, items):
+        """Параллельно применяет func к каждому элементу items и отдаёт пары (элемент, результат)
+        по мере готовности - обработку первых ответов можно начинать, пока остальные ещё загружаются"""
+        items = list(items)
+        if not items:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as pool:
+            futures = {pool.submit(self.call, method, func, item): item for item in items}
+            try:
+                for future in as_completed(futures):
+                    yield futures[future], future.result()
+            finally:
+                # генератор закрыт досрочно или упал - не начатые запросы отменяем
+                for future in futures:
+                    future.cancel()
+
+
+    def map(self, method, func, items):
+        """Параллельно применяет func к каждому элементу items, возвращает словарь {элемент: результат}"""
+        items = list(items)
+        results = dict(self.imap(method, func, items))
+        # сохраняем исходный порядок элементов
+        return {item: results[item] for item in items}
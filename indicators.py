@@ -0,0 +1,278 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from price_store import PRICE_STORE_DIR
+
+
+# файл с сохранённым состоянием индикаторов (рядом с хранилищем цен)
+INDICATOR_STATE_PATH = os.path.join(PRICE_STORE_DIR, 'indicators.npz')
+# окна индикаторов по умолчанию
+RSI_WINDOW = 14
+Z_WINDOW = 60
+SR_WINDOW = 200
+
+
+# Хвостовые ядра: считают только последнее значение индикатора по матрице (тикеры × окно)
+
+def tail_min(window_values):
+    """Минимум за окно (NaN, если окно заполнено не полностью)"""
+    return window_values.min(axis=1) if window_values.size else np.full(len(window_values), np.nan)
+
+
+def tail_max(window_values):
+    """Максимум за окно (NaN, если окно заполнено не полностью)"""
+    return window_values.max(axis=1) if window_values.size else np.full(len(window_values), np.nan)
+
+
+def tail_mean(window_values):
+    """Среднее за окно (NaN, если окно заполнено не полностью)"""
+    return window_values.mean(axis=1)
+
+
+def tail_std(window_values):
+    """Выборочное стандартное отклонение за окно (ddof=1, как у pandas rolling std)"""
+    return window_values.std(axis=1, ddof=1)
+
+
+def rsi_from_state(avg_gain, avg_loss):
+    """RSI по сглаженным (EWM) средним росту и падения"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = avg_gain / np.where(avg_loss == 0, np.nan, avg_loss)
+        rsi = 100 - (100 / (1 + rs))
+    # нет падений (или нет данных) - RSI = 100, как fillna(100) в полном расчёте
+    return np.where(np.isnan(rsi), 100.0, rsi)
+
+
+def z_score_from_window(window_values, current):
+    """Z-Score последней цены относительно окна"""
+    std = tail_std(window_values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = (current - tail_mean(window_values)) / np.where(std == 0, np.nan, std)
+    return np.where(np.isnan(z), 0.0, z)
+
+
+def bar_hashes(days, values):
+    """Хэши баров (дата, цена) для отпечатка истории тикера: отпечаток - сумма хэшей учтённых баров (uint64
+    с переполнением), поэтому он дополняется при каждом новом баре и не зависит от порядка сложения"""
+    days = np.asarray(days, dtype=np.int64).astype(np.uint64)
+    bits = np.asarray(values, dtype=np.float64).view(np.uint64)
+    with np.errstate(over='ignore'):
+        keys = bits ^ (days * np.uint64(0x9E3779B97F4A7C15))
+    return pd.util.hash_array(np.ravel(keys)).reshape(np.shape(keys))
+
+
+class IndicatorState():
+    """Потоковое состояние индикаторов по всем тикерам.
+
+    Хранит для каждого тикера последнюю цену, EWM-средние роста/падения для RSI и кольцевой буфер
+    последних цен для Z-Score и поддержки/сопротивления. Обновление на один бар стоит O(тикеры),
+    пропуски (NaN) не меняют состояние тикера - как dropna() в поштучном расчёте.
+    digest - отпечаток всех учтённых баров тикера: по нему находятся тикеры с переписанной историей.
+    """
+    # массивы состояния (по строке на тикер)
+    _arrays = ('last_date', 'count', 'last_price', 'avg_gain', 'avg_loss', 'buffer', 'position', 'digest')
+
+    def __init__(self, tickers, rsi_window=RSI_WINDOW, z_window=Z_WINDOW, sr_window=SR_WINDOW):
+        self.tickers = list(tickers)
+        self.rsi_window = rsi_window
+        self.z_window = z_window
+        self.sr_window = sr_window
+        n = len(self.tickers)
+        self.buffer_size = max(z_window, sr_window)
+        # дата последнего учтённого бара (дни от 1970-01-01, минимум int64 - баров не было)
+        self.last_date = np.full(n, np.iinfo(np.int64).min, dtype=np.int64)
+        self.count = np.zeros(n, dtype=np.int64)
+        self.last_price = np.full(n, np.nan)
+        self.avg_gain = np.full(n, np.nan)
+        self.avg_loss = np.full(n, np.nan)
+        self.buffer = np.full((n, self.buffer_size), np.nan)
+        # позиция последней записанной цены в кольцевом буфере
+        self.position = np.full(n, -1, dtype=np.int64)
+        self.digest = np.zeros(n, dtype=np.uint64)
+        # номер записи хранилища цен, по которому сохранено состояние (-1 - неизвестен)
+        self.store_revision = -1
+
+        # коэффициенты EWM(alpha=1/window, adjust=False) в том же виде, что и у pandas
+        com = 1 / (1 / rsi_window) - 1
+        self._alpha = 1 / (1 + com)
+        self._old_weight = 1 - self._alpha
+
+
+    @property
+    def windows(self):
+        return (self.rsi_window, self.z_window, self.sr_window)
+
+
+    def update(self, date, prices):
+        """Обновление состояния одним баром: prices - цены в порядке self.tickers (NaN - нет торгов)"""
+        prices = np.asarray(prices, dtype=np.float64)
+        day = np.datetime64(pd.Timestamp(date).date(), 'D').astype(np.int64)
+        observed = ~np.isnan(prices) & (self.last_date < day)
+        first = observed & (self.count == 0)
+        following = observed & (self.count > 0)
+
+        delta = prices - self.last_price
+        gain = np.where(delta > 0, delta, 0.0)
+        loss = np.where(delta < 0, -delta, 0.0)
+        self.avg_gain[first] = 0.0
+        self.avg_loss[first] = 0.0
+        self.avg_gain[following] = self._ewm(self.avg_gain[following], gain[following])
+        self.avg_loss[following] = self._ewm(self.avg_loss[following], loss[following])
+
+        rows = np.flatnonzero(observed)
+        self.position[rows] = (self.position[rows] + 1) % self.buffer_size
+        self.buffer[rows, self.position[rows]] = prices[rows]
+        self.last_price[rows] = prices[rows]
+        self.count[rows] += 1
+        self.last_date[rows] = day
+        self.digest[rows] += bar_hashes(day, prices[rows])
+
+
+    def update_many(self, prices):
+        """Применение нескольких баров (DataFrame даты × тикеры); уже учтённые даты пропускаются"""
+        prices = prices.reindex(columns=self.tickers)
+        start = self.last_date.min() if len(self.tickers) else 0
+        if start != np.iinfo(np.int64).min:
+            prices = prices[prices.index > pd.Timestamp(np.datetime64(int(start), 'D'))]
+        values = prices.to_numpy(dtype=np.float64)
+        for date, row in zip(prices.index, values):
+            self.update(date, row)
+
+
+    def _ewm(self, average, value):
+        """Шаг EWM с adjust=False (повторяет арифметику pandas, чтобы результат совпадал до бита)"""
+        updated = (self._old_weight * average + self._alpha * value) / (self._old_weight + self._alpha)
+        return np.where(average != value, updated, average)
+
+
+    def _window(self, size):
+        """Последние size цен каждого тикера (тикеры × size); NaN, если цен меньше"""
+        offsets = np.arange(size - 1, -1, -1)
+        columns = (self.position[:, None] - offsets) % self.buffer_size
+        window_values = self.buffer[np.arange(len(self.tickers))[:, None], columns]
+        window_values[self.count < size] = np.nan
+        return window_values
+
+
+    def rsi(self):
+        return pd.Series(rsi_from_state(self.avg_gain, self.avg_loss), index=self.tickers)
+
+
+    def z_score(self):
+        return pd.Series(z_score_from_window(self._window(self.z_window), self.last_price), index=self.tickers)
+
+
+    def support_resistance(self):
+        window_values = self._window(self.sr_window)
+        return pd.Series(tail_min(window_values), index=self.tickers), pd.Series(tail_max(window_values), index=self.tickers)
+
+
+    def copy(self):
+        state = IndicatorState(self.tickers, *self.windows)
+        for name in self._arrays:
+            setattr(state, name, getattr(self, name).copy())
+        state.store_revision = self.store_revision
+        return state
+
+
+    def take(self, rows):
+        """Копия состояния части тикеров (по номерам строк)"""
+        state = IndicatorState([self.tickers[i] for i in rows], *self.windows)
+        for name in self._arrays:
+            setattr(state, name, getattr(self, name)[rows])
+        return state
+
+
+    def reindex(self, tickers):
+        """Состояние для нового набора тикеров: новые тикеры получают пустое состояние"""
+        state = IndicatorState(tickers, *self.windows)
+        positions = {ticker: i for i, ticker in enumerate(self.tickers)}
+        known = [i for i, ticker in enumerate(state.tickers) if ticker in positions]
+        source = [positions[state.tickers[i]] for i in known]
+        for name in self._arrays:
+            getattr(state, name)[known] = getattr(self, name)[source]
+        return state
+
+
+    def reset(self, mask):
+        """Сброс состояния выбранных тикеров (будут пересчитаны с начала истории)"""
+        self.last_date[mask] = np.iinfo(np.int64).min
+        self.count[mask] = 0
+        self.position[mask] = -1
+        self.last_price[mask] = np.nan
+        self.avg_gain[mask] = np.nan
+        self.avg_loss[mask] = np.nan
+        self.buffer[mask] = np.nan
+        self.digest[mask] = 0
+
+
+    def changed_mask(self, prices):
+        """Тикеры, у которых история до последнего учтённого бара изменилась (перезапись или удаление цен
+        на любую дату, например при перезагрузке тикера): отпечаток цен из prices не совпадает с digest"""
+        prices = prices.reindex(columns=self.tickers)
+        values = prices.to_numpy(dtype=np.float64)
+        days = prices.index.values.astype('datetime64[D]').astype(np.int64)
+        counted = ~np.isnan(values) & (days[:, None] <= self.last_date[None, :])
+        digest = np.where(counted, bar_hashes(days[:, None], values), np.uint64(0)).sum(axis=0, dtype=np.uint64)
+        return (self.count > 0) & (digest != self.digest)
+
+
+    def save(self, path=INDICATOR_STATE_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, tickers=np.array(self.tickers, dtype=str), windows=np.array(self.windows),
+                 store_revision=np.int64(self.store_revision), **{name: getattr(self, name) for name in self._arrays})
+        os.replace(tmp_path, path)
+
+
+    @classmethod
+    def load(cls, path=INDICATOR_STATE_PATH):
+        """Чтение состояния; None, если файл записан в старом формате (без части массивов)"""
+        with np.load(path) as data:
+            if any(name not in data.files for name in cls._arrays):
+                return None
+            state = cls(data['tickers'].tolist(), *data['windows'].tolist())
+            for name in cls._arrays:
+                setattr(state, name, data[name])
+            if 'store_revision' in data.files:
+                state.store_revision = int(data['store_revision'])
+        return state
+
+
+def compute_state(prices, path=None, rsi_window=RSI_WINDOW, z_window=Z_WINDOW, sr_window=SR_WINDOW, store=None):
+    """Состояние индикаторов на последнюю дату prices.
+
+    Если задан path, используется сохранённое состояние: к нему применяются только новые бары,
+    а тикеры с переписанной историей пересчитываются с начала. Сохраняется состояние без последней даты,
+    т.к. незавершённая дневная свеча может быть перезаписана при следующей загрузке.
+    store - хранилище, из которого прочитаны prices: переписанные тикеры берутся из его журнала перезаписей,
+    история целиком сравнивается (changed_mask) только без него или если журнал не доходит до состояния.
+    """
+    windows = (rsi_window, z_window, sr_window)
+    state = None
+    if path and os.path.exists(path):
+        state = IndicatorState.load(path)
+        revision = state.store_revision if state is not None else -1
+        state = state.reindex(prices.columns) if state is not None and state.windows == windows else None
+    if state is None:
+        state = IndicatorState(prices.columns, *windows)
+    else:
+        rewritten = store.rewritten_since(revision) if store is not None else None
+        if rewritten is None:
+            state.reset(state.changed_mask(prices))
+        else:
+            # перезапись после последнего учтённого бара тикера состояние не затрагивает
+            first_day = rewritten.reindex(state.tickers)
+            state.reset(first_day.notna().to_numpy() &
+                        (first_day.to_numpy().astype('datetime64[D]').astype(np.int64) <= state.last_date))
+
+    if path and len(prices.index):
+        state.update_many(prices[prices.index < prices.index[-1]])
+        if store is not None:
+            state.store_revision = store.revision
+        state.save(path)
+        state = state.copy()
+    state.update_many(prices)
+    return state
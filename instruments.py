@@ -0,0 +1,102 @@
+import argparse
+import os
+import time
+from datetime import timedelta
+
+import numpy as np
+from t_tech.invest import Client
+
+
+# справочник акций сохраняется между запусками и обновляется не чаще раза в INSTRUMENTS_TTL
+INSTRUMENTS_PATH = 'instruments.npz'
+INSTRUMENTS_TTL = timedelta(days=1)
+
+
+class InstrumentRegistry():
+    """Справочник акций TQBR для неквалифицированных инвесторов: {тикер: {figi, name, UID}}.
+
+    Загружается при первом обращении: из файла, если он свежее ttl, иначе запросом shares() к API.
+    """
+    def __init__(self, token, client_factory=Client, fetcher=None, path=INSTRUMENTS_PATH, ttl=INSTRUMENTS_TTL):
+        self.token = token
+        self.client_factory = client_factory
+        # запрос списка акций идёт через общий ограничитель частоты запросов, если он передан
+        self.fetcher = fetcher
+        self.path = path
+        self.ttl = ttl
+        self._tickers = None
+
+
+    @property
+    def tickers(self):
+        if self._tickers is None:
+            self._tickers = self.load()
+        return self._tickers
+
+
+    def is_stale(self):
+        """Файла нет или он старше ttl"""
+        if not os.path.exists(self.path):
+            return True
+        return time.time() - os.path.getmtime(self.path) > self.ttl.total_seconds()
+
+
+    def load(self):
+        """Справочник из файла, а если он устарел - из API (при ошибке API используется устаревший файл)"""
+        if not self.is_stale():
+            return self._read()
+        try:
+            return self.refresh()
+        except Exception as e:
+            if not os.path.exists(self.path):
+                raise
+            print(f'Не удалось обновить справочник инструментов, используется сохранённый: {e}')
+            return self._read()
+
+
+    def refresh(self):
+        """Принудительная загрузка списка акций из API и сохранение справочника"""
+        with self.client_factory(self.token) as client:
+            if self.fetcher is not None:
+                shares = self.fetcher.call('shares', lambda: client.instruments.shares().instruments)
+            else:
+                shares = client.instruments.shares().instruments
+
+        # фильтрация акций по классу и исключение акций для квалифицированных инвесторов
+        # TQBR — аббревиатура, которая означает «Торги Квалифицированных Биржевых Рынков».
+        # Это основной режим торгов на Московской бирже, предназначенный для торговли акциями.
+        # for_qual_investor_flag = False - отбирает только акции, предназначенные для неквалифицированных инвесторов.
+        self._tickers = {share.ticker: {'figi': share.figi, 'name': share.name, 'UID': share.asset_uid}
+                         for share in shares if share.class_code == 'TQBR' and not share.for_qual_investor_flag}
+        self._write(self._tickers)
+        print(f'Справочник инструментов обновлён: {len(self._tickers)} акций')
+        return self._tickers
+
+
+    def _read(self):
+        with np.load(self.path) as data:
+            return {ticker: {'figi': figi, 'name': name, 'UID': uid}
+                    for ticker, figi, name, uid in zip(data['ticker'].tolist(), data['figi'].tolist(),
+                                                       data['name'].tolist(), data['uid'].tolist())}
+
+
+    def _write(self, tickers):
+        """Компактное хранение: по массиву строк фиксированной длины на поле"""
+        tmp_path = self.path + '.tmp.npz'
+        np.savez(tmp_path,
+                 ticker=np.array(list(tickers), dtype=str),
+                 figi=np.array([values['figi'] for values in tickers.values()], dtype=str),
+                 name=np.array([values['name'] for values in tickers.values()], dtype=str),
+                 uid=np.array([values['UID'] for values in tickers.values()], dtype=str))
+        os.replace(tmp_path, self.path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Справочник акций TQBR')
+    parser.add_argument('--refresh', action='store_true', help='загрузить список акций из API, не дожидаясь истечения срока')
+    args = parser.parse_args()
+
+    from tokens_and_passwords import get_t_bankAPI_token
+    registry = InstrumentRegistry(get_t_bankAPI_token())
+    tickers = registry.refresh() if args.refresh else registry.tickers
+    print(f'Акций в справочнике: {len(tickers)}')
@@ -1,41 +1,103 @@
-from db_config import CONNECTION_DB
+import argparse
+import os
+
+import pandas as pd
+
+from db_config import DB_POOL
 from tokens_and_passwords import get_t_bankAPI_token, get_db_connection
 from data import MyClient
 from analysis import Analysis
 from db_update import db_update
+from excel_tracker import TRACKER_PATH
+from feature_cache import content_hash
+from pipeline import Pipeline, Stage
+from price_store import open_price_store
+from profiling import TIMINGS_PATH, PipelineProfiler
 
 
 
 # получаю токен из заранее созданного фаила, вы можее присвоить токен напрямую
 T_BANK_TOKEN = get_t_bankAPI_token()
+# справочник акций загружается лениво (из instruments.npz), создание клиента не обращается к API
 my_client = MyClient(T_BANK_TOKEN)
 
 
-def main():
-    db = CONNECTION_DB(get_db_connection()[0], get_db_connection()[1], get_db_connection()[2])
-    # создаём файлы candles.csv и fundamentals.csv
-    my_client.get_candles_and_fundamentals()
+def run_analysis(results):
     # подключаем класс анализа
     analysis = Analysis()
     analysis.recommendations()
-    # получаем рекомендации по акциям
-    buy = analysis.get_buy_list()
-    sell = analysis.get_sell_list()
+    return analysis
+
+
+def save_excel(results):
+    analysis = results['analysis']
     # сохраняем в эксель
-    analysis.save_to_excel(buy, sell)
+    analysis.save_to_excel(analysis.get_buy_list(), analysis.get_sell_list())
+
 
-    # обновляем базу данных
-    db_update(db, analysis)
+def excel_inputs(results):
+    """Отпечаток входных данных журнала: сигналы, последние цены, дата (журнал хранит дату подтверждения
+    сигнала) и сам файл - если его правили вручную, журнал пересчитывается"""
+    analysis = results['analysis']
+    stat = os.stat(TRACKER_PATH) if os.path.exists(TRACKER_PATH) else None
+    return content_hash('excel', analysis.get_buy_list(), analysis.get_sell_list(), analysis.get_prices().iloc[-1],
+                        pd.Timestamp.now().normalize(), stat and (stat.st_mtime_ns, stat.st_size))
+
+
+def db_inputs(results):
+    """Отпечаток входных данных БД: рекомендации и хранилище цен (тикеры, даты, последние цены)"""
+    store = open_price_store()
+    return content_hash('db_update', results['analysis'].get_recommendations(), store.tickers, store.dates,
+                        store.last_prices())
+
+
+def main(profiler=None, force=False):
+    # замеры этапов (время, обращения к API и БД, память) - возвращаются из main(), в __main__ пишутся в JSON
+    profiler = profiler or PipelineProfiler()
+    db_name, db_user, db_password = get_db_connection()[:3]
+    db_pool = DB_POOL(db_name, db_user, db_password)
+    stages = [
+        # справочник акций нужен обоим этапам загрузки - читаем его один раз до них
+        Stage('instruments', lambda results: my_client.tickers_TQBR_nocval),
+        # свечи и отчётности загружаются одновременно (у методов API разные лимиты),
+        # свечи каждого тикера разбираются и пишутся в хранилище по мере прихода ответов
+        Stage('candles', lambda results: my_client.sync_candles(), deps=['instruments']),
+        Stage('fundamentals', lambda results: my_client.get_fundamentals(), deps=['instruments']),
+        # отбор акций сравнивает их между собой (IQR, нормализация), поэтому анализ ждёт все тикеры
+        Stage('analysis', run_analysis, deps=['candles', 'fundamentals']),
+        # журнал и БД независимы - пишутся одновременно; при неизменных входных данных этап пропускается
+        Stage('excel', save_excel, deps=['analysis'], inputs=excel_inputs),
+        # обновляем базу данных (сессия из пула, при обрыве соединения запись повторяется)
+        Stage('db', lambda results: db_pool.run(db_update, results['analysis']), deps=['analysis'], inputs=db_inputs),
+    ]
+    try:
+        results = Pipeline(stages, profiler=profiler, force=force).run()
+    finally:
+        db_pool.close()
 
     # выводим в консоль результат
-    print(buy)
+    analysis = results['analysis']
+    print(analysis.get_buy_list())
     print()
-    print(sell)
+    print(analysis.get_sell_list())
     print()
 
     # убеждаемся, что программа завершилась без ошибок
     print('Программа завершилась')
+    return profiler
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description='Загрузка данных, анализ и обновление БД')
+    parser.add_argument('--timings', default=TIMINGS_PATH, help='файл JSON с замерами этапов')
+    parser.add_argument('--profile', choices=['cprofile', 'pyinstrument'], default=None,
+                        help='сохранить дамп профилировщика для каждого этапа (каталог profiles)')
+    parser.add_argument('--trace-memory', action='store_true', help='пик выделенной памяти по этапам (tracemalloc, медленнее)')
+    parser.add_argument('--force', action='store_true', help='выполнить все этапы, даже если входные данные не изменились')
+    args = parser.parse_args()
+
+    profiler = PipelineProfiler(trace_memory=args.trace_memory, profiler=args.profile)
+    try:
+        main(profiler, args.force)
+    finally:
+        profiler.save(args.timings)
@@ -0,0 +1,126 @@
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+
+
+# отпечатки входных данных этапов последнего успешного запуска
+PIPELINE_STATE_PATH = 'pipeline_state.json'
+
+
+class Stage():
+    """Этап запуска: func(results) получает словарь результатов выполненных этапов {имя: результат}.
+
+    deps - этапы, которые должны завершиться раньше. inputs(results) - отпечаток входных данных этапа
+    (строка, например content_hash): если он совпадает с отпечатком прошлого успешного запуска, этап пропускается.
+    После выполнения отпечаток снимается заново - этап может сам менять свои входные данные (например, файл журнала).
+    """
+    def __init__(self, name, func, deps=(), inputs=None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.inputs = inputs
+
+
+class Pipeline():
+    """Планировщик этапов с зависимостями: каждый этап запускается в пуле потоков, как только завершены
+    его зависимости, поэтому независимые этапы (загрузка свечей и отчётностей, запись в Excel и в БД) идут
+    одновременно, а общее время приближается к самой длинной цепочке этапов, а не к их сумме.
+
+    profiler - PipelineProfiler: замеры по этапам (счётчики одновременно идущих этапов пересекаются);
+    если замеры нельзя разделить между этапами (profiler.exclusive - профилировщик или tracemalloc), этапы идут по одному.
+    force=True выполняет все этапы, даже если их входные данные не изменились.
+    """
+    def __init__(self, stages, max_workers=4, state_path=PIPELINE_STATE_PATH, profiler=None, force=False):
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            unknown = [dep for dep in stage.deps if dep not in self.stages]
+            if unknown:
+                raise ValueError(f'Этап {stage.name}: неизвестные зависимости {unknown}')
+        self._check_cycles()
+        self.max_workers = 1 if profiler is not None and profiler.exclusive else max_workers
+        self.state_path = state_path
+        self.profiler = profiler
+        self.force = force
+
+
+    def _check_cycles(self):
+        """Порядок этапов без циклов (иначе ValueError)"""
+        done, visiting = set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f'Циклическая зависимость этапа {name}')
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+
+    def run(self):
+        """Выполнение всех этапов; при ошибке этапа новые этапы не запускаются, запущенные дожидаются
+        завершения, ошибка пробрасывается. Возвращает {имя этапа: результат} (пропущенные этапы - None)"""
+        state = self._load_state()
+        results, running = {}, {}
+        pending = dict(self.stages)
+        error = None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                if error is None:
+                    for name, stage in list(pending.items()):
+                        if all(dep in results for dep in stage.deps):
+                            del pending[name]
+                            fingerprint = stage.inputs(results) if stage.inputs else None
+                            if not self.force and fingerprint is not None and state.get(name) == fingerprint:
+                                print(f'[{name}] входные данные не изменились, этап пропущен')
+                                results[name] = None
+                                continue
+                            running[pool.submit(self._run_stage, stage, dict(results))] = name
+                    # пропуск этапа мог открыть следующие - проверяем ещё раз
+                    if any(all(dep in results for dep in stage.deps) for stage in pending.values()):
+                        continue
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        error = error or e
+                        continue
+                    stage = self.stages[name]
+                    if stage.inputs is not None:
+                        state[name] = stage.inputs(results)
+        # отпечатки сохраняются и при ошибке - для этапов, которые успели выполниться
+        self._save_state(state)
+        if error is not None:
+            raise error
+        return results
+
+
+    def _run_stage(self, stage, results):
+        with self.profiler.stage(stage.name) if self.profiler is not None else nullcontext():
+            return stage.func(results)
+
+
+    def _load_state(self):
+        if self.state_path is None or not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path, encoding='utf-8') as f:
+            return json.load(f)
+
+
+    def _save_state(self, state):
+        if self.state_path is None:
+            return
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
@@ -0,0 +1,315 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# каталог бинарного хранилища цен и CSV-файл для импорта/экспорта
+PRICE_STORE_DIR = 'prices'
+CANDLES_CSV = 'candles.csv'
+
+
+class PriceStore():
+    """Колоночное хранилище цен закрытия.
+
+    Цены лежат в бинарном файле как матрица float64 (тикеры × даты) и открываются через memmap.
+    Каждый тикер - непрерывная строка с запасом места под новые даты, поэтому:
+    - чтение части тикеров не загружает остальные;
+    - новые дни дописываются на место, без перезаписи файла;
+    - новые тикеры дописываются в конец файла.
+
+    revision растёт с каждой записью. Журнал перезаписей (journal) хранит для последних записей самую раннюю
+    дату, на которой изменилась уже сохранённая история тикера (кроме последней даты - её незавершённая свеча
+    перезаписывается каждый день): по нему производные данные (состояние индикаторов) находят тикеры,
+    которые нужно пересчитать, не сравнивая всю историю.
+    """
+    # шаг, с которым растёт запас места под даты
+    DATE_CHUNK = 256
+    # сколько последних записей с перезаписями истории хранит журнал
+    JOURNAL_SIZE = 64
+
+    def __init__(self, path=PRICE_STORE_DIR):
+        self.path = path
+        self._meta_path = os.path.join(path, 'meta.json')
+        self._data_path = os.path.join(path, 'close.bin')
+        self._dates_path = os.path.join(path, 'dates.bin')
+        self._load_meta()
+
+
+    def _load_meta(self):
+        """Чтение индекса тикеров и размеров матрицы"""
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+        else:
+            meta = {'tickers': [], 'n_dates': 0, 'capacity': 0}
+        self.tickers = meta['tickers']
+        self.n_dates = meta['n_dates']
+        self.capacity = meta['capacity']
+        # хранилища без журнала: журнал начинается с текущей записи
+        self.revision = meta.get('revision', 0)
+        self.journal_start = meta.get('journal_start', self.revision)
+        self.journal = meta.get('journal', [])
+        self._ticker_pos = {ticker: i for i, ticker in enumerate(self.tickers)}
+
+
+    def _save_meta(self):
+        """Атомарная запись индекса (пишется последним, после данных)"""
+        tmp_path = self._meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'tickers': self.tickers, 'n_dates': self.n_dates, 'capacity': self.capacity,
+                       'revision': self.revision, 'journal_start': self.journal_start, 'journal': self.journal},
+                      f, ensure_ascii=False)
+        os.replace(tmp_path, self._meta_path)
+
+
+    def exists(self):
+        return os.path.exists(self._meta_path)
+
+
+    def _matrix(self, mode='r'):
+        """Матрица цен (тикеры × capacity) без загрузки в память"""
+        if not self.tickers or not self.capacity:
+            return np.full((len(self.tickers), 0), np.nan)
+        return np.memmap(self._data_path, dtype=np.float64, mode=mode, shape=(len(self.tickers), self.capacity))
+
+
+    def _dates(self, mode='r'):
+        """Даты как количество дней от 1970-01-01"""
+        if not self.capacity:
+            return np.empty(0, dtype=np.int64)
+        return np.memmap(self._dates_path, dtype=np.int64, mode=mode, shape=(self.capacity,))
+
+
+    @property
+    def dates(self):
+        days = np.asarray(self._dates()[:self.n_dates])
+        return pd.DatetimeIndex(days.astype('datetime64[D]').astype('datetime64[ns]'), name='Date')
+
+
+    def read(self, tickers=None, start=None, end=None):
+        """Чтение цен в DataFrame (даты × тикеры), можно ограничить набор тикеров и диапазон дат"""
+        dates = self.dates
+        lo = dates.searchsorted(pd.Timestamp(start)) if start is not None else 0
+        hi = dates.searchsorted(pd.Timestamp(end), side='right') if end is not None else self.n_dates
+        matrix = self._matrix()
+        if tickers is None:
+            columns = list(self.tickers)
+            # срез memmap - без копирования данных
+            block = matrix[:, lo:hi]
+        else:
+            columns = [ticker for ticker in tickers if ticker in self._ticker_pos]
+            # читаются только строки запрошенных тикеров
+            block = matrix[[self._ticker_pos[ticker] for ticker in columns], lo:hi]
+        return pd.DataFrame(block.T, index=dates[lo:hi], columns=columns)
+
+
+    def rewritten_since(self, revision):
+        """Самая ранняя перезаписанная дата каждого тикера, история которого менялась после записи revision
+        (Series тикер -> дата); None, если журнал не доходит до revision (нужно сравнить историю целиком)"""
+        if revision < self.journal_start:
+            return None
+        days = {}
+        for entry_revision, rewrites in self.journal:
+            if entry_revision > revision:
+                for ticker, day in rewrites.items():
+                    days[ticker] = min(day, days.get(ticker, day))
+        return pd.Series(np.array(list(days.values()), dtype='datetime64[D]').astype('datetime64[ns]'),
+                         index=list(days), dtype='datetime64[ns]')
+
+
+    def write(self, df):
+        """Полная перезапись хранилища из DataFrame (даты × тикеры); журнал перезаписей начинается заново"""
+        self._write(self._prepare(df))
+        self.journal = []
+        self.journal_start = self.revision
+        self._save_meta()
+
+
+    def _write(self, df):
+        """Запись матрицы и дат целиком, meta.json сохраняет вызывающий"""
+        os.makedirs(self.path, exist_ok=True)
+        n_dates = len(df.index)
+        capacity = self._capacity_for(n_dates)
+
+        matrix = np.full((len(df.columns), capacity), np.nan)
+        matrix[:, :n_dates] = df.to_numpy(dtype=np.float64).T
+        days = np.zeros(capacity, dtype=np.int64)
+        days[:n_dates] = df.index.values.astype('datetime64[D]').astype(np.int64)
+
+        self._replace_file(self._data_path, matrix)
+        self._replace_file(self._dates_path, days)
+        self.tickers = list(df.columns)
+        self.n_dates = n_dates
+        self.capacity = capacity
+        self._ticker_pos = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.revision += 1
+
+
+    def upsert(self, df):
+        """Добавление/обновление цен: новые значения перезаписывают старые, NaN в df данные не затирают"""
+        df = self._prepare(df).dropna(how='all')
+        if df.empty:
+            return
+        if not self.exists():
+            self.write(df)
+            return
+
+        dates = self.dates
+        new_dates = df.index[~df.index.isin(dates)]
+        if len(new_dates) and self.n_dates and new_dates[0] <= dates[-1]:
+            # даты внутри уже сохранённой истории - перестраиваем хранилище целиком (редкий случай),
+            # история тикеров из df считается перезаписанной с их первой даты в df
+            first = df.apply(pd.Series.first_valid_index).dropna()
+            self._write(df.combine_first(self.read()))
+            self._log_rewrites({ticker: day for ticker, day in first.items() if day <= dates[-1]})
+            self._save_meta()
+            return
+
+        n_dates = self.n_dates + len(new_dates)
+        if n_dates > self.capacity:
+            self._grow(self._capacity_for(n_dates))
+
+        # новые тикеры дописываются в конец файла строками из NaN; файл сначала обрезается до размера
+        # из meta.json - строки, дописанные прерванным запуском, иначе сдвинули бы новые тикеры
+        new_tickers = [ticker for ticker in df.columns if ticker not in self._ticker_pos]
+        if new_tickers:
+            with open(self._data_path, 'r+b') as f:
+                f.truncate(len(self.tickers) * self.capacity * np.dtype(np.float64).itemsize)
+                f.seek(0, os.SEEK_END)
+                np.full((len(new_tickers), self.capacity), np.nan).tofile(f)
+            self.tickers = self.tickers + new_tickers
+            self._ticker_pos = {ticker: i for i, ticker in enumerate(self.tickers)}
+
+        # новые даты дописываются в запас места на месте
+        if len(new_dates):
+            days = self._dates('r+')
+            days[self.n_dates:n_dates] = new_dates.values.astype('datetime64[D]').astype(np.int64)
+            days.flush()
+
+        all_dates = dates.append(new_dates)
+        date_pos = all_dates.get_indexer(df.index)
+        matrix = self._matrix('r+')
+        values = df.to_numpy(dtype=np.float64)
+        # изменённые значения на датах до последней сохранённой - в журнал перезаписей
+        history = date_pos < self.n_dates - 1
+        rewrites = {}
+        for j, ticker in enumerate(df.columns):
+            mask = ~np.isnan(values[:, j])
+            row = self._ticker_pos[ticker]
+            changed = mask & history
+            changed[changed] = ~(matrix[row, date_pos[changed]] == values[changed, j])
+            if changed.any():
+                rewrites[ticker] = df.index[np.argmax(changed)]
+            matrix[row, date_pos[mask]] = values[mask, j]
+        matrix.flush()
+
+        self.n_dates = n_dates
+        self.revision += 1
+        self._log_rewrites(rewrites)
+        self._save_meta()
+
+
+    def _log_rewrites(self, rewrites):
+        """Запись в журнал тикеров с перезаписанной историей {тикер: самая ранняя изменённая дата}"""
+        if not rewrites:
+            return
+        self.journal.append([self.revision, {ticker: int(np.datetime64(pd.Timestamp(day).date(), 'D').astype(np.int64))
+                                             for ticker, day in rewrites.items()}])
+        if len(self.journal) > self.JOURNAL_SIZE:
+            self.journal = self.journal[-self.JOURNAL_SIZE:]
+            # более ранние записи вытеснены - журнал полон только начиная с первой оставшейся
+            self.journal_start = self.journal[0][0] - 1
+
+
+    def last_valid_dates(self):
+        """Последняя дата с ценой для каждого тикера (NaT, если цен нет); читается только хвост истории"""
+        positions = self._last_valid_positions()
+        dates = self.dates
+        result = pd.Series(pd.NaT, index=self.tickers, dtype='datetime64[ns]')
+        found = positions >= 0
+        result[found] = dates[positions[found]]
+        return result
+
+
+    def last_prices(self):
+        """Последняя известная цена каждого тикера"""
+        positions = self._last_valid_positions()
+        matrix = self._matrix()
+        prices = np.full(len(self.tickers), np.nan)
+        found = np.flatnonzero(positions >= 0)
+        prices[found] = matrix[found, positions[found]]
+        return pd.Series(prices, index=self.tickers)
+
+
+    def to_csv(self, csv_path=CANDLES_CSV):
+        """Экспорт в CSV"""
+        self.read().to_csv(csv_path, encoding='utf-8')
+
+
+    @classmethod
+    def from_csv(cls, csv_path=CANDLES_CSV, path=PRICE_STORE_DIR):
+        """Импорт из CSV"""
+        store = cls(path)
+        store.write(pd.read_csv(csv_path, index_col='Date', parse_dates=['Date']))
+        return store
+
+
+    def _last_valid_positions(self, block_size=64):
+        """Индекс последнего не-NaN значения для каждого тикера (-1, если значений нет)"""
+        matrix = self._matrix()
+        positions = np.full(len(self.tickers), -1, dtype=np.int64)
+        unresolved = np.arange(len(self.tickers))
+        hi = self.n_dates
+        # идём от конца истории блоками, пока не найдём значения для всех тикеров
+        while len(unresolved) and hi > 0:
+            lo = max(0, hi - block_size)
+            valid = ~np.isnan(matrix[unresolved, lo:hi])
+            has_value = valid.any(axis=1)
+            last = hi - 1 - np.argmax(valid[:, ::-1], axis=1)
+            positions[unresolved[has_value]] = last[has_value]
+            unresolved = unresolved[~has_value]
+            hi = lo
+        return positions
+
+
+    def _grow(self, capacity):
+        """Увеличение запаса места под даты (перекладка матрицы)"""
+        matrix = np.full((len(self.tickers), capacity), np.nan)
+        matrix[:, :self.n_dates] = self._matrix()[:, :self.n_dates]
+        days = np.zeros(capacity, dtype=np.int64)
+        days[:self.n_dates] = self._dates()[:self.n_dates]
+        self._replace_file(self._data_path, matrix)
+        self._replace_file(self._dates_path, days)
+        self.capacity = capacity
+        self._save_meta()
+
+
+    def _capacity_for(self, n_dates):
+        return (n_dates // self.DATE_CHUNK + 1) * self.DATE_CHUNK
+
+
+    @staticmethod
+    def _prepare(df):
+        """Приведение индекса к дневным датам, сортировка"""
+        df = pd.DataFrame(df)
+        df.index = pd.to_datetime(df.index).normalize()
+        df.index.name = 'Date'
+        df = df[~df.index.duplicated(keep='last')]
+        return df.sort_index()
+
+
+    @staticmethod
+    def _replace_file(path, array):
+        tmp_path = path + '.tmp'
+        array.tofile(tmp_path)
+        os.replace(tmp_path, path)
+
+
+def open_price_store(path=PRICE_STORE_DIR, csv_path=CANDLES_CSV):
+    """Открытие хранилища цен; при первом запуске оно создаётся из CSV, если тот существует"""
+    store = PriceStore(path)
+    if not store.exists() and os.path.exists(csv_path):
+        store = PriceStore.from_csv(csv_path, path)
+    return store
@@ -0,0 +1,197 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # модуль только для POSIX: в Windows пик процесса - по замерам фонового опроса памяти
+    resource = None
+
+
+# куда пишутся замеры запуска и дампы профилировщика
+TIMINGS_PATH = 'timings.json'
+PROFILE_DIR = 'profiles'
+# период опроса памяти процесса во время этапа, секунд
+RSS_SAMPLE_INTERVAL = 0.01
+
+# счётчики событий всего процесса: запросы к API, повторы, обращения к БД
+counters = Counter()
+_counters_lock = threading.Lock()
+
+
+def count(name, n=1):
+    """Увеличение счётчика (вызывается из любых потоков)"""
+    with _counters_lock:
+        counters[name] += n
+
+
+def _peak_rss_mb():
+    """Пиковый объём памяти процесса с момента запуска (ru_maxrss: КБ в Linux, байты в macOS); None без resource"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+
+def _current_rss_mb():
+    """Текущий объём памяти процесса: /proc/self/statm в Linux, иначе psutil (если установлен), иначе None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss / 2**20
+
+
+class _RssSampler(threading.Thread):
+    """Фоновый опрос памяти процесса: максимум за время этапа (ru_maxrss - пик за всю жизнь процесса)"""
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = _current_rss_mb()
+        self._stop_event = threading.Event()
+
+
+    def run(self):
+        if self.peak is None:
+            return
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, _current_rss_mb())
+
+
+    def stop(self):
+        """Остановка опроса, пик памяти этапа в МБ (None - память процесса не узнать)"""
+        self._stop_event.set()
+        self.join()
+        if self.peak is None:
+            return None
+        return round(max(self.peak, _current_rss_mb()), 1)
+
+
+class PipelineProfiler():
+    """Замеры этапов запуска: время (реальное и процессорное), счётчики и пиковая память по каждому этапу.
+
+    peak_rss_mb - максимум памяти процесса, замеченный фоновым опросом за время этапа. cpu_s - процессорное
+    время всего процесса за время этапа (вместе с потоками этапа, например запросами к API, но и с одновременно
+    идущими этапами), thread_cpu_s - только потока, в котором выполнялся этап.
+    trace_memory=True включает tracemalloc - пик выделенной памяти внутри этапа (заметно замедляет работу).
+    profiler='cprofile' или 'pyinstrument' сохраняет дамп профилировщика каждого этапа в каталог PROFILE_DIR.
+    """
+    def __init__(self, trace_memory=False, profiler=None, profile_dir=PROFILE_DIR):
+        self.trace_memory = trace_memory
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self.stages = []
+        self.started_at = datetime.now()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+    @property
+    def exclusive(self):
+        """Замеры, которые нельзя разделить между одновременными этапами: профилировщик один на процесс
+        (в Python 3.12+ второй cProfile.enable() падает с ValueError), пик tracemalloc тоже общий для процесса,
+        поэтому этапы выполняются по одному"""
+        return self.profiler is not None or self.trace_memory
+
+
+    @contextmanager
+    def stage(self, name):
+        """Замер этапа: with profiler.stage('analysis'): ..."""
+        before = counters.copy()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        profile = self._start_profile()
+        sampler = _RssSampler()
+        sampler.start()
+        wall, cpu, thread_cpu = time.perf_counter(), time.process_time(), time.thread_time()
+        try:
+            yield
+        finally:
+            record = {
+                'stage': name,
+                'wall_s': round(time.perf_counter() - wall, 4),
+                'cpu_s': round(time.process_time() - cpu, 4),
+                'thread_cpu_s': round(time.thread_time() - thread_cpu, 4),
+                'peak_rss_mb': sampler.stop(),
+            }
+            if self.trace_memory:
+                record['peak_traced_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+            record['counters'] = {key: value - before.get(key, 0) for key, value in counters.items() if value != before.get(key, 0)}
+            self._stop_profile(profile, name)
+            self.stages.append(record)
+            print(f"[{name}] {record['wall_s']:.2f} с (CPU {record['cpu_s']:.2f} с), память {record['peak_rss_mb']} МБ")
+
+
+    def _start_profile(self):
+        if self.profiler == 'cprofile':
+            profile = cProfile.Profile()
+            profile.enable()
+            return profile
+        if self.profiler == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                print('pyinstrument не установлен (pip install pyinstrument), профилирование этапа пропущено')
+                return None
+            profile = Profiler()
+            profile.start()
+            return profile
+        return None
+
+
+    def _stop_profile(self, profile, name):
+        if profile is None:
+            return
+        os.makedirs(self.profile_dir, exist_ok=True)
+        if self.profiler == 'cprofile':
+            profile.disable()
+            profile.dump_stats(os.path.join(self.profile_dir, f'{name}.prof'))
+        else:
+            profile.stop()
+            with open(os.path.join(self.profile_dir, f'{name}.html'), 'w', encoding='utf-8') as f:
+                f.write(profile.output_html())
+
+
+    def _peak_rss_mb(self):
+        """Пик памяти запуска: ru_maxrss, а без модуля resource - максимум опроса по этапам и текущий объём"""
+        peak = _peak_rss_mb()
+        if peak is not None:
+            return peak
+        samples = [stage['peak_rss_mb'] for stage in self.stages if stage['peak_rss_mb'] is not None]
+        current = _current_rss_mb()
+        if current is not None:
+            samples.append(round(current, 1))
+        return max(samples, default=None)
+
+
+    def report(self):
+        return {
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'wall_s': round(time.perf_counter() - self._wall, 4),
+            'cpu_s': round(time.process_time() - self._cpu, 4),
+            'peak_rss_mb': self._peak_rss_mb(),
+            'counters': dict(counters),
+            'stages': self.stages,
+        }
+
+
+    def save(self, path=TIMINGS_PATH):
+        """Запись замеров в JSON"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+        print(f'Замеры этапов сохранены в {path}')
@@ -0,0 +1,325 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.cluster.hierarchy import fcluster, linkage
+from scipy.optimize import minimize
+from scipy.spatial.distance import squareform
+
+from price_store import PRICE_STORE_DIR
+
+
+# файл с сохранённым окном доходностей (рядом с хранилищем цен)
+RISK_STATE_PATH = os.path.join(PRICE_STORE_DIR, 'risk.npz')
+# окно доходностей для ковариации (торговых дней) и минимум общих дней для пары тикеров
+RISK_WINDOW = 250
+RISK_MIN_PERIODS = 60
+# порог корреляции, начиная с которого кандидаты на покупку считаются одним кластером
+CLUSTER_THRESHOLD = 0.7
+TRADING_DAYS = 252
+
+
+def ledoit_wolf_shrinkage(deviations):
+    """Интенсивность сжатия Ледуа-Вольфа к масштабированной единичной матрице (формула sklearn
+    ledoit_wolf_shrinkage); deviations - отклонения доходностей от средних (дни × тикеры), пропуски = 0.
+    Матрицы тикеры × тикеры считаются в типе deviations, суммы - в float64"""
+    n_samples, n_features = deviations.shape
+    if n_samples == 0 or n_features == 0:
+        return 0.0
+    x = deviations
+    x2 = x ** 2
+    emp_cov_trace = x2.sum(axis=0, dtype=np.float64) / n_samples
+    mu = emp_cov_trace.sum() / n_features
+    beta_ = (x2.T @ x2).sum(dtype=np.float64)
+    delta_ = np.square(x.T @ x).sum(dtype=np.float64) / n_samples ** 2
+    beta = 1.0 / (n_features * n_samples) * (beta_ / n_samples - delta_)
+    delta = (delta_ - 2.0 * mu * emp_cov_trace.sum() + n_features * mu ** 2) / n_features
+    beta = min(beta, delta)
+    return 0.0 if beta == 0 else float(beta / delta)
+
+
+class RiskState():
+    """Ковариация доходностей всех тикеров в скользящем окне, обновляемая по мере добавления дней.
+
+    Хранит кольцевой буфер последних window дневных доходностей (дни × тикеры) и суммы по парам тикеров:
+    Σx·y, Σx (по дням, где есть обе доходности) и число общих дней. Новые дни добавляются, а выпавшие
+    из окна вычитаются матричным умножением (обновление ранга k за O(k × тикеры²) без циклов по парам),
+    поэтому ковариация по всей вселенной не пересчитывается заново каждый день. Суммы и буфер хранятся
+    в dtype (по умолчанию float32 - вдвое меньше памяти), раз в window обновлений суммы пересобираются
+    из буфера, чтобы не копилась ошибка округления. Пропуски (NaN) исключаются попарно, как в DataFrame.cov().
+    """
+    # массивы, которые сохраняются между запусками (суммы пересобираются из буфера при загрузке)
+    _arrays = ('last_date', 'last_price', 'returns', 'position', 'filled')
+
+    def __init__(self, tickers, window=RISK_WINDOW, dtype=np.float32):
+        self.tickers = list(tickers)
+        self.window = window
+        self.dtype = np.dtype(dtype)
+        n = len(self.tickers)
+        # дата последнего учтённого дня (дни от 1970-01-01, минимум int64 - дней не было)
+        self.last_date = np.int64(np.iinfo(np.int64).min)
+        self.last_price = np.full(n, np.nan)
+        self.returns = np.full((window, n), np.nan, dtype=self.dtype)
+        # позиция последней записанной строки буфера и число заполненных строк
+        self.position = np.int64(-1)
+        self.filled = np.int64(0)
+        self._rebuild()
+
+
+    def update(self, date, prices):
+        """Добавление одного дня: prices - цены в порядке self.tickers (NaN - нет торгов)"""
+        self.update_many(pd.DataFrame([np.asarray(prices, dtype=np.float64)], index=[pd.Timestamp(date)],
+                                      columns=self.tickers))
+
+
+    def update_many(self, prices):
+        """Добавление нескольких дней (DataFrame даты × тикеры); уже учтённые даты пропускаются.
+        Доходность считается от последней известной цены тикера, день без торгов - пропуск"""
+        prices = prices.reindex(columns=self.tickers)
+        if self.last_date != np.iinfo(np.int64).min:
+            prices = prices[prices.index > pd.Timestamp(np.datetime64(int(self.last_date), 'D'))]
+        if prices.empty:
+            return
+        values = prices.to_numpy(dtype=np.float64)
+        previous = pd.DataFrame(np.vstack([self.last_price, values])).ffill().to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = values / previous[:-1] - 1
+        returns[~np.isfinite(returns)] = np.nan
+        self.last_price = previous[-1]
+        self.last_date = np.datetime64(prices.index[-1].date(), 'D').astype(np.int64)
+        # дни без единой доходности (первая цена в истории, выходные) окно не занимают
+        returns = returns[~np.isnan(returns).all(axis=1)].astype(self.dtype)
+        if len(returns):
+            self._push(returns)
+
+
+    def _push(self, rows):
+        """Запись строк в кольцевой буфер и обновление сумм на разницу между добавленными и вытесненными"""
+        k = min(len(rows), self.window)
+        rows = rows[-k:]
+        slots = (self.position + 1 + np.arange(k)) % self.window
+        # первые window - filled позиций свободны, остальные вытесняют самые старые строки окна
+        removed = self.returns[slots[self.window - self.filled:]] if self.filled + k > self.window else None
+        self.returns[slots] = rows
+        self.position = np.int64(slots[-1])
+        self.filled = np.int64(min(self.filled + k, self.window))
+        self._updates += k
+        if self._updates >= self.window:
+            self._rebuild()
+            return
+        self._accumulate(rows, 1)
+        if removed is not None:
+            self._accumulate(removed, -1)
+
+
+    def _accumulate(self, rows, sign):
+        valid = ~np.isnan(rows)
+        x = np.where(valid, rows, 0).astype(self.dtype)
+        m = valid.astype(self.dtype)
+        self._sxy += sign * (x.T @ x)
+        self._sx += sign * (x.T @ m)
+        self._n += sign * (m.T @ m)
+
+
+    def _rebuild(self):
+        """Суммы по парам заново из буфера"""
+        n = len(self.tickers)
+        self._sxy = np.zeros((n, n), dtype=self.dtype)
+        self._sx = np.zeros((n, n), dtype=self.dtype)
+        self._n = np.zeros((n, n), dtype=self.dtype)
+        self._updates = 0
+        self._accumulate(self._rows(), 1)
+
+
+    def _rows(self):
+        """Заполненные строки буфера от старых к новым"""
+        order = (self.position + 1 + np.arange(self.window)) % self.window
+        return self.returns[order[self.window - self.filled:]]
+
+
+    def covariance(self, min_periods=RISK_MIN_PERIODS, shrink=True):
+        """Ковариация дневных доходностей (тикеры × тикеры, dtype состояния). Пары, у которых общих дней
+        меньше min_periods, - NaN (при сжатии - 0). shrink=True - сжатие Ледуа-Вольфа к единичной матрице"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = (self._sxy - self._sx * self._sx.T / self._n) / (self._n - 1)
+        cov[self._n < max(min_periods, 2)] = np.nan
+        if shrink:
+            intensity = self.shrinkage()
+            cov = np.nan_to_num(cov, nan=0.0)
+            mu = np.trace(cov) / max(len(self.tickers), 1)
+            cov *= 1 - intensity
+            cov[np.diag_indices_from(cov)] += intensity * mu
+        return pd.DataFrame(cov, index=self.tickers, columns=self.tickers)
+
+
+    def correlation(self, min_periods=RISK_MIN_PERIODS, shrink=True):
+        """Корреляция - ковариация, нормированная на дисперсии с диагонали"""
+        cov = self.covariance(min_periods, shrink)
+        std = np.sqrt(np.diag(cov.to_numpy()))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = np.clip(cov.to_numpy() / np.outer(std, std), -1, 1)
+        return pd.DataFrame(corr, index=self.tickers, columns=self.tickers)
+
+
+    def shrinkage(self):
+        """Интенсивность сжатия Ледуа-Вольфа по доходностям окна"""
+        rows = self._rows()
+        valid = ~np.isnan(rows)
+        values = np.where(valid, rows, 0)
+        means = values.sum(axis=0) / np.maximum(valid.sum(axis=0), 1)
+        return ledoit_wolf_shrinkage(np.where(valid, values - means, 0).astype(self.dtype))
+
+
+    def take(self, tickers):
+        """Состояние части тикеров"""
+        positions = {ticker: i for i, ticker in enumerate(self.tickers)}
+        return self._select(tickers, [positions[ticker] for ticker in tickers])
+
+
+    def reindex(self, tickers):
+        """Состояние для нового набора тикеров: у новых тикеров в окне пропуски"""
+        positions = {ticker: i for i, ticker in enumerate(self.tickers)}
+        return self._select(tickers, [positions.get(ticker, -1) for ticker in tickers])
+
+
+    def _select(self, tickers, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        known = rows >= 0
+        state = RiskState(tickers, self.window, self.dtype)
+        state.last_date, state.position, state.filled = self.last_date, self.position, self.filled
+        state.last_price[known] = self.last_price[rows[known]]
+        state.returns[:, known] = self.returns[:, rows[known]]
+        state._rebuild()
+        return state
+
+
+    def matches(self, prices):
+        """Совпадают ли последние известные цены с prices на дату последнего учтённого дня
+        (иначе история была переписана и окно нужно строить заново)"""
+        if self.last_date == np.iinfo(np.int64).min:
+            return True
+        history = prices.reindex(columns=self.tickers)
+        history = history[history.index <= pd.Timestamp(np.datetime64(int(self.last_date), 'D'))]
+        stored = history.ffill().iloc[-1].to_numpy(dtype=np.float64) if len(history) else np.full(len(self.tickers), np.nan)
+        return bool(np.all((stored == self.last_price) | (np.isnan(stored) & np.isnan(self.last_price))))
+
+
+    def save(self, path=RISK_STATE_PATH):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, tickers=np.array(self.tickers, dtype=str), window=self.window,
+                 **{name: getattr(self, name) for name in self._arrays})
+        os.replace(tmp_path, path)
+
+
+    @classmethod
+    def load(cls, path=RISK_STATE_PATH):
+        with np.load(path) as data:
+            state = cls(data['tickers'].tolist(), int(data['window']), data['returns'].dtype)
+            for name in cls._arrays:
+                setattr(state, name, data[name])
+        state._rebuild()
+        return state
+
+
+def compute_risk(prices, path=None, window=RISK_WINDOW, dtype=np.float32):
+    """Состояние риска на последнюю дату prices. Если задан path, сохранённое окно дополняется только новыми
+    днями (при смене параметров или переписанной истории окно строится заново). Как и compute_state, сохраняется
+    состояние без последней даты - незавершённая дневная свеча может быть перезаписана"""
+    state = None
+    if path and os.path.exists(path):
+        state = RiskState.load(path)
+        if state.window != window or state.dtype != np.dtype(dtype):
+            state = None
+        else:
+            state = state.reindex(prices.columns)
+            state = state if state.matches(prices) else None
+    if state is None:
+        state = RiskState(prices.columns, window, dtype)
+
+    if path and len(prices.index):
+        state.update_many(prices[prices.index < prices.index[-1]])
+        state.save(path)
+    state.update_many(prices)
+    return state
+
+
+def portfolio_volatility(cov, weights, periods=TRADING_DAYS):
+    """Годовая волатильность портфеля: sqrt(wᵀΣw × periods)"""
+    weights = pd.Series(weights).reindex(cov.index).fillna(0).to_numpy(dtype=np.float64)
+    sigma = cov.to_numpy(dtype=np.float64)
+    return float(np.sqrt(max(weights @ sigma @ weights, 0.0) * periods))
+
+
+def correlation_clusters(corr, threshold=CLUSTER_THRESHOLD):
+    """Кластеры сильно связанных тикеров: иерархическая кластеризация (средняя связь) по расстоянию 1 - корреляция,
+    в один кластер попадают группы со средней корреляцией не ниже threshold. Возвращает номер кластера тикера"""
+    if len(corr) < 2:
+        return pd.Series(np.ones(len(corr), dtype=int), index=corr.index)
+    distance = 1 - np.nan_to_num(corr.to_numpy(dtype=np.float64), nan=0.0)
+    distance = (distance + distance.T) / 2
+    np.fill_diagonal(distance, 0)
+    tree = linkage(squareform(np.clip(distance, 0, 2), checks=False), method='average')
+    return pd.Series(fcluster(tree, t=1 - threshold, criterion='distance'), index=corr.index)
+
+
+def max_diversification_weights(cov):
+    """Веса без коротких позиций, максимизирующие коэффициент диверсификации wᵀσ / sqrt(wᵀΣw).
+    Решается эквивалентная задача min vᵀΣv при vᵀσ = 1, v ≥ 0, затем w = v / Σv"""
+    sigma = cov.to_numpy(dtype=np.float64)
+    n = len(sigma)
+    if n == 0:
+        return pd.Series(dtype=float)
+    std = np.sqrt(np.diag(sigma))
+    result = minimize(lambda v: v @ sigma @ v, np.full(n, 1 / std.sum()), jac=lambda v: 2 * sigma @ v,
+                      bounds=[(0, None)] * n, constraints=[{'type': 'eq', 'fun': lambda v: v @ std - 1, 'jac': lambda v: std}],
+                      method='SLSQP', options={'maxiter': 500, 'ftol': 1e-12})
+    weights = np.clip(result.x, 0, None)
+    return pd.Series(weights / weights.sum(), index=cov.index)
+
+
+def diversification_ratio(cov, weights):
+    """Отношение средневзвешенной волатильности акций к волатильности портфеля (1 - нет диверсификации)"""
+    weights = pd.Series(weights).reindex(cov.index).fillna(0).to_numpy(dtype=np.float64)
+    sigma = cov.to_numpy(dtype=np.float64)
+    return float(weights @ np.sqrt(np.diag(sigma)) / np.sqrt(weights @ sigma @ weights))
+
+
+def buy_list_risk(state, buy_list, threshold=CLUSTER_THRESHOLD):
+    """Риск списка на покупку: кластеры коррелированных кандидатов и веса максимальной диверсификации.
+    Возвращает таблицу (Акция, Кластер, Вес) и сводку волатильности равновесного и диверсифицированного портфеля"""
+    known = set(state.tickers)
+    tickers = [ticker for ticker in buy_list['Акция'] if ticker in known]
+    if not tickers:
+        return pd.DataFrame(columns=['Акция', 'Кластер', 'Вес']), {}
+    sub = state.take(tickers)
+    cov, corr = sub.covariance(), sub.correlation()
+    weights = max_diversification_weights(cov)
+    equal = pd.Series(1 / len(tickers), index=tickers)
+    table = pd.DataFrame({'Акция': tickers, 'Кластер': correlation_clusters(corr, threshold).to_numpy(),
+                          'Вес': weights.round(4).to_numpy()})
+    summary = {
+        'tickers': len(tickers),
+        'clusters': int(table['Кластер'].nunique()),
+        'equal_volatility': round(portfolio_volatility(cov, equal), 4),
+        'max_div_volatility': round(portfolio_volatility(cov, weights), 4),
+        'equal_diversification': round(diversification_ratio(cov, equal), 4),
+        'max_diversification': round(diversification_ratio(cov, weights), 4),
+    }
+    return table, summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Корреляции и риск списка на покупку')
+    parser.add_argument('--window', type=int, default=RISK_WINDOW)
+    parser.add_argument('--threshold', type=float, default=CLUSTER_THRESHOLD)
+    args = parser.parse_args()
+
+    from analysis import Analysis
+    analysis = Analysis()
+    analysis.recommendations()
+    state = compute_risk(analysis.get_prices(), RISK_STATE_PATH, args.window)
+    table, summary = buy_list_risk(state, analysis.get_buy_list(), args.threshold)
+    print(analysis.get_buy_list().merge(table, on='Акция')[['Акция', 'Score', 'Кластер', 'Вес']])
+    print(summary)
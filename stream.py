@@ -0,0 +1,310 @@
+import argparse
+import asyncio
+import time
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+from t_tech.invest import AsyncClient, LastPriceInstrument
+
+from analysis import Analysis, score_signals
+from candle_store import MARKET_TZ, quotation_to_float
+from config import AnalysisConfig
+from db_update import sync_signals
+from excel_tracker import TRACKER_PATH, read_tracker, update_tracker, write_tracker
+from indicators import compute_state
+from price_store import open_price_store
+
+
+# размер очереди баров между источником и обработчиком (источник ждёт, если обработчик не успевает)
+QUEUE_SIZE = 10000
+# сколько баров обрабатывается за один векторный шаг
+MAX_BATCH = 1000
+# как часто смены сигналов пишутся в БД и журнал (секунды)
+FLUSH_INTERVAL = 5.0
+SIGNAL_NAMES = {'buy': 'Покупка', 'sell': 'Продажа'}
+
+
+class Bar(NamedTuple):
+    """Последняя цена тикера на момент time"""
+    ticker: str
+    time: pd.Timestamp
+    price: float
+
+
+def trading_day(moment):
+    """Торговый день бара: время с часовым поясом переводится во время биржи"""
+    moment = pd.Timestamp(moment)
+    if moment.tzinfo is not None:
+        moment = moment.tz_convert(MARKET_TZ).tz_localize(None)
+    return moment.normalize()
+
+
+class ReplaySource():
+    """Воспроизведение сохранённых цен (даты/время × тикеры) как потока баров.
+    speed - во сколько раз быстрее реального времени (None - без пауз)"""
+    def __init__(self, prices, speed=None):
+        self.prices = prices
+        self.speed = speed
+
+
+    @classmethod
+    def from_price_store(cls, days, speed=None):
+        """Последние days дней хранилища цен"""
+        prices = open_price_store().read()
+        return cls(prices.iloc[-days:], speed)
+
+
+    @classmethod
+    def from_candle_store(cls, store, tickers=None, start=None, end=None, speed=None):
+        """Цены закрытия внутридневных свечей CandleStore в порядке времени"""
+        tickers = store.tickers() if tickers is None else tickers
+        closes = {ticker: store.read(ticker, start, end)['close'] for ticker in tickers}
+        return cls(pd.DataFrame(closes).sort_index(), speed)
+
+
+    async def __aiter__(self):
+        previous = None
+        values = self.prices.to_numpy(dtype=np.float64)
+        tickers = self.prices.columns
+        for moment, row in zip(self.prices.index, values):
+            if self.speed and previous is not None:
+                await asyncio.sleep((moment - previous).total_seconds() / self.speed)
+            previous = moment
+            for i in np.flatnonzero(~np.isnan(row)):
+                yield Bar(tickers[i], moment, row[i])
+
+
+class MarketDataSource():
+    """Поток последних цен из API (подписка last_price на все тикеры в одном соединении)"""
+    def __init__(self, token, figis):
+        # figis - {figi: тикер}
+        self.token = token
+        self.figis = figis
+
+
+    async def __aiter__(self):
+        async with AsyncClient(self.token) as client:
+            stream = client.create_market_data_stream()
+            stream.last_price.subscribe([LastPriceInstrument(figi=figi) for figi in self.figis])
+            try:
+                async for marketdata in stream:
+                    last_price = marketdata.last_price
+                    if last_price is None or last_price.figi not in self.figis:
+                        continue
+                    yield Bar(self.figis[last_price.figi], pd.Timestamp(last_price.time), quotation_to_float(last_price.price))
+            finally:
+                stream.stop()
+
+
+class SignalEngine():
+    """Потоковый расчёт сигналов.
+
+    Состояние индикаторов по закрытым дням берётся из истории цен (compute_state), цена текущего дня
+    обновляется каждым баром. На каждом шаге индикаторы пересчитываются только для тикеров с новыми барами:
+    состояние этих тикеров копируется и дополняется ценой дня, поэтому шаг стоит O(тикеры в шаге × окно).
+    При смене дня цены закрытия предыдущего дня добавляются в состояние. Память не растёт со временем:
+    хранится только состояние индикаторов и цены текущего дня.
+    """
+    def __init__(self, history, features, config=None, signals=None, sinks=()):
+        # history - дневные цены закрытия до начала потока, features - Analysis.get_features()
+        self.config = config if config is not None else AnalysisConfig()
+        cfg = self.config
+        self.features = features[features.index.isin(history.columns)]
+        self.tickers = list(self.features.index)
+        self._rows = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.state = compute_state(history[self.tickers], None, cfg.rsi_window, cfg.z_window, cfg.sr_window)
+        self.day = history.index[-1] if len(history.index) else None
+        self.day_prices = np.full(len(self.tickers), np.nan)
+        # последний сигнал по каждому тикеру ('buy'/'sell'); 'hold' открытый сигнал не закрывает
+        self.current = dict(signals or {})
+        self.last_prices = pd.Series(self.state.last_price.copy(), index=self.tickers)
+        self.sinks = list(sinks)
+        self.pending = []
+        self.stats = {'bars': 0, 'batches': 0, 'transitions': 0}
+
+
+    def on_bars(self, bars):
+        """Обработка пачки баров; возвращает смены сигналов (DataFrame)"""
+        results, dirty = [], set()
+        for bar in bars:
+            row = self._rows.get(bar.ticker)
+            if row is None:
+                continue
+            day = trading_day(bar.time)
+            if self.day is not None and day < self.day:
+                continue
+            if self.day is None or day > self.day:
+                # сигналы прошедшего дня считаются до его закрытия
+                results.append(self._evaluate(dirty))
+                dirty = set()
+                self._close_day(day)
+            self.day_prices[row] = bar.price
+            dirty.add(row)
+        results.append(self._evaluate(dirty))
+        self.stats['bars'] += len(bars)
+        self.stats['batches'] += 1
+        results = [result for result in results if len(result)]
+        return pd.concat(results, ignore_index=True) if results else pd.DataFrame()
+
+
+    def _close_day(self, day):
+        """Переход на новый день: цены закрытия прошедшего дня добавляются в состояние индикаторов"""
+        if self.day is not None and not np.isnan(self.day_prices).all():
+            self.state.update(self.day, self.day_prices)
+        self.day = day
+        self.day_prices = np.full(len(self.tickers), np.nan)
+
+
+    def _evaluate(self, dirty):
+        """Сигналы тикеров с новыми барами по цене текущего дня"""
+        if not dirty:
+            return pd.DataFrame()
+        rows = np.array(sorted(dirty), dtype=np.int64)
+        cfg = self.config
+        state = self.state.take(rows)
+        prices = self.day_prices[rows]
+        state.update(self.day, prices)
+
+        rsi = state.rsi().to_numpy()
+        z = state.z_score().to_numpy()
+        support = state.support_resistance()[0].to_numpy()
+        score, buy, sell = score_signals(self.features.iloc[rows], prices, rsi, z, support, cfg)
+        active = state.count >= cfg.min_history
+        signal = np.select([buy & active, sell & active], ['buy', 'sell'], 'hold')
+        self.last_prices.iloc[rows] = prices
+
+        # смена сигнала - новый buy/sell, отличный от последнего по тикеру
+        changed = [i for i, (row, value) in enumerate(zip(rows, signal))
+                   if value != 'hold' and self.current.get(self.tickers[row]) != value]
+        if not changed:
+            return pd.DataFrame()
+        transitions = pd.DataFrame({
+            'Акция': [self.tickers[rows[i]] for i in changed],
+            'Сигнал': signal[changed],
+            'Актуальная цена': prices[changed].round(2),
+            'Score': score[changed].round(2),
+            'RSI': rsi[changed].round(2),
+            'Z-Score': z[changed].round(2),
+            'Дата': self.day,
+        })
+        for ticker, value in zip(transitions['Акция'], transitions['Сигнал']):
+            self.current[ticker] = value
+        self.pending.append(transitions)
+        self.stats['transitions'] += len(transitions)
+        return transitions
+
+
+    async def flush(self):
+        """Передача накопленных смен сигналов приёмникам (БД, журнал)"""
+        if not self.pending:
+            return
+        transitions = pd.concat(self.pending, ignore_index=True)
+        self.pending = []
+        # если тикер сменил сигнал несколько раз, смены передаются по очереди (в каждой порции тикер один раз)
+        rounds = transitions.groupby('Акция').cumcount()
+        for _, part in transitions.groupby(rounds):
+            for sink in self.sinks:
+                await sink.write(part, self.last_prices)
+
+
+    async def run(self, source, flush_interval=FLUSH_INTERVAL, queue_size=QUEUE_SIZE):
+        """Чтение источника в одном цикле asyncio: источник складывает бары в ограниченную очередь,
+        обработчик забирает их пачками и пересчитывает сигналы"""
+        queue = asyncio.Queue(maxsize=queue_size)
+
+        async def produce():
+            try:
+                async for bar in source:
+                    await queue.put(bar)
+            finally:
+                await queue.put(None)
+
+        producer = asyncio.create_task(produce())
+        last_flush = time.monotonic()
+        finished = False
+        try:
+            while not finished:
+                bars = [await queue.get()]
+                while len(bars) < MAX_BATCH and not queue.empty():
+                    bars.append(queue.get_nowait())
+                if bars[-1] is None:
+                    bars.pop()
+                    finished = True
+                transitions = self.on_bars(bars)
+                if len(transitions):
+                    for day, ticker, signal, price in transitions[['Дата', 'Акция', 'Сигнал', 'Актуальная цена']].to_numpy():
+                        print(f'{day:%Y-%m-%d} {ticker}: {signal} по {price}')
+                if time.monotonic() - last_flush >= flush_interval:
+                    await self.flush()
+                    last_flush = time.monotonic()
+        finally:
+            producer.cancel()
+            await self.flush()
+        return self.stats
+
+
+class DbSink():
+    """Запись смен сигналов в таблицы signals/history (в отдельном потоке, чтобы не блокировать цикл)"""
+    def __init__(self, db_pool):
+        self.db_pool = db_pool
+
+
+    async def write(self, transitions, last_prices):
+        await asyncio.to_thread(self.db_pool.run, sync_signals, transitions)
+
+
+class TrackerSink():
+    """Обновление журнала stock_tracker.xlsx сменами сигналов"""
+    def __init__(self, path=TRACKER_PATH):
+        self.path = path
+
+
+    async def write(self, transitions, last_prices):
+        await asyncio.to_thread(self._write, transitions, last_prices)
+
+
+    def _write(self, transitions, last_prices):
+        signals = transitions[['Акция', 'Актуальная цена']].assign(Сигнал=transitions['Сигнал'].map(SIGNAL_NAMES))
+        recommendations, history = read_tracker(self.path)
+        recommendations, history = update_tracker(recommendations, history, signals, last_prices)
+        write_tracker(self.path, recommendations, history)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Потоковый расчёт сигналов')
+    parser.add_argument('--replay', type=int, default=None, help='воспроизвести последние N дней хранилища цен')
+    parser.add_argument('--speed', type=float, default=None, help='ускорение воспроизведения')
+    parser.add_argument('--no-sinks', action='store_true', help='не записывать сигналы в БД и журнал')
+    args = parser.parse_args()
+
+    from db_config import DB_POOL
+    from db_analytics import create_analytics_tables
+    from tokens_and_passwords import get_t_bankAPI_token, get_db_connection
+    from data import MyClient
+
+    analysis = Analysis()
+    prices = analysis.get_prices()
+    if args.replay:
+        history, source = prices.iloc[:-args.replay], ReplaySource(prices.iloc[-args.replay:], args.speed)
+    else:
+        # поток начинается с сегодняшнего дня: состояние индикаторов - по закрытым дням
+        history = prices[prices.index < pd.Timestamp.now().normalize()]
+        client = MyClient(get_t_bankAPI_token())
+        source = MarketDataSource(client.token, {values['figi']: ticker for ticker, values in client.tickers_TQBR_nocval.items()})
+
+    sinks, db_pool, signals = [], None, None
+    if not args.no_sinks:
+        db_pool = DB_POOL(*get_db_connection()[:3])
+        sinks = [DbSink(db_pool), TrackerSink()]
+        # агрегаты signal_performance дополняются при каждой записи смен сигналов
+        db_pool.run(create_analytics_tables)
+        # открытые сигналы из БД: повтор того же сигнала сменой не считается
+        table_of_signals = db_pool.run(lambda db: pd.read_sql_query("""SELECT ticker_name, signal FROM signals""", db.conn))
+        signals = dict(zip(table_of_signals['ticker_name'], table_of_signals['signal']))
+    engine = SignalEngine(history, analysis.get_features(), analysis.config, signals=signals, sinks=sinks)
+    try:
+        print(asyncio.run(engine.run(source)))
+    finally:
+        if db_pool is not None:
+            db_pool.close()
@@ -0,0 +1,141 @@
+import argparse
+import itertools
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from backtest import Backtest
+from config import AnalysisConfig
+from price_store import open_price_store
+
+
+# пространство перебора по умолчанию (поле AnalysisConfig: варианты значений)
+SEARCH_SPACE = {
+    'roe_min': [0, 3, 5],
+    'pe_max': [20, 30, 40],
+    'volatility_max': [0.3, 0.4, 0.5],
+    'rsi_window': [10, 14, 21],
+    'z_window': [40, 60, 90],
+    'rsi_levels': [(25, 35, 45), (30, 40, 50), (35, 45, 55)],
+    'support_margin': [1.02, 1.05, 1.1],
+    'buy_score': [5, 5.5, 6, 6.5],
+    'buy_rsi': [45, 50, 55],
+    'sell_rsi': [65, 70, 75],
+    'sell_z': [1.5, 2, 2.5],
+}
+SWEEP_RESULTS_PATH = 'sweep_results.csv'
+
+
+class SharedPrices():
+    """Матрица цен в разделяемой памяти: процессы-исполнители читают её без копирования через pickle"""
+    def __init__(self, prices):
+        values = prices.to_numpy(dtype=np.float64)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        np.ndarray(values.shape, dtype=np.float64, buffer=self.shm.buf)[:] = values
+        # всё, что нужно процессу для подключения: имя блока, форма матрицы, даты и тикеры
+        self.spec = (self.shm.name, values.shape, prices.index, prices.columns)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def attach_prices(spec):
+    """Подключение к матрице цен в разделяемой памяти (возвращает блок памяти - его нужно держать открытым)"""
+    name, shape, index, columns = spec
+    shm = shared_memory.SharedMemory(name=name)
+    values = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    return shm, pd.DataFrame(values, index=index, columns=columns, copy=False)
+
+
+def config_grid(grid, base=None):
+    """Все сочетания значений из словаря {поле AnalysisConfig: [значения]}"""
+    base = base if base is not None else AnalysisConfig()
+    keys = list(grid)
+    return [base.replace(**dict(zip(keys, values))) for values in itertools.product(*(grid[key] for key in keys))]
+
+
+def config_sample(space, n, base=None, seed=42):
+    """Случайная выборка n различных сочетаний из пространства {поле AnalysisConfig: [значения]}"""
+    base = base if base is not None else AnalysisConfig()
+    total = int(np.prod([len(values) for values in space.values()]))
+    rng = random.Random(seed)
+    configs = {}
+    while len(configs) < min(n, total):
+        config = base.replace(**{key: rng.choice(values) for key, values in space.items()})
+        configs.setdefault(config, None)
+    return list(configs)
+
+
+def run_sweep(prices, fundamentals, configs, processes=None, output=None):
+    """Прогон вариантов настроек через Backtest на всех ядрах. Возвращает таблицу: поля настроек + показатели.
+
+    Матрица цен передаётся процессам через разделяемую память. Варианты группируются по настройкам отбора
+    акций, чтобы процесс пересчитывал отбор акций на каждую дату только при их смене.
+    """
+    configs = list(configs)
+    processes = processes or os.cpu_count() or 1
+    # сортировка по ключу отбора: соседние варианты в одной порции переиспользуют отбор акций
+    order = sorted(range(len(configs)), key=lambda i: (repr(configs[i].filter_key()), i))
+    ordered = [configs[i] for i in order]
+    print(f'Перебор настроек: {len(configs)} вариантов, процессов: {processes}')
+
+    if processes > 1 and len(configs) > 1:
+        with SharedPrices(prices) as shared:
+            with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                     initargs=(shared.spec, fundamentals)) as pool:
+                summaries = list(pool.map(_evaluate, ordered, chunksize=max(1, len(ordered) // (processes * 4))))
+    else:
+        _worker.update(backtest=Backtest(prices, fundamentals))
+        summaries = [_evaluate(config) for config in ordered]
+
+    results = [None] * len(configs)
+    for i, config, summary in zip(order, ordered, summaries):
+        results[i] = {**config.to_dict(), **summary}
+    results = pd.DataFrame(results)
+    if output:
+        results.to_csv(output, index=False)
+        print(f'Результаты перебора сохранены в {output}')
+    return results
+
+
+# состояние процесса-исполнителя: цены из разделяемой памяти и Backtest по ним
+# (индикаторы и отбор акций Backtest кэширует сам)
+_worker = {}
+
+
+def _init_worker(spec, fundamentals):
+    shm, prices = attach_prices(spec)
+    _worker.update(shm=shm, backtest=Backtest(prices, fundamentals))
+
+
+def _evaluate(config):
+    return _worker['backtest'].summary(config)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Перебор настроек Analysis на истории цен')
+    parser.add_argument('--samples', type=int, default=200, help='число случайных вариантов из SEARCH_SPACE')
+    parser.add_argument('--grid', action='store_true', help='перебрать все сочетания SEARCH_SPACE')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--output', default=SWEEP_RESULTS_PATH)
+    args = parser.parse_args()
+
+    prices = open_price_store().read()
+    fundamentals = pd.read_csv('fundamentals.csv', index_col=0).T
+    configs = config_grid(SEARCH_SPACE) if args.grid else config_sample(SEARCH_SPACE, args.samples)
+    results = run_sweep(prices, fundamentals, configs, args.processes, args.output)
+    print(results.sort_values('hit_rate', ascending=False).head(10).to_string())